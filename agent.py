@@ -1,214 +1,135 @@
 # 2. agent.py
+# Command line entry point. The agent itself lives in sql_agent.py and is only
+# imported when needed, so --help, argument errors and calls forwarded to a
+# running daemon (--serve) do not pay for importing langchain/langgraph.
 
-from typing import List, Tuple, Dict, Any, TypedDict, Annotated
-from langgraph.graph import StateGraph, END
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain_ollama import ChatOllama
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.tools import Tool
-from langchain.agents import AgentExecutor
-from langchain.agents.react.agent import create_react_agent
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
-import sqlite3
-
-class SQLiteTools:
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-        
-    def execute_query(self, query: str) -> List[Tuple]:
-        """
-        Function to execute SQL queries
-        """
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-                cursor.execute(query)
-                return cursor.fetchall()
-        except Exception as e:
-            return f"Error execute_query occurred: {str(e)}"
-            
-    def get_table_schema(self, *args) -> Dict[str, List[str]]:  
-        """Get schema information for all tables"""
-        try:
-            with sqlite3.connect(self.db_path) as conn:
-                cursor = conn.cursor()
-
-                cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-                tables = cursor.fetchall()
-                
-                schema = {}
-                for table in tables:
-                    table_name = table[0]
-
-                    cursor.execute(f"PRAGMA table_info({table_name})")
-                    columns = cursor.fetchall()
-
-                    schema[table_name] = [
-                        {
-                            "name": col[1],
-                            "type": col[2],
-                            "notnull": col[3],
-                            "pk": col[5]
-                        } for col in columns
-                    ]
-                return schema
-        except Exception as e:
-            return f"Error get_table_schema occurred: {str(e)}"
-
-class AgentState(TypedDict):
-    input: str
-    output: Any
-    messages: List[Any]
-
-class SQLiteAgent:
-    def __init__(self, db_path: str, model_name: str = "deepseek-r1:8b"):
-        self.db_tools = SQLiteTools(db_path)
-        
-        self.llm = ChatOllama(
-            model=model_name,
-            temperature=0,  # ความแปรปรวนในการสร้างข้อความ ใช้ 0 สำหรับความแม่นยำสูงสุด
-            callbacks=[StreamingStdOutCallbackHandler()],
-            base_url="http://localhost:11434",
-            streaming=True
-        )
-        
-        self.tools = [
-            Tool(
-              name="execute_query",
-              func=self.db_tools.execute_query,
-              description="Execute a SQL query. Input should be a valid SQL query string."
-            ),
-            Tool(
-                name="get_schema",
-                func=self.db_tools.get_table_schema,
-                description="Get the database schema. No input needed."
-            )
-        ]
-        
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are a SQL database assistant. Follow the format below EXACTLY, including EXACT spacing and punctuation:
-
-            Thought: [your reasoning]
-            Action: [tool name]
-            Action Input: [tool input]
-            Observation: [tool output]
-            ... (this Thought/Action/Action Input/Observation can repeat if needed)
-            Thought: [your conclusion]
-            Final Answer: [your response]
-
-            Available tools:
-            {tool_names}
-
-            {tools}
-
-            Remember:
-            1. ALWAYS start with "Thought:"
-            2. ALWAYS include "Action:" after "Thought:"
-            3. ALWAYS follow the exact format above
-            4. NEVER include multiple actions without observations between them
-            5. NEVER skip steps in the format"""),
-                    ("human", "{input}"),
-                    ("ai", "{agent_scratchpad}")
-        ])
-          
-        self.agent = create_react_agent(
-            llm=self.llm,
-            tools=self.tools,
-            prompt=self.prompt
-        )
-        
-        self.agent_executor = AgentExecutor(
-            agent=self.agent,
-            tools=self.tools,
-            verbose=True,
-            return_intermediate_steps=True,  # สำหรับการแสดงข้อความระหว่างการทำงาน
-            handle_parsing_errors=True,  # จัดการข้อผิดพลาดในการแปลงข้อความ
-            max_iterations=5  # จำกัดจำนวนรอบการทำงาน (เพื่อป้องกันการวนลูป)
-        )
-
-    def run(self, query: str) -> Any:
-        """
-        Run Agent to process queries
-        """
-        try:
-          def process_agent(state: Dict) -> Dict:
-              # Call agent executor
-              result = self.agent_executor.invoke({
-                  "input": state["input"],
-                  "agent_scratchpad": state.get("messages", [])
-              })
-              
-              # Create messages
-              messages = []
-              if "intermediate_steps" in result:
-                  for step in result["intermediate_steps"]:
-                      action, output = step
-                      messages.extend([
-                          AIMessage(content=str(action)),
-                          HumanMessage(content=str(output))
-                      ])
-              
-              # Update state
-              return {
-                  "input": state["input"],
-                  "output": result.get("output", ""),
-                  "messages": messages
-              }
-          
-          workflow = StateGraph(state_schema=AgentState)
-          
-          workflow.add_node("agent", process_agent)
-          
-          workflow.set_entry_point("agent")
-          
-          workflow.add_edge("agent", END)
-          
-          app = workflow.compile()
-          
-          # Create initial state
-          initial_state = {
-              "input": query,
-              "output": None,
-              "messages": []
-          }
-          
-          # Run workflow
-          result = app.invoke(initial_state)
-          
-          # Get results
-          return result["output"]
-        except ValueError as e:
-            if "Could not parse LLM output" in str(e):
-                return f"Error: The model response could not be parsed. Original query: {query}"
-            raise
-        except Exception as e:
-            return f"An error occurred: {str(e)}"
+import json
+import os
+import socket
+import sys
+import tempfile
+from typing import Any, Dict, Optional
+
+DEFAULT_SOCKET = os.environ.get(
+    "AGENT_SOCKET", os.path.join(tempfile.gettempdir(), f"sqlite-agent-{os.getuid()}.sock")
+)
+
+def __getattr__(name: str) -> Any:
+    # from agent import SQLiteAgent ฯลฯ ยังใช้ได้เหมือนเดิม แต่โหลด stack หนักตอนเรียกใช้ครั้งแรก
+    import sql_agent
+    try:
+        return getattr(sql_agent, name)
+    except AttributeError:
+        raise AttributeError(f"module 'agent' has no attribute {name!r}") from None
+
+def run_via_daemon(request: Dict[str, Any], socket_path: str = DEFAULT_SOCKET,
+                   stream: bool = True) -> Optional[str]:
+    """
+    Send one query to a running `agent.py --serve` daemon and return the final
+    output, printing tokens as they arrive. Returns None when no daemon is listening.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+
+    with sock:
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode())
+        with sock.makefile(encoding="utf-8") as lines:
+            for line in lines:
+                event = json.loads(line)
+                if event["event"] == "token" and stream:
+                    sys.stdout.write(event["data"]["token"])
+                    sys.stdout.flush()
+                elif event["event"] == "final":
+                    return event["data"]["output"]
+                elif event["event"] == "error":
+                    raise RuntimeError(event["data"]["detail"])
+    raise RuntimeError("Agent daemon closed the connection without a result")
 
 # Usage example
 # Command line interface
 if __name__ == "__main__":
     import argparse
-    import sys
-    
+
     # สร้าง argument parser
     parser = argparse.ArgumentParser(description='SQLite AI Assistant')
     parser.add_argument('--db', type=str, default="products.db", help='Database file path')
     parser.add_argument('--model', type=str, default="deepseek-r1:8b", help='Ollama model name')
-    parser.add_argument('prompt', type=str, nargs='+', help='Natural language prompt')
-    
+    parser.add_argument('--batch-in', type=str, help='JSONL file of queries ({"query": ...} or a JSON string per line)')
+    parser.add_argument('--batch-out', type=str, help='JSONL file to write batch results to (default: stdout)')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent queries in batch mode')
+    parser.add_argument('--mode', type=str, choices=['react', 'tools'], default="react",
+                        help='react = text-parsed ReAct, tools = native tool calling')
+    parser.add_argument('--serve', action='store_true', help='Run as a daemon keeping warmed agents on a Unix socket')
+    parser.add_argument('--socket', type=str, default=DEFAULT_SOCKET, help='Unix socket path for --serve and the client')
+    parser.add_argument('--no-daemon', action='store_true', help='Always run in-process, even if a daemon is running')
+    parser.add_argument('--session', type=str, help='Session id; follow-up prompts with the same id see earlier turns')
+    parser.add_argument('prompt', type=str, nargs='*', help='Natural language prompt')
+
     # Parse arguments
     args = parser.parse_args()
-    
-    # สร้าง Agent
-    agent = SQLiteAgent(args.db, model_name=args.model)
-    
+    if not args.prompt and not args.batch_in and not args.serve:
+        parser.error("a prompt, --batch-in or --serve is required")
+
+    if args.serve:
+        import asyncio
+        from sql_agent import serve
+        try:
+            asyncio.run(serve(args.socket, default_db_path=args.db, default_model_name=args.model))
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            pass
+        except RuntimeError as e:
+            print(f"เกิดข้อผิดพลาด: {str(e)}")
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.batch_in:
+        import asyncio
+        from sql_agent import _read_batch_file, run_batch
+        items = _read_batch_file(args.batch_in)
+        results = asyncio.run(run_batch(items, max_concurrency=args.workers,
+                                        default_db_path=args.db, default_model_name=args.model,
+                                        default_mode=args.mode))
+        out = open(args.batch_out, "w", encoding="utf-8") if args.batch_out else sys.stdout
+        try:
+            for item, result in zip(items, results):
+                out.write(json.dumps({"query": item["query"], **result}, ensure_ascii=False) + "\n")
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        sys.exit(0)
+
+    # รวมคำสั่งเป็น string เดียว
+    prompt = ' '.join(args.prompt)
+
+    if not args.no_daemon:
+        # ถ้ามี daemon รันอยู่ ส่งต่อไปเลย ไม่ต้อง import langchain
+        try:
+            # daemon อาจรันอยู่คนละ directory ส่ง path เต็มไป
+            result = run_via_daemon({"query": prompt, "db_path": os.path.abspath(args.db), "model_name": args.model,
+                                     "mode": args.mode, "session_id": args.session}, args.socket)
+        except Exception as e:
+            print(f"เกิดข้อผิดพลาด: {str(e)}")
+            sys.exit(1)
+        if result is not None:
+            print()
+            print(result)
+            sys.exit(0)
+
+    from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
+    from sql_agent import get_agent
+
+    # Same pooled agent (cache, fast path, schema digest) the daemon would use
+    agent = get_agent(args.db, args.model)
+
     try:
-        # รวมคำสั่งเป็น string เดียว
-        prompt = ' '.join(args.prompt)
-        
         # ส่งคำสั่งไปให้ agent
-        result = agent.run(prompt)
+        result = agent.run(prompt, callbacks=[StreamingStdOutCallbackHandler()], mode=args.mode,
+                           session_id=args.session)
         print(result)
-            
+
     except Exception as e:
-        print(f"เกิดข้อผิดพลาด: {str(e)}")
\ No newline at end of file
+        print(f"เกิดข้อผิดพลาด: {str(e)}")
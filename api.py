@@ -1,24 +1,123 @@
 # api.py
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
 import asyncio
-from typing import Optional
+import json
+import logging
+import os
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, Dict, List, Literal, Optional
 
 import uvicorn
 
-from agent import SQLiteAgent
+from agent import (OLLAMA_KEEP_ALIVE, REACT_SYSTEM_PROMPT, TOOL_CALLING_PROMPT, get_agent, plan_batch,
+                   run_batch, warm_up)
+from backends import backend_pool
+from cache import query_cache
+from metrics import TracingCallbackHandler, registry
+from router import router_stats
+
+logger = logging.getLogger(__name__)
 
 class QueryRequest(BaseModel):
     query: str
     model_name: Optional[str] = "deepseek-r1:8b"
     db_path: Optional[str] = "products.db"
+    agent_mode: Literal["react", "tools"] = os.environ.get("AGENT_MODE", "react")
+    trace: bool = False
+    session_id: Optional[str] = None  # follow-up questions see a compacted history of earlier turns
 
 class QueryResponse(BaseModel):
     result: str
     error: Optional[str] = None
+    trace: Optional[Dict[str, Any]] = None
+
+class SessionRequest(BaseModel):
+    model_name: Optional[str] = "deepseek-r1:8b"
+    db_path: Optional[str] = "products.db"
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+    max_concurrency: Optional[int] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
+    unique_queries: int
+
+class ConcurrencyLimiter:
+    """
+    Cap the number of queries running at once. Extra requests wait in a
+    bounded queue; a full queue returns 429 and a wait that exceeds
+    queue_timeout returns 503.
+    """
+    def __init__(self, max_concurrent: int, max_queued: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._inflight = 0
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    @property
+    def waiting(self) -> int:
+        return max(self._inflight - self.max_concurrent, 0)
+
+    @asynccontextmanager
+    async def slot(self):
+        # Count running and queued requests together so the check is not racy
+        if self._inflight >= self.max_concurrent + self.max_queued:
+            raise HTTPException(status_code=429, detail="Too many queued queries, try again later")
+
+        self._inflight += 1
+        try:
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Server busy, query timed out waiting in queue",
+                    headers={"Retry-After": str(int(self.queue_timeout))}
+                )
+            try:
+                yield
+            finally:
+                self._semaphore.release()
+        finally:
+            self._inflight -= 1
+
+limiter = ConcurrencyLimiter(
+    max_concurrent=int(os.environ.get("MAX_CONCURRENT_QUERIES", "4")),
+    max_queued=int(os.environ.get("MAX_QUEUED_QUERIES", "32")),
+    queue_timeout=float(os.environ.get("QUEUE_TIMEOUT", "30"))
+)
+
+# Models to load into Ollama at startup (comma separated, empty = no warm-up)
+WARMUP_MODELS = [m.strip() for m in os.environ.get("WARMUP_MODELS", "deepseek-r1:8b").split(",") if m.strip()]
+WARMUP_SECONDS = registry.gauge("agent_model_warmup_seconds", "Model load time at startup, -1 on failure", ["model"])
+
+async def _warm_up_models():
+    prefix = TOOL_CALLING_PROMPT if os.environ.get("AGENT_MODE") == "tools" else REACT_SYSTEM_PROMPT
+    results = await asyncio.to_thread(warm_up, WARMUP_MODELS, keep_alive=OLLAMA_KEEP_ALIVE, prefix=prefix)
+    for model, seconds in results.items():
+        if isinstance(seconds, str):
+            logger.warning("warm-up %s failed: %s", model, seconds)
+            seconds = -1
+        WARMUP_SECONDS.set(seconds, model=model)
 
-app = FastAPI(title="SQLite AI Assistant")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # โหลด model ไว้ก่อน request แรก ไม่บล็อกการ start server
+    task = asyncio.create_task(_warm_up_models()) if WARMUP_MODELS else None
+    yield
+    if task is not None and not task.done():
+        task.cancel()
+
+app = FastAPI(title="SQLite AI Assistant", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,12 +129,101 @@ app.add_middleware(
 
 @app.post("/query", response_model=QueryResponse)
 async def process_query(request: QueryRequest):
-    try:
-        agent = SQLiteAgent(request.db_path, model_name=request.model_name)
-        result = agent.run(request.query)
-        return QueryResponse(result=str(result))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    async with limiter.slot():
+        try:
+            agent = await asyncio.to_thread(get_agent, request.db_path, request.model_name)
+            tracer = TracingCallbackHandler()
+            result = await agent.arun(request.query, tracer=tracer, mode=request.agent_mode,
+                                      session_id=request.session_id)
+            return QueryResponse(result=str(result), trace=tracer.trace() if request.trace else None)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "4"))
+BATCH_MAX_QUERIES = int(os.environ.get("BATCH_MAX_QUERIES", "100"))
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+async def process_query_batch(request: BatchQueryRequest):
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+    # Every agent run takes its own limiter slot, so batches count against MAX_CONCURRENT_QUERIES
+    # like single queries; a run that cannot get one comes back with the 429/503 as its error
+    max_concurrency = min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    items = [{**item.model_dump(), "mode": item.agent_mode} for item in request.queries]
+    results = await run_batch(items, max_concurrency=max_concurrency, slot=limiter.slot)
+    return BatchQueryResponse(
+        results=[QueryResponse(**result) for result in results],
+        unique_queries=len(plan_batch(items)[1])
+    )
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return query_cache.stats()
+
+@app.get("/router/stats")
+async def fast_path_stats():
+    """Fast-path decisions by intent and the share of questions answered without the LLM"""
+    return router_stats()
+
+@app.delete("/cache")
+async def clear_cache():
+    query_cache.clear()
+    return {"cleared": True}
+
+@app.delete("/sessions/{session_id}")
+async def end_session(session_id: str, request: Optional[SessionRequest] = None,
+                      db_path: Optional[str] = None, model_name: Optional[str] = None):
+    """End a session on the database it was used with: query parameters or the same fields as /query"""
+    request = request or SessionRequest()
+    agent = await asyncio.to_thread(get_agent, db_path or request.db_path or "products.db",
+                                    model_name or request.model_name or "deepseek-r1:8b")
+    await asyncio.to_thread(agent.end_session, session_id)
+    return {"ended": session_id}
+
+@app.get("/backends")
+async def backends():
+    """Health and load of every LLM backend in OLLAMA_BACKENDS"""
+    return backend_pool.stats()
+
+CACHE_EVENTS = registry.gauge("agent_query_cache_events", "Answer cache counters", ["event"])
+CACHE_ENTRIES = registry.gauge("agent_query_cache_entries", "Entries in the answer cache")
+INFLIGHT = registry.gauge("agent_inflight_queries", "Queries running or queued in the limiter")
+ROUTER_HIT_RATE = registry.gauge("agent_router_hit_rate", "Share of questions answered by the fast path")
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    stats = query_cache.stats()
+    for event in ("answer_hits", "sql_hits", "misses", "evictions", "expirations"):
+        CACHE_EVENTS.set(stats[event], event=event)
+    CACHE_ENTRIES.set(stats["entries"])
+    INFLIGHT.set(limiter.inflight)
+    ROUTER_HIT_RATE.set(router_stats()["hit_rate"])
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+def _sse(event: dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+@app.post("/query/stream")
+async def process_query_stream(request: QueryRequest):
+    # Take the slot before the response starts so 429/503 still reach the client
+    stack = AsyncExitStack()
+    await stack.enter_async_context(limiter.slot())
+
+    async def event_stream():
+        async with stack:
+            try:
+                agent = await asyncio.to_thread(get_agent, request.db_path, request.model_name)
+                async for event in agent.astream(request.query, mode=request.agent_mode,
+                                                 session_id=request.session_id):
+                    yield _sse(event)
+            except Exception as e:
+                yield _sse({"event": "error", "data": {"detail": str(e)}})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 def run_fastapi():
     uvicorn.run(app, host="0.0.0.0", port=8000)
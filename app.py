@@ -1,7 +1,160 @@
 # app.py
-import streamlit as st
+import ast
 import json
-from agent import SQLiteAgent
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+from langchain_core.callbacks import BaseCallbackHandler
+
+from agent import get_agent
+from db import SEARCH_COLUMNS
+
+HISTORY_LIMIT = int(os.environ.get("APP_HISTORY_LIMIT", "50"))
+APP_WORKERS = int(os.environ.get("APP_WORKERS", "8"))
+POLL_SECONDS = float(os.environ.get("APP_POLL_SECONDS", "0.2"))
+PAGE_SIZES = [25, 50, 100]
+
+@st.cache_resource(show_spinner=False)
+def load_executor() -> ThreadPoolExecutor:
+    """Shared worker threads so queries never run on a session's script thread"""
+    return ThreadPoolExecutor(max_workers=APP_WORKERS, thread_name_prefix="app-query")
+
+class RunHandler(BaseCallbackHandler):
+    """Collects streamed tokens and the last tool result while the query runs in the background"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: List[str] = []
+        self.tool_name: Optional[str] = None
+        self.tool_input: Optional[str] = None
+        self.tool_output: Any = None
+        self.tool_columns: Optional[List[str]] = None
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        with self._lock:
+            self._tokens.append(token)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        self.tool_name = (serialized or {}).get("name") or kwargs.get("name")
+        self.tool_input = input_str
+        self.tool_columns = None
+
+    def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        # tool-calling mode ส่ง ToolMessage มา เนื้อหาเป็น string ของผลลัพธ์ ชื่อคอลัมน์อยู่ใน artifact
+        self.tool_output = getattr(output, "content", output)
+        self.tool_columns = getattr(output, "artifact", None) or getattr(output, "columns", None)
+
+    def text(self) -> str:
+        with self._lock:
+            return "".join(self._tokens)
+
+def _parse_rows(output: Any) -> Any:
+    """Tool output as Python data; tool-calling mode sends JSON, ReAct observations are Python reprs"""
+    if not isinstance(output, str):
+        return output
+    try:
+        return json.loads(output)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(output)
+    except (ValueError, SyntaxError):
+        return None
+
+def _default_columns(width: int) -> List[str]:
+    return [f"col_{i + 1}" for i in range(width)]
+
+def _to_table(handler: RunHandler, output: Any) -> Optional[Dict[str, Any]]:
+    """
+    The last tool result as {"columns", "rows"} when it is tabular, otherwise None.
+    Column names come from the tool result itself, the SQL is never run again here.
+    Fast-path and cached answers have no tool call, their output is the rows themselves.
+    """
+    result = _parse_rows(handler.tool_output if handler.tool_name else output)
+    if isinstance(result, dict) and isinstance(result.get("rows"), list):
+        # cache ที่ข้อมูลเปลี่ยนแล้วส่งแถวใหม่มาโดยไม่มีชื่อคอลัมน์
+        rows = result["rows"]
+        return {"columns": result.get("columns") or _default_columns(len(rows[0]) if rows else 0), "rows": rows}
+    if isinstance(result, dict) and "preview" in result:
+        # ผลลัพธ์ใหญ่เกิน budget มีแค่ preview แถวแรก ๆ
+        return {"columns": result["columns"], "rows": result["preview"]}
+    if isinstance(result, list) and result and all(isinstance(row, (tuple, list)) for row in result):
+        width = len(result[0])
+        if handler.tool_name == "search_products" and width == len(SEARCH_COLUMNS):
+            return {"columns": SEARCH_COLUMNS, "rows": result}
+        columns = handler.tool_columns if handler.tool_name else None
+        return {"columns": columns if columns and len(columns) == width else _default_columns(width), "rows": result}
+    return None
+
+def show_table(table: Dict[str, Any], key: str) -> None:
+    """Render rows one page at a time instead of the whole result"""
+    frame = pd.DataFrame(table["rows"], columns=table["columns"])
+    size_col, page_col = st.columns([1, 3])
+    page_size = size_col.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_size")
+    pages = max(1, -(-len(frame) // page_size))
+    page = page_col.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=f"{key}_page")
+    start = (page - 1) * page_size
+    st.dataframe(frame.iloc[start:start + page_size], use_container_width=True, hide_index=True)
+    st.caption(f"{len(frame):,} rows")
+
+def show_output(output: Any) -> None:
+    # Check if result is JSON
+    try:
+        if isinstance(output, str):
+            st.json(json.loads(output))
+        else:
+            st.write(output)
+    except (ValueError, TypeError):
+        st.write(output)
+
+def show_entry(entry: Dict[str, Any]) -> None:
+    show_output(entry["output"])
+    if entry["table"]:
+        show_table(entry["table"], key=f"table_{entry['id']}")
+
+@st.fragment(run_every=POLL_SECONDS)
+def poll_pending() -> None:
+    """
+    Show tokens of the running query; only this fragment re-runs every POLL_SECONDS,
+    the script thread is never blocked. Once the query finishes it moves to history
+    and the whole page re-runs to show it.
+    """
+    pending = st.session_state.pending
+    if pending is None:
+        return
+    if not pending["future"].done():
+        st.markdown(f"⏳ **{pending['query']}**\n\n{pending['handler'].text()}")
+        return
+    finish_pending(pending)
+    st.rerun()
+
+def finish_pending(pending: Dict[str, Any]) -> None:
+    """Move a finished query to history, or keep its error for the next run"""
+    st.session_state.pending = None
+    try:
+        output = pending["future"].result()
+    except Exception as e:
+        st.session_state.error = f"Error: {str(e)}"
+        return
+
+    entry = {
+        "id": st.session_state.next_id,
+        "query": pending["query"],
+        "output": output,
+        "table": _to_table(pending["handler"], output),
+        "seconds": time.perf_counter() - pending["started"],
+    }
+    st.session_state.next_id += 1
+    history = st.session_state.history
+    history.append(entry)
+    # เก็บแค่ HISTORY_LIMIT รายการล่าสุด session ที่เปิดนาน ๆ จะได้ไม่ช้าลงเรื่อย ๆ
+    del history[:-HISTORY_LIMIT]
+    st.session_state.selected = entry["id"]
 
 def main():
     st.set_page_config(
@@ -11,6 +164,13 @@ def main():
     )
 
     st.title("🤖 SQLite AI Assistant")
+    st.session_state.setdefault("history", [])
+    st.session_state.setdefault("pending", None)
+    st.session_state.setdefault("next_id", 1)
+    st.session_state.setdefault("selected", None)
+    st.session_state.setdefault("error", None)
+    # คำถามต่อเนื่องในหน้าเดียวกันใช้ session เดียวกัน agent จะเห็นคำถามและ SQL ก่อนหน้า
+    st.session_state.setdefault("session_id", uuid.uuid4().hex)
 
     # Sidebar configuration
     with st.sidebar:
@@ -20,12 +180,15 @@ def main():
             ["deepseek-r1:8b"],
             index=0
         )
-        
+
         db_path = st.text_input(
             "Database Path",
             value="products.db"
         )
-        
+
+        if st.button("🆕 New conversation", disabled=st.session_state.pending is not None):
+            st.session_state.session_id = uuid.uuid4().hex
+
         st.markdown("---")
         st.markdown("""
         ### Example Queries:
@@ -36,48 +199,47 @@ def main():
 
     # Main content
     query = st.text_area("Enter your query:", height=100)
-    
-    if st.button("🚀 Execute Query", type="primary"):
+
+    busy = st.session_state.pending is not None
+    if st.button("🚀 Execute Query", type="primary", disabled=busy):
         if query:
-            try:
-                with st.spinner("Processing..."):
-                    # Create agent and process query
-                    agent = SQLiteAgent(db_path, model_name=model_name)
-                    result = agent.run(query)
-                    
-                    # Show results
-                    st.success("Query executed successfully!")
-                    
-                    # Add to history
-                    if 'history' not in st.session_state:
-                        st.session_state.history = []
-                    st.session_state.history.append((query, result))
-                    
-                    # Check if result is JSON
-                    try:
-                        if isinstance(result, str):
-                            json_result = json.loads(result)
-                            st.json(json_result)
-                        else:
-                            st.write(result)
-                    except:
-                        st.write(result)
-                    
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
+            # get_agent เก็บ agent ต่อ (db, model) ไว้ให้ทุก session ของ process อยู่แล้ว
+            agent = get_agent(db_path, model_name)
+            handler = RunHandler()
+            st.session_state.pending = {
+                "query": query,
+                "handler": handler,
+                "started": time.perf_counter(),
+                "future": load_executor().submit(agent.run, query, callbacks=[handler],
+                                                 session_id=st.session_state.session_id),
+            }
         else:
             st.warning("Please enter a query")
 
-    # History section
-    with st.expander("📜 Query History", expanded=False):
-        if 'history' not in st.session_state:
-            st.session_state.history = []
-            
-        # Show query history
-        for idx, (past_query, past_result) in enumerate(st.session_state.history):
-            st.markdown(f"**Query {idx+1}:** {past_query}")
-            st.markdown(f"**Result:** {past_result}")
-            st.markdown("---")
+    # The fragment polls on its own timer; a rerun while the query is running picks it back up
+    if st.session_state.pending is not None:
+        poll_pending()
+    if st.session_state.error is not None:
+        st.error(st.session_state.error)
+        st.session_state.error = None
+
+    history = st.session_state.history
+    latest = next((entry for entry in history if entry["id"] == st.session_state.selected), None)
+    if latest is not None:
+        st.success(f"Query executed successfully! ({latest['seconds']:.1f}s)")
+        show_entry(latest)
+
+    # History section: only the titles are listed, a result is rendered when it is opened
+    with st.expander(f"📜 Query History ({len(history)} of max {HISTORY_LIMIT})", expanded=False):
+        entries = {entry["id"]: entry for entry in reversed(history)}
+        picked = st.selectbox(
+            "Show result of",
+            [None, *entries],
+            format_func=lambda entry_id: "—" if entry_id is None else f"Query {entry_id}: {entries[entry_id]['query'][:80]}",
+            key="history_pick"
+        )
+        if picked is not None and picked != st.session_state.selected:
+            show_entry(entries[picked])
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,364 @@
+# backends.py
+import asyncio
+import json
+import os
+import threading
+import time
+import urllib.request
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Set
+
+import httpx
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_ollama import ChatOllama
+from pydantic import ConfigDict, Field
+
+from metrics import registry
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+
+BACKEND_INFLIGHT = registry.gauge("agent_llm_backend_inflight", "LLM requests running on each backend", ["backend"])
+BACKEND_WAITING = registry.gauge("agent_llm_backend_queue_depth",
+                                 "LLM requests waiting for a free backend slot", ["model"])
+BACKEND_HEALTHY = registry.gauge("agent_llm_backend_healthy", "1 if the backend passed its last health check", ["backend"])
+BACKEND_REQUESTS = registry.counter("agent_llm_backend_requests_total", "LLM requests per backend by outcome",
+                                    ["backend", "outcome"])
+BACKEND_LATENCY = registry.histogram("agent_llm_backend_request_duration_seconds", "LLM request time per backend",
+                                     ["backend"])
+
+class BackendUnavailable(RuntimeError):
+    pass
+
+# ReadTimeout, 5xx หรือ RemoteProtocolError (ต่อติดแล้วแต่ขาดกลางทาง) อาจแปลว่า model ทำงานไปแล้ว
+# ไม่ retry ซ้ำบน backend อื่น
+_CONNECTION_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout)
+
+def _is_connection_error(error: BaseException) -> bool:
+    """Errors worth retrying on another backend: the request never reached the model"""
+    return isinstance(error, _CONNECTION_ERRORS)
+
+class Backend:
+    def __init__(self, url: str, max_concurrency: int):
+        self.url = url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        self.last_used = 0.0
+
+class BackendPool:
+    """
+    Ollama endpoints per model. acquire() hands out the healthy backend with the
+    fewest outstanding requests relative to its concurrency limit and waits when
+    all of them are full. Backends that fail a request or a periodic health check
+    are skipped until they pass a check again.
+    """
+    def __init__(self, models: Dict[str, List[Dict[str, Any]]], default_concurrency: int = 4,
+                 health_interval: float = 10.0, health_timeout: float = 2.0, queue_timeout: float = 300.0,
+                 passthrough: bool = False):
+        self.passthrough = passthrough  # only the implicit OLLAMA_BASE_URL backend, nothing to route
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.queue_timeout = queue_timeout
+        self._backends: Dict[str, Backend] = {}
+        self._models: Dict[str, List[Backend]] = {}
+        self._condition = threading.Condition()
+        self._async_waiters: List[Any] = []
+        self._health_thread: Optional[threading.Thread] = None
+        for model, entries in models.items():
+            pool = []
+            for entry in entries:
+                url = entry["url"].rstrip("/")
+                # GPU box เดียวกันใช้ร่วมกันทุก model limit จึงนับต่อ URL
+                backend = self._backends.setdefault(url, Backend(url, int(entry.get("max_concurrency", default_concurrency))))
+                pool.append(backend)
+                BACKEND_HEALTHY.set(1, backend=url)
+            self._models[model] = pool
+
+    @classmethod
+    def from_env(cls) -> "BackendPool":
+        """
+        OLLAMA_BACKENDS is either a comma separated list of URLs used for every
+        model, or JSON: {"model": ["http://gpu1:11434", {"url": ..., "max_concurrency": 2}], "*": [...]}
+        """
+        raw = os.environ.get("OLLAMA_BACKENDS", "").strip()
+        if not raw:
+            config: Any = {"*": [OLLAMA_BASE_URL]}
+        elif raw.startswith("{"):
+            config = json.loads(raw)
+        else:
+            config = {"*": [url.strip() for url in raw.split(",") if url.strip()]}
+        models = {model: [entry if isinstance(entry, dict) else {"url": entry} for entry in entries]
+                  for model, entries in config.items()}
+        return cls(models,
+                   default_concurrency=int(os.environ.get("OLLAMA_BACKEND_CONCURRENCY", "4")),
+                   health_interval=float(os.environ.get("OLLAMA_HEALTH_INTERVAL", "10")),
+                   queue_timeout=float(os.environ.get("OLLAMA_QUEUE_TIMEOUT", "300")),
+                   passthrough=not raw)
+
+    def backends(self, model: str) -> List[Backend]:
+        return self._models.get(model) or self._models.get("*") or []
+
+    def urls(self, model: str) -> List[str]:
+        return [backend.url for backend in self.backends(model)]
+
+    def _pick(self, model: str, exclude: Set[str]) -> Optional[Backend]:
+        candidates = [b for b in self.backends(model) if b.url not in exclude]
+        healthy = [b for b in candidates if b.healthy]
+        # ถ้าทุกตัวถูก mark ว่าล่ม ลองต่อไปก่อน health check อาจยังไม่ทันรอบ
+        free = [b for b in (healthy or candidates) if b.outstanding < b.max_concurrency]
+        if not free:
+            return None
+        return min(free, key=lambda b: (b.outstanding / b.max_concurrency, b.last_used))
+
+    def _take(self, model: str, exclude: Set[str]) -> Optional[Backend]:
+        """Reserve a slot if one is free right now (caller holds the condition)"""
+        backend = self._pick(model, exclude)
+        if backend is not None:
+            backend.outstanding += 1
+            backend.last_used = time.monotonic()
+            BACKEND_INFLIGHT.set(backend.outstanding, backend=backend.url)
+        return backend
+
+    def _check_candidates(self, model: str, exclude: Set[str]) -> None:
+        self._ensure_health_checks()
+        if not [b for b in self.backends(model) if b.url not in exclude]:
+            raise BackendUnavailable(f"No LLM backend left to try for {model}")
+
+    def _notify(self) -> None:
+        """Wake blocked acquire() threads and aacquire() coroutines (caller holds the condition)"""
+        self._condition.notify_all()
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+
+    def acquire(self, model: str, exclude: Set[str] = frozenset(), timeout: Optional[float] = None) -> Backend:
+        """Reserve a slot on the least busy backend for model, waiting up to timeout for one to free up"""
+        self._check_candidates(model, exclude)
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        with self._condition:
+            backend = self._take(model, exclude)
+            if backend is None:
+                BACKEND_WAITING.inc(model=model)
+                try:
+                    while backend is None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0 or not self._condition.wait(remaining):
+                            raise BackendUnavailable(f"All LLM backends for {model} are busy")
+                        backend = self._take(model, exclude)
+                finally:
+                    BACKEND_WAITING.dec(model=model)
+        return backend
+
+    async def aacquire(self, model: str, exclude: Set[str] = frozenset()) -> Backend:
+        """
+        acquire() for coroutines. Waits on the event loop rather than in a worker
+        thread: parked threads would starve the default executor the async tools run on.
+        """
+        self._check_candidates(model, exclude)
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.queue_timeout
+        waiting = False
+        try:
+            while True:
+                with self._condition:
+                    backend = self._take(model, exclude)
+                    if backend is not None:
+                        return backend
+                    waiter = loop.create_future()
+                    self._async_waiters.append((loop, waiter))
+                if not waiting:
+                    BACKEND_WAITING.inc(model=model)
+                    waiting = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BackendUnavailable(f"All LLM backends for {model} are busy")
+                try:
+                    await asyncio.wait_for(waiter, remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            if waiting:
+                BACKEND_WAITING.dec(model=model)
+
+    def release(self, backend: Backend, seconds: float, outcome: str) -> None:
+        with self._condition:
+            backend.outstanding -= 1
+            if outcome == "connection_error":
+                self._mark(backend, False)
+            BACKEND_INFLIGHT.set(backend.outstanding, backend=backend.url)
+            self._notify()
+        BACKEND_REQUESTS.inc(backend=backend.url, outcome=outcome)
+        if outcome == "ok":
+            BACKEND_LATENCY.observe(seconds, backend=backend.url)
+
+    def _mark(self, backend: Backend, healthy: bool) -> None:
+        backend.healthy = healthy
+        BACKEND_HEALTHY.set(1 if healthy else 0, backend=backend.url)
+
+    def check_health(self) -> Dict[str, bool]:
+        """Probe every backend once (GET /api/version) and update its state"""
+        results = {}
+        for backend in list(self._backends.values()):
+            try:
+                with urllib.request.urlopen(backend.url + "/api/version", timeout=self.health_timeout) as response:
+                    ok = response.status == 200
+            except Exception:
+                ok = False
+            with self._condition:
+                self._mark(backend, ok)
+                self._notify()
+            results[backend.url] = ok
+        return results
+
+    def _health_loop(self) -> None:
+        while True:
+            time.sleep(self.health_interval)
+            self.check_health()
+
+    def _ensure_health_checks(self) -> None:
+        if self._health_thread is not None or self.health_interval <= 0 or len(self._backends) < 2:
+            return
+        with self._condition:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="llm-health", daemon=True)
+                self._health_thread.start()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._condition:
+            return [{"url": b.url, "healthy": b.healthy, "outstanding": b.outstanding,
+                     "max_concurrency": b.max_concurrency} for b in self._backends.values()]
+
+    @contextmanager
+    def slot(self, model: str, exclude: Set[str] = frozenset()) -> Iterator[Backend]:
+        """acquire/release around one request; connection errors mark the backend unhealthy"""
+        backend = self.acquire(model, exclude)
+        start, outcome = time.perf_counter(), "error"
+        try:
+            yield backend
+            outcome = "ok"
+        except BaseException as e:
+            if _is_connection_error(e):
+                outcome = "connection_error"
+            raise
+        finally:
+            self.release(backend, time.perf_counter() - start, outcome)
+
+    @asynccontextmanager
+    async def aslot(self, model: str, exclude: Set[str] = frozenset()) -> AsyncIterator[Backend]:
+        backend = await self.aacquire(model, exclude)
+        start, outcome = time.perf_counter(), "error"
+        try:
+            yield backend
+            outcome = "ok"
+        except BaseException as e:
+            if _is_connection_error(e):
+                outcome = "connection_error"
+            raise
+        finally:
+            self.release(backend, time.perf_counter() - start, outcome)
+
+class BalancedChatModel(BaseChatModel):
+    """
+    Chat model that sends each call to one ChatOllama per backend, picked by the
+    BackendPool. A call that fails to connect is retried on the next backend;
+    a stream is only retried if no chunk was produced yet.
+    """
+    model: str
+    pool: BackendPool
+    chat_kwargs: Dict[str, Any] = Field(default_factory=dict)
+    clients: Dict[str, ChatOllama] = Field(default_factory=dict)
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return "balanced-ollama"
+
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model, "backends": self.pool.urls(self.model)}
+
+    def _client(self, backend: Backend) -> ChatOllama:
+        client = self.clients.get(backend.url)
+        if client is None:
+            client = self.clients.setdefault(backend.url, ChatOllama(model=self.model, base_url=backend.url,
+                                                                     **self.chat_kwargs))
+        return client
+
+    def bind_tools(self, tools: Sequence[Any], *, tool_choice: Any = None, **kwargs: Any):
+        # Same format ChatOllama.bind_tools uses, forwarded to the backend client as kwargs["tools"]
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tried: Set[str] = set()
+        while True:
+            try:
+                with self.pool.slot(self.model, tried) as backend:
+                    tried.add(backend.url)
+                    return self._client(backend)._generate(messages, stop, run_manager, **kwargs)
+            except Exception as e:
+                # slot ถูกคืนและ backend ถูก mark ว่าล่มแล้ว ลองตัวถัดไป
+                if not _is_connection_error(e) or len(tried) >= len(self.pool.backends(self.model)):
+                    raise
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        tried: Set[str] = set()
+        while True:
+            try:
+                async with self.pool.aslot(self.model, tried) as backend:
+                    tried.add(backend.url)
+                    return await self._client(backend)._agenerate(messages, stop, run_manager, **kwargs)
+            except Exception as e:
+                if not _is_connection_error(e) or len(tried) >= len(self.pool.backends(self.model)):
+                    raise
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        tried: Set[str] = set()
+        while True:
+            started = False
+            try:
+                with self.pool.slot(self.model, tried) as backend:
+                    tried.add(backend.url)
+                    for chunk in self._client(backend)._stream(messages, stop, run_manager, **kwargs):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                if started or not _is_connection_error(e) or len(tried) >= len(self.pool.backends(self.model)):
+                    raise
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        tried: Set[str] = set()
+        while True:
+            started = False
+            try:
+                async with self.pool.aslot(self.model, tried) as backend:
+                    tried.add(backend.url)
+                    async for chunk in self._client(backend)._astream(messages, stop, run_manager, **kwargs):
+                        started = True
+                        yield chunk
+                return
+            except Exception as e:
+                if started or not _is_connection_error(e) or len(tried) >= len(self.pool.backends(self.model)):
+                    raise
+
+backend_pool = BackendPool.from_env()
+
+def create_chat_model(model_name: str, pool: Optional[BackendPool] = None, **chat_kwargs: Any) -> BaseChatModel:
+    """
+    Plain ChatOllama when no OLLAMA_BACKENDS are configured, otherwise a
+    BalancedChatModel over every backend configured for model_name
+    """
+    pool = pool or backend_pool
+    if pool.passthrough:
+        return ChatOllama(model=model_name, base_url=pool.urls(model_name)[0], **chat_kwargs)
+    return BalancedChatModel(model=model_name, pool=pool, chat_kwargs=chat_kwargs)
@@ -0,0 +1,764 @@
+# bench.py
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from agent import SQLiteAgent, SQLiteTools, AgentPool, agent_pool, is_failed_output
+from db import ConnectionPool
+from fake_ollama import FakeOllama
+from router import router_stats
+from setup import (INSERT_PRODUCT_SQL, bulk_load, check_stats, create_search_index, create_stats_tables,
+                   drop_stats_triggers, generate_products, rebuild_search_index, rebuild_stats)
+
+class SlowStubLLM(BaseChatModel):
+    """
+    Chat model stub that answers a COUNT query with ReAct steps, looking up
+    the schema first unless it is already in the prompt, and sleeping
+    `delay` seconds per call to simulate LLM latency
+    """
+    delay: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-stub"
+
+    def _reply(self, messages: List[BaseMessage]) -> ChatResult:
+        scratchpad = str(messages[-1].content)
+        schema_known = "Action: get_schema" in scratchpad or any(
+            "Database schema" in str(message.content) for message in messages)
+        if "Action: execute_query" in scratchpad:
+            text = "Thought: I have the count\nFinal Answer: done"
+        elif not schema_known:
+            text = "Thought: check the tables first\nAction: get_schema\nAction Input: "
+        else:
+            text = "Thought: count rows\nAction: execute_query\nAction Input: SELECT COUNT(*) FROM products"
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.delay)
+        return self._reply(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.delay)
+        return self._reply(messages)
+
+class LLMCallCounter(BaseCallbackHandler):
+    def __init__(self):
+        self.calls = 0
+
+    def on_chat_model_start(self, serialized: Any, messages: Any, **kwargs: Any) -> None:
+        self.calls += 1
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        "mean_ms": statistics.mean(samples) * 1000,
+        "p50_ms": samples[len(samples) // 2] * 1000,
+        "max_ms": samples[-1] * 1000,
+    }
+
+def _measure(fn, iterations):
+    timings = []
+    tracemalloc.start()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return timings, peak
+
+def bench_pool(args):
+    """Compare per-request agent setup cost: new agent every time vs pooled agent"""
+    pool = AgentPool(max_size=4)
+    # ให้ pool สร้าง agent ไว้ก่อน เพื่อวัดเฉพาะกรณี warm
+    pool.get(args.db, args.model)
+
+    cold, cold_peak = _measure(lambda: SQLiteAgent(args.db, model_name=args.model), args.iterations)
+    warm, warm_peak = _measure(lambda: pool.get(args.db, args.model), args.iterations)
+
+    print(f"Agent setup overhead over {args.iterations} requests")
+    for label, samples, peak in (("cold", cold, cold_peak), ("warm", warm, warm_peak)):
+        stats = _summary(samples)
+        print(f"{label:<5} mean={stats['mean_ms']:.3f}ms p50={stats['p50_ms']:.3f}ms "
+              f"max={stats['max_ms']:.3f}ms peak_alloc={peak / 1024:.1f}KiB")
+
+def bench_concurrency(args):
+    """Run N queries concurrently through arun against a slow stub LLM"""
+    agent = SQLiteAgent(args.db, model_name=args.model, llm=SlowStubLLM(delay=args.delay))
+    agent.agent_executor.verbose = False
+
+    start = time.perf_counter()
+    agent.run("count total records in products table")
+    single = time.perf_counter() - start
+
+    async def fan_out():
+        await asyncio.gather(*[agent.arun("count total records in products table") for _ in range(args.requests)])
+
+    start = time.perf_counter()
+    asyncio.run(fan_out())
+    concurrent = time.perf_counter() - start
+
+    print(f"single query:         {single:.2f}s")
+    print(f"{args.requests} concurrent queries: {concurrent:.2f}s ({concurrent / single:.2f}x single)")
+
+def _build_large_db(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute('''
+    CREATE TABLE products (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        category TEXT NOT NULL,
+        stock INTEGER NOT NULL,
+        description TEXT,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    rng = random.Random(42)
+    categories = ['Smartphones', 'Laptops', 'TVs', 'Audio', 'Tablets', 'Wearables', 'Cameras', 'Gaming']
+    conn.executemany(
+        'INSERT INTO products (id, name, price, category, stock, description) VALUES (?, ?, ?, ?, ?, ?)',
+        ((i, f'Product {i}', round(rng.uniform(100, 100000), 2), rng.choice(categories),
+          rng.randint(0, 500), f'Synthetic product {i}') for i in range(1, rows + 1))
+    )
+    conn.execute('CREATE INDEX idx_products_category ON products(category)')
+    conn.execute('CREATE INDEX idx_products_price ON products(price)')
+    conn.execute('CREATE INDEX idx_products_stock ON products(stock)')
+    conn.commit()
+    conn.close()
+
+def bench_tools(args):
+    """Tool-call latency with and without the connection pool on a large products table"""
+    queries = [
+        "SELECT COUNT(*) FROM products WHERE category = 'Laptops'",
+        "SELECT id, name, price FROM products WHERE price BETWEEN 1000 AND 1100 LIMIT 20",
+        "SELECT * FROM products WHERE id = 12345",
+        "SELECT name FROM products ORDER BY price DESC LIMIT 5",
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'large.db')
+        _build_large_db(path, args.rows)
+
+        pool = ConnectionPool()
+        variants = (("no pool", SQLiteTools(path, pool=None)), ("pool", SQLiteTools(path, pool=pool)))
+        print(f"Tool-call latency over {args.iterations} rounds, {args.rows} rows")
+        for label, tools in variants:
+            timings, _ = _measure(lambda: [tools.execute_query(q) for q in queries], args.iterations)
+            stats = _summary([t / len(queries) for t in timings])
+            print(f"{label:<8} mean={stats['mean_ms']:.3f}ms p50={stats['p50_ms']:.3f}ms max={stats['max_ms']:.3f}ms")
+        pool.close_all()
+
+def bench_llm_calls(args):
+    """LLM calls per query with and without the schema digest in the prompt"""
+    questions = [
+        "count total records in products table",
+        "how many laptops are in stock",
+        "what is the most expensive TV",
+    ]
+    for inject_schema in (False, True):
+        agent = SQLiteAgent(args.db, model_name=args.model, llm=SlowStubLLM(delay=0), inject_schema=inject_schema)
+        counter = LLMCallCounter()
+        for question in questions:
+            agent.run(question, callbacks=[counter])
+        label = "schema in prompt" if inject_schema else "get_schema tool"
+        print(f"{label:<17} llm_calls/query={counter.calls / len(questions):.2f}")
+
+def bench_results(args):
+    """Peak memory and observation size of SELECT * as the products table grows"""
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'rows':>9} {'peak_alloc':>12} {'observation':>12}")
+        for rows in args.sizes:
+            path = os.path.join(tmp, f'products_{rows}.db')
+            _build_large_db(path, rows)
+            tools = SQLiteTools(path, pool=None)
+            tracemalloc.start()
+            observation = str(tools.execute_query("SELECT * FROM products"))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{rows:>9} {peak / 1024:>10.1f}KiB {len(observation):>10}ch")
+
+SHARD_QUERIES = [
+    "SELECT COUNT(*) FROM products",
+    "SELECT category, COUNT(*), AVG(price), MIN(price), MAX(price) FROM products GROUP BY category",
+    "SELECT COUNT(*) FROM products WHERE category = 'Laptops'",
+    "SELECT id, name, price FROM products ORDER BY price DESC LIMIT 10",
+    "SELECT SUM(stock) FROM products WHERE price > 50000",
+    "SELECT COUNT(DISTINCT category) FROM products",
+]
+
+def _split_shards(source, directory, count):
+    """Split products by category into `count` shard files and write a manifest"""
+    conn = sqlite3.connect(source)
+    categories = [row[0] for row in conn.execute("SELECT DISTINCT category FROM products ORDER BY category")]
+    conn.close()
+    manifest = {"partition_key": "category", "shards": []}
+    for i in range(count):
+        values = categories[i::count]
+        path = os.path.join(directory, f'shard_{i}.db')
+        shard = sqlite3.connect(path)
+        shard.execute("ATTACH DATABASE ? AS source", (source,))
+        schema = shard.execute("SELECT sql FROM source.sqlite_master WHERE name = 'products'").fetchone()[0]
+        shard.execute(schema)
+        shard.execute(f"INSERT INTO products SELECT * FROM source.products WHERE category IN ({','.join('?' * len(values))})",
+                      values)
+        shard.commit()
+        shard.execute("DETACH DATABASE source")
+        shard.execute('CREATE INDEX idx_products_category ON products(category)')
+        shard.execute('CREATE INDEX idx_products_price ON products(price)')
+        create_search_index(shard.cursor())
+        rebuild_search_index(shard.cursor())
+        create_stats_tables(shard.cursor())
+        rebuild_stats(shard.cursor())
+        shard.commit()
+        shard.close()
+        manifest["shards"].append({"path": os.path.basename(path), "values": values})
+    manifest_path = os.path.join(directory, 'catalog.json')
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    return manifest_path
+
+def bench_shards(args):
+    """Single file vs the same rows split across shards: latency and result equality"""
+    from shards import ShardedSQLiteTools, resolve_shards
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'products.db')
+        _build_large_db(source, args.rows)
+        manifest = _split_shards(source, tmp, args.shards)
+        single = SQLiteTools(source)
+        sharded = ShardedSQLiteTools(manifest, resolve_shards(manifest))
+        print(f"{'single':>9} {'sharded':>9}  same  query")
+        for query in SHARD_QUERIES:
+            timings, results = [], []
+            for tools in (single, sharded):
+                samples = []
+                for _ in range(args.iterations):
+                    start = time.perf_counter()
+                    result = tools.execute_query(query)
+                    samples.append(time.perf_counter() - start)
+                timings.append(statistics.median(samples) * 1000)
+                # rows with equal sort keys may come back in a different order, compare as sets
+                results.append(repr(result if not isinstance(result, list) else
+                                    sorted(repr(tuple(round(v, 6) if isinstance(v, float) else v for v in row))
+                                           for row in result)))
+            same = "yes" if results[0] == results[1] else "NO"
+            print(f"{timings[0]:>7.1f}ms {timings[1]:>7.1f}ms  {same:>4}  {query}")
+
+SEARCH_TERMS = [
+    "noise cancelling",
+    "wireless headphones",
+    "sony oled",
+    "robot vacuum",
+    "apple watch titanium",
+    "gps",
+    "fold 4242",
+    "hasselblad",
+]
+
+def bench_search(args):
+    """Keyword lookup: LIKE '%term%' scans vs the FTS5 index used by search_products"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'products.db')
+        loaded, seconds = bulk_load(generate_products(args.rows), db_path=path, replace=True)
+        print(f"Built {loaded:,} products with the search index in {seconds:.1f}s")
+        tools = SQLiteTools(path, guard=None)
+        print(f"{'LIKE':>9} {'FTS5':>9} {'hits':>5}  terms")
+        for terms in SEARCH_TERMS:
+            words = terms.split()
+            where = " AND ".join("(name LIKE ? OR description LIKE ? OR category LIKE ?)" for _ in words)
+            like_sql = f"SELECT id, name, price, category, stock, description FROM products WHERE {where} LIMIT ?"
+            like_params = [f"%{word}%" for word in words for _ in range(3)] + [args.limit]
+            timings = []
+            for run in (lambda: tools.execute_query(like_sql, like_params),
+                        lambda: tools.search_products(terms, args.limit)):
+                samples = []
+                for _ in range(args.iterations):
+                    start = time.perf_counter()
+                    result = run()
+                    samples.append(time.perf_counter() - start)
+                timings.append(statistics.median(samples) * 1000)
+            hits = len(result) if isinstance(result, list) else result
+            print(f"{timings[0]:>7.1f}ms {timings[1]:>7.1f}ms {hits:>5}  {terms}")
+
+STATS_QUERY = '''
+SELECT category, COUNT(*), SUM(stock), ROUND(AVG(price), 2), MIN(price), MAX(price)
+FROM products GROUP BY category ORDER BY category
+'''
+
+def _time_writes(path, first_id, count, seed):
+    """Seconds per row for single-row INSERTs, price UPDATEs and DELETEs, one transaction each"""
+    rng = random.Random(seed)
+    rows = list(generate_products(count, seed=seed, start_id=first_id))
+    ids = [row[0] for row in rows]
+    conn = sqlite3.connect(path, isolation_level=None)
+    timings = {}
+    try:
+        for name, sql, params in (
+                ("insert", INSERT_PRODUCT_SQL, rows),
+                ("update", 'UPDATE products SET price = ? WHERE id = ?',
+                 [(float(rng.randint(1, 3000) * 100 + 90), i) for i in ids]),
+                ("delete", 'DELETE FROM products WHERE id = ?', [(i,) for i in ids])):
+            conn.execute('BEGIN')
+            start = time.perf_counter()
+            for row in params:
+                conn.execute(sql, row)
+            conn.execute('COMMIT')
+            timings[name] = (time.perf_counter() - start) / count
+    finally:
+        conn.close()
+    return timings
+
+def bench_stats(args):
+    """Write overhead of the summary-table triggers vs GROUP BY scans saved by get_stats"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'products.db')
+        plain = os.path.join(tmp, 'plain.db')
+        loaded, seconds = bulk_load(generate_products(args.rows), db_path=path, replace=True)
+        print(f"Built {loaded:,} products with summary tables in {seconds:.1f}s")
+        shutil.copy(path, plain)
+        conn = sqlite3.connect(plain)
+        drop_stats_triggers(conn.cursor())
+        conn.close()
+
+        print(f"\n{'write':<8} {'no stats':>10} {'stats':>10} {'overhead':>10}")
+        without = _time_writes(plain, args.rows + 1, args.writes, seed=7)
+        with_stats = _time_writes(path, args.rows + 1, args.writes, seed=7)
+        overhead = 0.0
+        for name in without:
+            extra = with_stats[name] - without[name]
+            overhead = max(overhead, extra)
+            print(f"{name:<8} {without[name] * 1e6:>8.1f}us {with_stats[name] * 1e6:>8.1f}us {extra * 1e6:>8.1f}us")
+
+        tools = SQLiteTools(path, guard=None)
+        timings = []
+        for run in (lambda: tools.execute_query(STATS_QUERY), lambda: tools.get_stats()):
+            samples = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                run()
+                samples.append(time.perf_counter() - start)
+            timings.append(statistics.median(samples))
+        print(f"\n{'read':<8} {'GROUP BY':>10} {'get_stats':>10}")
+        print(f"{'stats':<8} {timings[0] * 1000:>8.2f}ms {timings[1] * 1000:>8.2f}ms")
+        # ต้นทุนเขียนที่เพิ่มขึ้นต่อแถว เทียบกับเวลาที่ประหยัดได้ต่อการอ่านหนึ่งครั้ง
+        print(f"One get_stats read saves the trigger overhead of ~{(timings[0] - timings[1]) / max(overhead, 1e-9):,.0f} writes")
+
+        conn = sqlite3.connect(path)
+        drift = check_stats(conn)
+        conn.close()
+        print(f"Consistency after {args.writes * 3:,} writes: {'OK' if not drift else f'{len(drift)} inconsistent rows'}")
+
+LOAD_QUESTIONS = [
+    "count total records in products table",
+    "show database schema",
+    "show first 5 rows from products table",
+    "what is the average price per category",
+]
+
+def _percentile(samples, pct):
+    samples = sorted(samples)
+    if not samples:
+        return 0.0
+    index = min(int(round(pct / 100 * (len(samples) - 1))), len(samples) - 1)
+    return samples[index]
+
+def _rss_kib():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+class _ToolTimer:
+    """Wrap SQLiteTools methods with timers; agents must be built inside the context"""
+    def __init__(self):
+        self.timings = []
+        self._originals = {}
+
+    def __enter__(self):
+        for name in ("execute_query", "get_table_schema"):
+            original = getattr(SQLiteTools, name)
+            self._originals[name] = original
+
+            def timed(tools_self, *args, _original=original, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return _original(tools_self, *args, **kwargs)
+                finally:
+                    self.timings.append(time.perf_counter() - start)
+            setattr(SQLiteTools, name, timed)
+        return self
+
+    def __exit__(self, *exc):
+        for name, original in self._originals.items():
+            setattr(SQLiteTools, name, original)
+
+def _fake_url(fake):
+    return f"http://{fake.host}:{fake.port}"
+
+@contextmanager
+def _use_fake(fake):
+    """
+    Agents built inside the block talk to the fake server. create_chat_model reads
+    backends.backend_pool, which otherwise follows OLLAMA_BASE_URL/OLLAMA_BACKENDS.
+    """
+    import backends
+    original = backends.backend_pool
+    if fake is not None:
+        backends.backend_pool = backends.BackendPool({"*": [{"url": _fake_url(fake)}]}, passthrough=True)
+    try:
+        yield
+    finally:
+        backends.backend_pool = original
+
+def _require_llm_calls(fake, calls=None):
+    # 0 calls = agent ไปต่อที่อื่น (เช่น OLLAMA_BASE_URL) ตัวเลขที่ได้ไม่ได้วัดอะไรเลย
+    if fake is not None and not (fake.stats["calls"] if calls is None else calls):
+        raise SystemExit(f"the fake Ollama server on {_fake_url(fake)} received no LLM calls, nothing was benchmarked")
+
+def bench_load(args):
+    """Drive SQLiteAgent or api.py against a fake Ollama server at fixed concurrency"""
+    questions = args.questions or LOAD_QUESTIONS
+
+    with FakeOllama(token_latency=args.token_latency, port=args.port) as fake, _use_fake(fake), \
+            _ToolTimer() as tool_timer:
+        if args.target == "api":
+            import httpx
+            import api
+            api.limiter = api.ConcurrencyLimiter(args.concurrency, args.requests, queue_timeout=600)
+            agent_pool.clear()
+            if not args.cache:
+                agent_pool.agent_kwargs["cache"] = None
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://bench",
+                                       timeout=600)
+
+            async def one(question):
+                response = await client.post("/query", json={"query": question, "db_path": args.db,
+                                                              "model_name": args.model, "agent_mode": args.mode})
+                response.raise_for_status()
+                if is_failed_output(response.json()["result"]):
+                    raise RuntimeError(response.json()["result"])
+        else:
+            from cache import query_cache
+            agent = SQLiteAgent(args.db, model_name=args.model, cache=query_cache if args.cache else None)
+
+            async def one(question):
+                result = await agent.arun(question, mode=args.mode)
+                if is_failed_output(result):
+                    raise RuntimeError(result)
+
+        latencies = []
+        errors = 0
+        warmup_calls = 0
+        router_baseline = {}
+
+        async def drive():
+            nonlocal errors, warmup_calls, router_baseline
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def timed(question):
+                nonlocal errors
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        await one(question)
+                    except Exception:
+                        errors += 1
+                    latencies.append(time.perf_counter() - start)
+
+            # รอบแรกไม่นับ (warm-up)
+            try:
+                await one(questions[0])
+            except Exception as e:
+                raise SystemExit(f"warm-up query failed: {e}")
+            warmup_calls = fake.stats["calls"]
+            fake.reset_stats()
+            router_baseline = router_stats()["decisions"]
+            tool_timer.timings.clear()
+            latencies.clear()
+            await asyncio.gather(*[timed(questions[i % len(questions)]) for i in range(args.requests)])
+            if args.target == "api":
+                await client.aclose()
+
+        start = time.perf_counter()
+        asyncio.run(drive())
+        elapsed = time.perf_counter() - start
+        llm_stats = dict(fake.stats)
+        _require_llm_calls(fake, warmup_calls + llm_stats["calls"])
+
+    results = {
+        "target": args.target,
+        "mode": args.mode,
+        "python": platform.python_version(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "token_latency_s": args.token_latency,
+        "errors": errors,
+        "latency_ms": {
+            "p50": _percentile(latencies, 50) * 1000,
+            "p95": _percentile(latencies, 95) * 1000,
+            "p99": _percentile(latencies, 99) * 1000,
+            "mean": statistics.mean(latencies) * 1000 if latencies else 0.0,
+        },
+        "throughput_qps": len(latencies) / elapsed if elapsed else 0.0,
+        "llm_calls_per_query": llm_stats["calls"] / args.requests,
+        "llm_tokens_per_query": llm_stats["tokens"] / args.requests,
+        "tool_calls_per_query": len(tool_timer.timings) / args.requests,
+        "tool_time_ms": {
+            "total": sum(tool_timer.timings) * 1000,
+            "mean": statistics.mean(tool_timer.timings) * 1000 if tool_timer.timings else 0.0,
+            "p95": _percentile(tool_timer.timings, 95) * 1000,
+        },
+        "rss_kib": _rss_kib(),
+        "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "router": router_stats(router_baseline),
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{args.target}: {args.requests} requests @ concurrency {args.concurrency}, {errors} errors")
+    print(f"latency p50={results['latency_ms']['p50']:.1f}ms p95={results['latency_ms']['p95']:.1f}ms "
+          f"p99={results['latency_ms']['p99']:.1f}ms throughput={results['throughput_qps']:.2f} q/s")
+    print(f"llm_calls/query={results['llm_calls_per_query']:.2f} tool_calls/query={results['tool_calls_per_query']:.2f} "
+          f"tool_time_mean={results['tool_time_ms']['mean']:.3f}ms rss={results['rss_kib']}KiB")
+    print(f"fast-path hit rate={results['router']['hit_rate']:.0%} {results['router']['decisions']}")
+    print(f"results written to {args.output}")
+
+def bench_backends(args):
+    """Throughput on one vs several fake Ollama backends, then failover when one goes down mid-run"""
+    from backends import BackendPool, BalancedChatModel
+    fakes = [FakeOllama(token_latency=args.token_latency, port=args.port + i, parallel=args.parallel).start()
+             for i in range(args.backends)]
+    urls = [f"http://localhost:{fake.port}" for fake in fakes]
+
+    def run(pool, kill_at=None):
+        for fake in fakes:
+            fake.reset_stats()
+        llm = BalancedChatModel(model=args.model, pool=pool, chat_kwargs={"temperature": 0})
+        agent = SQLiteAgent(args.db, model_name=args.model, llm=llm)
+
+        async def fan_out():
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def one(i):
+                async with semaphore:
+                    if i == kill_at:
+                        # ปิด backend ตัวสุดท้ายกลางทาง request ที่ค้างอยู่ต้องย้ายไปตัวอื่น
+                        fakes[-1].stop()
+                    result = await agent.arun(LOAD_QUESTIONS[i % len(LOAD_QUESTIONS)])
+                    return not is_failed_output(result)
+
+            start = time.perf_counter()
+            ok = await asyncio.gather(*[one(i) for i in range(args.requests)])
+            return time.perf_counter() - start, sum(ok)
+
+        seconds, ok = asyncio.run(fan_out())
+        calls = [fake.stats["calls"] for fake in fakes]
+        return seconds, ok, calls
+
+    def pool_of(backend_urls):
+        return BackendPool({"*": [{"url": url, "max_concurrency": args.parallel} for url in backend_urls]},
+                           health_interval=0.5)
+
+    try:
+        print(f"{args.requests} requests @ concurrency {args.concurrency}, {args.parallel} parallel chats per backend")
+        for label, pool, kill_at in (("1 backend", pool_of(urls[:1]), None),
+                                     (f"{len(urls)} backends", pool_of(urls), None),
+                                     ("failover", pool_of(urls), args.requests // 2)):
+            seconds, ok, calls = run(pool, kill_at)
+            states = ", ".join(f"{b['url'].rsplit(':', 1)[1]}={'up' if b['healthy'] else 'down'}" for b in pool.stats())
+            print(f"{label:<11} {args.requests / seconds:>6.2f} q/s  ok={ok}/{args.requests}  "
+                  f"llm_calls per backend={calls}  [{states}]")
+    finally:
+        for fake in fakes:
+            fake.stop()
+
+def bench_modes(args):
+    """LLM round-trips and generated tokens per answered question, ReAct vs native tool calling"""
+    from metrics import TracingCallbackHandler
+    questions = args.questions or LOAD_QUESTIONS
+    fake = None if args.live else FakeOllama(token_latency=0.0, port=args.port).start()
+    try:
+        with _use_fake(fake):
+            agent = SQLiteAgent(args.db, model_name=args.model, inject_schema=True)
+        results = {}
+        for mode in ("react", "tools"):
+            traces = []
+            if fake is not None:
+                fake.reset_stats()
+            for question in questions:
+                tracer = TracingCallbackHandler()
+                agent.run(question, tracer=tracer, mode=mode)
+                traces.append(tracer.trace())
+            _require_llm_calls(fake)
+            answered = [t for t in traces if t["status"] == "ok"] or traces
+            # tool calls stream as a single chunk, so prefer the server-side token count when we have it
+            tokens = (fake.stats["tokens"] / len(traces) if fake is not None else
+                      statistics.mean(sum(c["tokens"] for c in t["llm_calls"]) for t in answered))
+            results[mode] = {
+                "answered": sum(1 for t in traces if t["status"] == "ok"),
+                "llm_calls_per_query": statistics.mean(len(t["llm_calls"]) for t in answered),
+                "tokens_per_query": tokens,
+                "parse_failures": sum(t["parse_failures"] for t in traces),
+                "latency_ms": statistics.mean(t["total_ms"] for t in answered),
+            }
+    finally:
+        if fake is not None:
+            fake.stop()
+
+    for mode, row in results.items():
+        print(f"{mode:>6}: answered={row['answered']}/{len(questions)} llm_calls/query={row['llm_calls_per_query']:.2f} "
+              f"tokens/query={row['tokens_per_query']:.1f} parse_failures={row['parse_failures']} "
+              f"latency={row['latency_ms']:.1f}ms")
+
+def bench_warmup(args):
+    """Time to first token of the first and following requests, with and without warm_up()"""
+    from agent import _ollama_post, warm_up
+    from backends import OLLAMA_BASE_URL
+    from metrics import TracingCallbackHandler
+    fake = None
+    if not args.live:
+        fake = FakeOllama(token_latency=args.token_latency, load_delay=args.load_delay,
+                          prompt_latency=args.prompt_latency, port=args.port).start()
+    base_url = _fake_url(fake) if fake is not None else OLLAMA_BASE_URL
+    try:
+        with _use_fake(fake):
+            agent = SQLiteAgent(args.db, model_name=args.model, inject_schema=True)
+        for scenario in ("cold", "warmed"):
+            # keep_alive=0 ทำให้ Ollama unload model ก่อนเริ่มแต่ละรอบ
+            _ollama_post(base_url, "/api/generate", {"model": args.model, "keep_alive": 0}, 60)
+            warm_up_s = None
+            if scenario == "warmed":
+                start = time.perf_counter()
+                warm_up([args.model], base_url=base_url if fake is not None else None)
+                warm_up_s = time.perf_counter() - start
+            ttfts = []
+            for i in range(args.requests):
+                tracer = TracingCallbackHandler()
+                agent.run(LOAD_QUESTIONS[i % len(LOAD_QUESTIONS)], tracer=tracer)
+                first = tracer.trace()["llm_calls"][:1]
+                if first and first[0]["ttft_ms"] is not None:
+                    ttfts.append(first[0]["ttft_ms"])
+            line = f"{scenario:>6}: first_ttft={ttfts[0]:.1f}ms" if ttfts else f"{scenario:>6}: no tokens"
+            if len(ttfts) > 1:
+                line += f" warm_ttft_mean={statistics.mean(ttfts[1:]):.1f}ms"
+            if warm_up_s is not None:
+                line += f" warm_up={warm_up_s * 1000:.1f}ms"
+            print(line)
+        _require_llm_calls(fake)
+        if fake is not None:
+            cached = fake.stats["cached_prompt_tokens"] / max(fake.stats["prompt_tokens"], 1)
+            print(f"prompt cache reuse: {cached:.0%} of {fake.stats['prompt_tokens']} prompt tokens")
+    finally:
+        if fake is not None:
+            fake.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description='SQLite AI Assistant benchmarks')
+    parser.add_argument('--db', type=str, default="products.db", help='Database file path')
+    parser.add_argument('--model', type=str, default="deepseek-r1:8b", help='Ollama model name')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pool_parser = subparsers.add_parser('pool', help='Cold vs warm agent setup overhead')
+    pool_parser.add_argument('--iterations', type=int, default=50)
+    pool_parser.set_defaults(func=bench_pool)
+
+    concurrency_parser = subparsers.add_parser('concurrency', help='Concurrent arun against a slow stub LLM')
+    concurrency_parser.add_argument('--requests', type=int, default=10)
+    concurrency_parser.add_argument('--delay', type=float, default=0.5, help='Stub LLM latency per call (seconds)')
+    concurrency_parser.set_defaults(func=bench_concurrency)
+
+    tools_parser = subparsers.add_parser('tools', help='Tool-call latency with and without the connection pool')
+    tools_parser.add_argument('--rows', type=int, default=500000)
+    tools_parser.add_argument('--iterations', type=int, default=200)
+    tools_parser.set_defaults(func=bench_tools)
+
+    llm_calls_parser = subparsers.add_parser('llm-calls', help='LLM calls per query with and without schema injection')
+    llm_calls_parser.set_defaults(func=bench_llm_calls)
+
+    results_parser = subparsers.add_parser('results', help='Memory and observation size of large result sets')
+    results_parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    results_parser.set_defaults(func=bench_results)
+
+    load_parser = subparsers.add_parser('load', help='Load test against a fake Ollama server')
+    load_parser.add_argument('--target', choices=['agent', 'api'], default='agent')
+    load_parser.add_argument('--requests', type=int, default=100)
+    load_parser.add_argument('--concurrency', type=int, default=8)
+    load_parser.add_argument('--token-latency', type=float, default=0.005, help='Fake LLM seconds per token')
+    load_parser.add_argument('--port', type=int, default=11434, help='Port for the fake Ollama server')
+    load_parser.add_argument('--cache', action='store_true', help='Keep the answer cache enabled')
+    load_parser.add_argument('--mode', choices=['react', 'tools'], default='react', help='Agent mode')
+    load_parser.add_argument('--questions', type=str, nargs='*', help='Questions to cycle through')
+    load_parser.add_argument('--output', type=str, default='bench_results.json', help='Machine-readable results file')
+    load_parser.set_defaults(func=bench_load)
+
+    modes_parser = subparsers.add_parser('modes', help='LLM calls and tokens per query, ReAct vs tool calling')
+    modes_parser.add_argument('--questions', type=str, nargs='*', help='Questions to ask in both modes')
+    modes_parser.add_argument('--live', action='store_true', help='Use the real Ollama server instead of the fake one')
+    modes_parser.add_argument('--port', type=int, default=11434, help='Port for the fake Ollama server')
+    modes_parser.set_defaults(func=bench_modes)
+
+    shards_parser = subparsers.add_parser('shards', help='Single database vs sharded fan-out')
+    shards_parser.add_argument('--rows', type=int, default=400000)
+    shards_parser.add_argument('--shards', type=int, default=4)
+    shards_parser.add_argument('--iterations', type=int, default=5)
+    shards_parser.set_defaults(func=bench_shards)
+
+    search_parser = subparsers.add_parser('search', help='LIKE scans vs full-text search_products')
+    search_parser.add_argument('--rows', type=int, default=400000)
+    search_parser.add_argument('--limit', type=int, default=10)
+    search_parser.add_argument('--iterations', type=int, default=5)
+    search_parser.set_defaults(func=bench_search)
+
+    backends_parser = subparsers.add_parser('backends', help='Load balancing and failover across fake Ollama backends')
+    backends_parser.add_argument('--backends', type=int, default=3)
+    backends_parser.add_argument('--requests', type=int, default=48)
+    backends_parser.add_argument('--concurrency', type=int, default=12)
+    backends_parser.add_argument('--parallel', type=int, default=2, help='Concurrent chats each fake backend serves')
+    backends_parser.add_argument('--port', type=int, default=11500, help='Port of the first fake backend')
+    backends_parser.add_argument('--token-latency', type=float, default=0.01, help='Fake seconds per generated token')
+    backends_parser.set_defaults(func=bench_backends)
+
+    stats_parser = subparsers.add_parser('stats', help='Summary-table trigger overhead vs GROUP BY reads')
+    stats_parser.add_argument('--rows', type=int, default=400000)
+    stats_parser.add_argument('--writes', type=int, default=5000, help='Rows inserted, updated and deleted')
+    stats_parser.add_argument('--iterations', type=int, default=5)
+    stats_parser.set_defaults(func=bench_stats)
+
+    warmup_parser = subparsers.add_parser('warmup', help='Cold-start vs warm time to first token')
+    warmup_parser.add_argument('--requests', type=int, default=5)
+    warmup_parser.add_argument('--live', action='store_true', help='Use the real Ollama server instead of the fake one')
+    warmup_parser.add_argument('--port', type=int, default=11434, help='Port for the fake Ollama server')
+    warmup_parser.add_argument('--load-delay', type=float, default=2.0, help='Fake model load time (seconds)')
+    warmup_parser.add_argument('--prompt-latency', type=float, default=0.0005, help='Fake seconds per uncached prompt token')
+    warmup_parser.add_argument('--token-latency', type=float, default=0.005, help='Fake seconds per generated token')
+    warmup_parser.set_defaults(func=bench_warmup)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
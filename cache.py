@@ -0,0 +1,251 @@
+# cache.py
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from urllib.parse import quote
+
+from shards import resolve_shards
+
+def normalize_question(question: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation so trivial variants share a key"""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.;")
+
+STALE_NOTE = "The data changed since this question was last answered; these are fresh rows from the same SQL."
+
+def render_fresh_rows(sql: str, rows: Any) -> str:
+    """Level 2 answer: the re-executed rows as JSON with a note, not a rewrite of the cached text"""
+    return json.dumps({"note": STALE_NOTE, "sql": sql, "rows": rows}, ensure_ascii=False, default=str)
+
+class DataVersionTracker:
+    """
+    Build a data version token per database from the file signature (mtime/size
+    of the db and its -wal file) plus a generation counter that is bumped
+    whenever PRAGMA data_version changes on a long-lived connection
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections: Dict[str, sqlite3.Connection] = {}
+        self._last_seen: Dict[str, int] = {}
+        self._generation: Dict[str, int] = {}
+
+    def _file_signature(self, db_path: str) -> str:
+        parts = []
+        for path in (db_path, db_path + "-wal"):
+            try:
+                st = os.stat(path)
+                parts.append(f"{st.st_mtime_ns}.{st.st_size}")
+            except FileNotFoundError:
+                parts.append("-")
+        return ":".join(parts)
+
+    def token(self, db_path: str) -> str:
+        shards = resolve_shards(db_path)
+        if shards is not None:
+            # sharded database: changes in any shard invalidate the answer
+            return "|".join(self.token(path) for path in shards.paths)
+        key = os.path.abspath(db_path)
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = sqlite3.connect(f"file:{quote(key)}?mode=ro", uri=True, check_same_thread=False)
+                self._connections[key] = conn
+            # data_version เปลี่ยนเมื่อ connection อื่น commit ข้อมูลใหม่
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if key in self._last_seen and self._last_seen[key] != data_version:
+                self._generation[key] = self._generation.get(key, 0) + 1
+            self._last_seen[key] = data_version
+            return f"{self._file_signature(key)}:{self._generation.get(key, 0)}"
+
+class MemoryCacheBackend:
+    """In-process LRU store"""
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: Dict[str, Any]) -> int:
+        """Store entry and return the number of evicted entries"""
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+class SQLiteCacheBackend:
+    """On-disk LRU store so cached answers survive restarts"""
+    def __init__(self, path: str, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+        CREATE TABLE IF NOT EXISTS query_cache (
+            key TEXT PRIMARY KEY,
+            answer TEXT,
+            sql TEXT,
+            version TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_used REAL NOT NULL
+        )
+        ''')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_query_cache_last_used ON query_cache(last_used)')
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT answer, sql, version, created_at FROM query_cache WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute('UPDATE query_cache SET last_used = ? WHERE key = ?', (time.time(), key))
+            self._conn.commit()
+            return {"answer": row[0], "sql": row[1], "version": row[2], "created_at": row[3]}
+
+    def set(self, key: str, entry: Dict[str, Any]) -> int:
+        with self._lock:
+            self._conn.execute('''
+            INSERT OR REPLACE INTO query_cache (key, answer, sql, version, created_at, last_used)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (key, entry["answer"], entry["sql"], entry["version"], entry["created_at"], time.time()))
+            evicted = self._conn.execute('''
+            DELETE FROM query_cache WHERE key IN (
+                SELECT key FROM query_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+            )
+            ''', (self.max_entries,)).rowcount
+            self._conn.commit()
+            return max(evicted, 0)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM query_cache WHERE key = ?', (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute('DELETE FROM query_cache')
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM query_cache').fetchone()[0]
+
+class QueryCache:
+    """
+    Two-level cache for agent answers keyed by normalized question, model and db.
+    Level 1 returns the final answer while the data version is unchanged.
+    Level 2 re-executes the stored SQL once the data has changed and returns
+    the fresh rows (render_fresh_rows); the cached answer text is left as is.
+    """
+    def __init__(self, backend=None, ttl: Optional[float] = 3600, tracker: Optional[DataVersionTracker] = None):
+        self.backend = backend or MemoryCacheBackend()
+        self.ttl = ttl
+        self.tracker = tracker or DataVersionTracker()
+        self._lock = threading.Lock()
+        self._counters = {"answer_hits": 0, "sql_hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += amount
+
+    def _key(self, db_path: str, model_name: str, question: str) -> str:
+        return f"{model_name}\x1f{os.path.abspath(db_path)}\x1f{normalize_question(question)}"
+
+    def lookup(self, db_path: str, model_name: str, question: str,
+               execute: Callable[[str], Any]) -> Optional[Dict[str, Any]]:
+        """
+        Return {"output": ..., "level": "answer" | "sql"} on a hit, None on a miss.
+        `execute` runs SQL for level 2 hits.
+        """
+        key = self._key(db_path, model_name, question)
+        entry = self.backend.get(key)
+        if entry is None:
+            self._count("misses")
+            return None
+
+        if self.ttl is not None and time.time() - entry["created_at"] > self.ttl:
+            self.backend.delete(key)
+            self._count("expirations")
+            self._count("misses")
+            return None
+
+        version = self.tracker.token(db_path)
+        if entry["version"] == version and entry["answer"] is not None:
+            self._count("answer_hits")
+            return {"output": entry["answer"], "level": "answer"}
+
+        if entry["sql"]:
+            # ข้อมูลเปลี่ยนแล้ว แต่ยังใช้ SQL เดิมได้โดยไม่ต้องเรียก LLM
+            # คำตอบเดิมเป็นข้อความที่ LLM เขียนจากข้อมูลเก่า ส่งแถวใหม่กลับไปตรง ๆ และไม่เขียนทับคำตอบนั้น
+            result = execute(entry["sql"])
+            if isinstance(result, str) and result.startswith("Error"):
+                self.backend.delete(key)
+                self._count("misses")
+                return None
+            self._count("sql_hits")
+            return {"output": render_fresh_rows(entry["sql"], result), "level": "sql"}
+
+        self.backend.delete(key)
+        self._count("misses")
+        return None
+
+    def store(self, db_path: str, model_name: str, question: str, answer: Any, sql: Optional[str] = None) -> None:
+        self._count("evictions", self.backend.set(self._key(db_path, model_name, question), {
+            "answer": str(answer),
+            "sql": sql,
+            "version": self.tracker.token(db_path),
+            "created_at": time.time()
+        }))
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["answer_hits"] + counters["sql_hits"] + counters["misses"]
+        hits = counters["answer_hits"] + counters["sql_hits"]
+        counters["entries"] = len(self.backend)
+        counters["hit_rate"] = hits / lookups if lookups else 0.0
+        return counters
+
+def _default_backend():
+    path = os.environ.get("QUERY_CACHE_PATH")
+    max_entries = int(os.environ.get("QUERY_CACHE_SIZE", "1024"))
+    if path:
+        return SQLiteCacheBackend(path, max_entries=max_entries)
+    return MemoryCacheBackend(max_entries=max_entries)
+
+query_cache = QueryCache(
+    backend=_default_backend(),
+    ttl=float(os.environ.get("QUERY_CACHE_TTL", "3600")) or None
+)
@@ -0,0 +1,545 @@
+# db.py
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple
+from urllib.parse import quote
+
+class ConnectionPool:
+    """
+    Reuse SQLite connections per (thread, db_path) so tool calls keep a warm
+    page cache and statement cache instead of reconnecting every time
+    """
+    def __init__(self, read_only: bool = True, wal: bool = False, mmap_size: int = 256 * 1024 * 1024,
+                 cache_size: int = -64000, temp_store: str = "MEMORY"):
+        self.read_only = read_only
+        self.wal = wal
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size  # ค่าติดลบ = ขนาดเป็น KiB
+        self.temp_store = temp_store
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: Set[sqlite3.Connection] = set()
+        self._wal_ready: Set[str] = set()
+
+    def _enable_wal(self, db_path: str) -> None:
+        # journal_mode is persistent, but it can only be switched on a writable connection
+        with self._lock:
+            if db_path in self._wal_ready:
+                return
+            conn = sqlite3.connect(db_path)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            finally:
+                conn.close()
+            self._wal_ready.add(db_path)
+
+    def _connect(self, db_path: str) -> sqlite3.Connection:
+        if self.wal:
+            self._enable_wal(db_path)
+
+        if self.read_only:
+            uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.execute("PRAGMA query_only=ON")
+        else:
+            conn = sqlite3.connect(db_path, check_same_thread=False)
+
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size={int(self.cache_size)}")
+        conn.execute(f"PRAGMA temp_store={self.temp_store}")
+        return conn
+
+    def get(self, db_path: str) -> sqlite3.Connection:
+        """Get the calling thread's connection for db_path, opening it on first use"""
+        connections: Dict[str, sqlite3.Connection] = getattr(self._local, "connections", None)
+        if connections is None:
+            connections = self._local.connections = {}
+
+        conn = connections.get(db_path)
+        if conn is None:
+            conn = self._connect(db_path)
+            connections[db_path] = conn
+            with self._lock:
+                self._connections.add(conn)
+        return conn
+
+    def discard(self, db_path: str) -> None:
+        """Drop the calling thread's connection, e.g. after it hit an unrecoverable error"""
+        connections = getattr(self._local, "connections", {})
+        conn = connections.pop(db_path, None)
+        if conn is not None:
+            with self._lock:
+                self._connections.discard(conn)
+            conn.close()
+
+    def close_all(self) -> None:
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections.clear()
+        self._local = threading.local()
+
+connection_pool = ConnectionPool(
+    read_only=os.environ.get("SQLITE_READ_ONLY", "1") == "1",
+    wal=os.environ.get("SQLITE_WAL", "0") == "1",
+    mmap_size=int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    cache_size=int(os.environ.get("SQLITE_CACHE_SIZE", "-64000")),
+    temp_store=os.environ.get("SQLITE_TEMP_STORE", "MEMORY")
+)
+
+class SchemaCache:
+    """
+    Cache table/column/index information per database, reloaded only when
+    PRAGMA schema_version changes
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+    def _load(self, conn: sqlite3.Connection) -> Dict[str, Any]:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table';")
+        rows = cursor.fetchall()
+        # FTS5 tables and their shadow tables (<name>_data, _idx, ...) are not queried
+        # with plain SQL, they are listed separately and reached through search_products
+        virtual = [name for name, sql in rows if (sql or "").upper().startswith("CREATE VIRTUAL TABLE")]
+        tables = [name for name, _ in rows
+                  if name not in virtual and not any(name.startswith(v + "_") for v in virtual)]
+
+        fulltext = {}
+        for table_name in virtual:
+            cursor.execute(f"PRAGMA table_info({table_name})")
+            fulltext[table_name] = [col[1] for col in cursor.fetchall()]
+
+        columns = {}
+        indexes = {}
+        for table_name in tables:
+            cursor.execute(f"PRAGMA table_info({table_name})")
+            columns[table_name] = [
+                {
+                    "name": col[1],
+                    "type": col[2],
+                    "notnull": col[3],
+                    "pk": col[5]
+                } for col in cursor.fetchall()
+            ]
+
+            indexes[table_name] = []
+            cursor.execute(f"PRAGMA index_list({table_name})")
+            for index in cursor.fetchall():
+                index_name, unique, origin = index[1], index[2], index[3]
+                if origin == "pk":
+                    continue
+                cursor.execute(f"PRAGMA index_info({index_name})")
+                indexes[table_name].append({
+                    "name": index_name,
+                    "columns": [info[2] for info in cursor.fetchall()],
+                    "unique": bool(unique)
+                })
+        cursor.close()
+        return {"columns": columns, "indexes": indexes, "fulltext": fulltext}
+
+    def get(self, conn: sqlite3.Connection, db_path: str) -> Dict[str, Any]:
+        """Return {"version", "columns", "indexes", "fulltext"} for db_path, reloading if the schema changed"""
+        key = os.path.abspath(db_path)
+        version = conn.execute("PRAGMA schema_version").fetchone()[0]
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry["version"] == version:
+                return entry
+
+        entry = {"version": version, **self._load(conn)}
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, db_path: str) -> None:
+        with self._lock:
+            self._entries.pop(os.path.abspath(db_path), None)
+
+class _ColumnSummary:
+    def __init__(self, max_distinct: int):
+        self.max_distinct = max_distinct
+        self.min = None
+        self.max = None
+        self.nulls = 0
+        self.distinct: Set[Any] = set()
+        self.distinct_overflow = False
+
+    def add(self, value: Any) -> None:
+        if value is None:
+            self.nulls += 1
+            return
+        try:
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+        except TypeError:
+            # คอลัมน์ที่มีหลายชนิดข้อมูลปนกัน เปรียบเทียบไม่ได้
+            pass
+        if not self.distinct_overflow:
+            self.distinct.add(value)
+            if len(self.distinct) > self.max_distinct:
+                self.distinct_overflow = True
+                self.distinct.clear()
+
+    def merge(self, other: "_ColumnSummary") -> None:
+        """Fold in a summary computed over another slice of the same column"""
+        self.nulls += other.nulls
+        for value in (other.min, other.max):
+            if value is None:
+                continue
+            try:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+            except TypeError:
+                pass
+        if other.distinct_overflow:
+            self.distinct_overflow = True
+            self.distinct.clear()
+        elif not self.distinct_overflow:
+            self.distinct |= other.distinct
+            if len(self.distinct) > self.max_distinct:
+                self.distinct_overflow = True
+                self.distinct.clear()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "min": self.min,
+            "max": self.max,
+            "nulls": self.nulls,
+            "distinct": f">{self.max_distinct}" if self.distinct_overflow else len(self.distinct)
+        }
+
+class ResultRows(list):
+    """
+    A plain list of rows that also carries the column names, for callers that
+    render a table, and the query plan warnings of the query that produced it
+    """
+    def __init__(self, rows: Sequence[Tuple] = (), columns: Sequence[str] = (), warnings: Sequence[str] = ()):
+        super().__init__(rows)
+        self.columns = list(columns)
+        self.warnings = list(warnings)
+
+def with_warnings(result: Any, warnings: Sequence[str]) -> Any:
+    """Attach the plan warnings of a query that was allowed to run; error strings are left as they are"""
+    if not warnings:
+        return result
+    if isinstance(result, ResultRows):
+        result.warnings = list(warnings)
+    elif isinstance(result, dict):
+        result = {**result, "warnings": list(warnings)}
+    return result
+
+def tool_observation(result: Any) -> Any:
+    """
+    execute_query result as the agent sees it. A list repr would drop the plan
+    warnings, rows that have some become {"columns", "rows", "warnings"}.
+    """
+    if getattr(result, "warnings", None):
+        return {"columns": result.columns, "rows": list(result), "warnings": result.warnings}
+    return result
+
+def materialize_rows(cursor: sqlite3.Cursor, max_rows: int = 50, max_bytes: int = 8000,
+                     fetch_size: int = 500, max_distinct: int = 1000) -> Any:
+    """
+    Fetch a result set in chunks. Small results come back as a plain list of
+    rows (a ResultRows, which also knows the column names). Results over the row or byte budget come back as a truncated preview
+    with the total row count and a per-column min/max/distinct summary, so
+    memory and prompt size stay flat no matter how many rows match.
+    """
+    if cursor.description is None:
+        return cursor.fetchall()
+
+    columns = [description[0] for description in cursor.description]
+    summaries = [_ColumnSummary(max_distinct) for _ in columns]
+    preview = []
+    preview_bytes = 0
+    row_count = 0
+    truncated = False
+
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            break
+        for row in rows:
+            row_count += 1
+            for summary, value in zip(summaries, row):
+                summary.add(value)
+            if truncated:
+                continue
+            row_bytes = len(repr(row))
+            if len(preview) < max_rows and preview_bytes + row_bytes <= max_bytes:
+                preview.append(row)
+                preview_bytes += row_bytes
+            else:
+                truncated = True
+
+    if not truncated:
+        return ResultRows(preview, columns)
+
+    return {
+        "truncated": True,
+        "row_count": row_count,
+        "columns": columns,
+        "preview": preview,
+        "summary": {name: summary.to_dict() for name, summary in zip(columns, summaries)}
+    }
+
+class AsyncToolsMixin:
+    """Async wrappers that run the blocking tool methods in a worker thread so the event loop is not blocked"""
+    async def aexecute_query(self, query: str) -> Any:
+        return await asyncio.to_thread(self.execute_query, query)
+
+    async def aget_table_schema(self, *args) -> Dict[str, List[str]]:
+        return await asyncio.to_thread(self.get_table_schema, *args)
+
+    async def asearch_products(self, query: str, limit: int = 10) -> Any:
+        return await asyncio.to_thread(self.search_products, query, limit)
+
+    async def aget_stats(self, category: str = "") -> Dict[str, Any]:
+        return await asyncio.to_thread(self.get_stats, category)
+
+class QueryBudget:
+    """Progress-handler state for one statement"""
+    def __init__(self, time_budget: float, max_vm_steps: int, interval: int):
+        self.deadline = time.monotonic() + time_budget
+        self.time_budget = time_budget
+        self.max_vm_steps = max_vm_steps
+        self.interval = interval
+        self.steps = 0
+        self.reason: Optional[str] = None
+
+    def __call__(self) -> int:
+        self.steps += self.interval
+        if self.steps > self.max_vm_steps:
+            self.reason = f"exceeded the budget of {self.max_vm_steps} VM steps"
+            return 1
+        if time.monotonic() > self.deadline:
+            self.reason = f"exceeded the {self.time_budget:g}s time budget"
+            return 1
+        return 0
+
+class QueryGuard:
+    """
+    Inspect LLM-generated SQL with EXPLAIN QUERY PLAN before it runs and bound
+    its wall-clock time and VM steps while it runs
+    """
+    _FROM_RE = re.compile(
+        r"(?:\bFROM|\bJOIN|,)\s*([\w\"`\[\]]+)(?:\s+(?:AS\s+)?"
+        r"(?!(?:ON|USING|WHERE|JOIN|GROUP|ORDER|LIMIT|LEFT|INNER|CROSS|NATURAL|FROM|HAVING|UNION)\b)(\w+))?",
+        re.IGNORECASE
+    )
+    _SCAN_RE = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?(.*)$")
+    _LIMIT_RE = re.compile(r"\bLIMIT\s+\d+\s*(?:OFFSET\s+\d+\s*)?;?\s*$", re.IGNORECASE)
+
+    def __init__(self, time_budget: float = 5.0, max_vm_steps: int = 100_000_000,
+                 max_join_rows: int = 10_000_000, large_table_rows: int = 100_000, interval: int = 10_000):
+        self.time_budget = time_budget
+        self.max_vm_steps = max_vm_steps
+        self.max_join_rows = max_join_rows
+        self.large_table_rows = large_table_rows
+        self.interval = interval
+
+    def _estimate_rows(self, conn: sqlite3.Connection, table: str) -> Optional[int]:
+        # MAX(rowid) อ่านจาก b-tree ได้ทันที ไม่ต้อง scan ทั้งตาราง
+        try:
+            row = conn.execute(f'SELECT MAX(rowid) FROM "{table}"').fetchone()
+            return row[0] or 0
+        except sqlite3.Error:
+            return None
+
+    def inspect(self, conn: sqlite3.Connection, query: str, params: Sequence[Any] = ()) -> Dict[str, Any]:
+        """
+        Return the query plan with full scans flagged. "blocked" is set when
+        the plan is a cartesian product over more than max_join_rows rows.
+        """
+        report: Dict[str, Any] = {"plan": [], "full_scans": [], "warnings": [], "blocked": None}
+        try:
+            plan = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        except sqlite3.Error:
+            # ให้ error จริงไปแสดงตอน execute
+            return report
+
+        aliases = {}
+        for table, alias in self._FROM_RE.findall(query):
+            table = table.strip('"`[]')
+            aliases[table.lower()] = table
+            if alias:
+                aliases[alias.lower()] = table
+
+        # Nested-loop joins of one SELECT are sibling rows under the same parent. Compound
+        # arms and subqueries hang under their own parent node and run one after another
+        loops: Dict[int, List[Dict[str, Any]]] = {}
+        for row in plan:
+            detail = row[3]
+            report["plan"].append(detail)
+            match = self._SCAN_RE.match(detail)
+            # SCAN ... USING (COVERING) INDEX ก็ยังอ่านทุกแถว นับเป็น full scan เหมือนกัน
+            if not match or match.group(1) in ("CONSTANT", "SUBQUERY"):
+                continue
+            name = match.group(2) or match.group(1)
+            table = aliases.get(name.lower(), aliases.get(match.group(1).lower(), match.group(1)))
+            rows = self._estimate_rows(conn, table)
+            scan = {"table": table, "estimated_rows": rows}
+            report["full_scans"].append(scan)
+            loops.setdefault(row[1], []).append(scan)
+            if rows is not None and rows >= self.large_table_rows:
+                report["warnings"].append(f"full scan of {table} (~{rows} rows)")
+
+        for scans in loops.values():
+            if len(scans) < 2:
+                continue
+            estimate = 1
+            for scan in scans:
+                estimate *= max(scan["estimated_rows"] or 1, 1)
+            tables = " x ".join(scan["table"] for scan in scans)
+            report["warnings"].append(f"cartesian product {tables} (~{estimate} row combinations)")
+            # ถ้ามี LIMIT อาจหยุดได้เร็ว ปล่อยให้ budget ตอนรันเป็นตัวตัดสิน
+            if estimate > self.max_join_rows and not self._LIMIT_RE.search(query) and not report["blocked"]:
+                report["blocked"] = f"cartesian product {tables} would visit ~{estimate} row combinations"
+        return report
+
+    @contextmanager
+    def budget(self, conn: sqlite3.Connection) -> Iterator[QueryBudget]:
+        """Abort the running statement once the time or VM-step budget is spent"""
+        budget = QueryBudget(self.time_budget, self.max_vm_steps, self.interval)
+        conn.set_progress_handler(budget, self.interval)
+        try:
+            yield budget
+        finally:
+            conn.set_progress_handler(None, self.interval)
+
+def describe_blocked_query(report: Dict[str, Any], reason: str, indexes: Dict[str, List[Dict[str, Any]]]) -> str:
+    """Structured observation telling the agent why the query was stopped and how to rewrite it"""
+    indexed = sorted({
+        f"{scan['table']}.{column}"
+        for scan in report["full_scans"]
+        for index in indexes.get(scan["table"], [])
+        for column in index["columns"]
+    })
+    details = {
+        "error": "query_too_expensive",
+        "reason": reason,
+        "warnings": report["warnings"],
+        "plan": report["plan"],
+        "hint": "Rewrite the query: filter on indexed columns"
+                + (f" ({', '.join(indexed)})" if indexed else "")
+                + ", add explicit JOIN ... ON conditions, add LIMIT, or aggregate instead of returning raw rows."
+    }
+    return f"Error query_too_expensive: {json.dumps(details, ensure_ascii=False, default=str)}"
+
+SEARCH_TABLE = "products_fts"
+SEARCH_COLUMNS = ["id", "name", "price", "category", "stock", "description", "score"]
+# bm25 weights per FTS column (name, description, category): a hit in the name counts most
+SEARCH_WEIGHTS = (10.0, 2.0, 5.0)
+SEARCH_SQL = (
+    "SELECT p.id, p.name, p.price, p.category, p.stock, p.description, "
+    f"round(bm25({SEARCH_TABLE}, {', '.join(map(str, SEARCH_WEIGHTS))}), 4) AS score "
+    f"FROM {SEARCH_TABLE} JOIN products p ON p.id = {SEARCH_TABLE}.rowid "
+    f"WHERE {SEARCH_TABLE} MATCH ? ORDER BY bm25({SEARCH_TABLE}, {', '.join(map(str, SEARCH_WEIGHTS))}) LIMIT ?"
+)
+
+def search_expressions(text: str) -> List[str]:
+    """
+    FTS5 MATCH expressions for free text, most specific first: every term (AND),
+    then any term (OR). Terms are quoted so user input can never be parsed as
+    FTS5 syntax (column filters, NEAR, a stray quote).
+    """
+    terms = list(dict.fromkeys(re.findall(r"\w+", text.lower())))
+    if not terms:
+        return []
+    quoted = [f'"{term}"' for term in terms]
+    expressions = [" ".join(quoted)]
+    if len(quoted) > 1:
+        expressions.append(" OR ".join(quoted))
+    return expressions
+
+STATS_COLUMNS = ["category", "product_count", "total_stock", "avg_price", "min_price", "max_price"]
+
+def normalize_stats_category(category: Optional[str]) -> Optional[str]:
+    """Tool input -> category name, or None for every category ("", "all", "*", quoted input)"""
+    category = (category or "").strip().strip("'\"").strip()
+    return None if category.lower() in ("", "all", "none", "*") else category
+
+def stats_queries(category: Optional[str]) -> List[Tuple[str, Tuple]]:
+    """The two O(categories) reads behind get_stats: per-category totals and the price histogram"""
+    where, params = ("WHERE category = ? COLLATE NOCASE", (category,)) if category else ("", ())
+    return [
+        (f"SELECT category, product_count, total_stock, price_sum, min_price, max_price "
+         f"FROM category_stats {where} ORDER BY category", params),
+        (f"SELECT bucket_start, bucket_end, SUM(product_count) FROM price_histogram {where} "
+         f"GROUP BY bucket_start, bucket_end ORDER BY bucket_start", params),
+    ]
+
+def render_stats(category_rows: Sequence[Tuple], bucket_rows: Sequence[Tuple]) -> Dict[str, Any]:
+    """
+    Combine category_stats and price_histogram rows (possibly several per key,
+    one per shard) into the get_stats observation
+    """
+    totals: Dict[str, List[Any]] = {}
+    for category, count, stock, price_sum, low, high in category_rows:
+        total = totals.get(category)
+        if total is None:
+            totals[category] = [count, stock, price_sum, low, high]
+            continue
+        total[0] += count
+        total[1] += stock
+        total[2] += price_sum
+        total[3] = min(total[3], low)
+        total[4] = max(total[4], high)
+
+    buckets: Dict[Tuple, int] = {}
+    for start, end, count in bucket_rows:
+        buckets[(start, end)] = buckets.get((start, end), 0) + count
+
+    return {
+        "columns": STATS_COLUMNS,
+        "rows": [(category, count, stock, round(price_sum / count, 2), low, high)
+                 for category, (count, stock, price_sum, low, high) in sorted(totals.items())],
+        "price_histogram": [(f"{start:g}-{end:g}" if end is not None else f"{start:g}+", count)
+                            for (start, end), count in sorted(buckets.items())]
+    }
+
+def render_schema_digest(schema: Dict[str, Any]) -> str:
+    """Compact one-line-per-table schema description for the system prompt"""
+    lines = []
+    for table_name, columns in schema["columns"].items():
+        if table_name.startswith("sqlite_"):
+            continue
+        parts = []
+        for col in columns:
+            part = f"{col['name']} {col['type']}".strip()
+            if col["pk"]:
+                part += " PK"
+            elif col["notnull"]:
+                part += " NOT NULL"
+            parts.append(part)
+        lines.append(f"{table_name}({', '.join(parts)})")
+        for index in schema["indexes"].get(table_name, []):
+            unique = "UNIQUE " if index["unique"] else ""
+            lines.append(f"  {unique}INDEX {index['name']} ON {table_name}({', '.join(index['columns'])})")
+    for table_name, columns in schema.get("fulltext", {}).items():
+        lines.append(f"FULLTEXT {table_name}({', '.join(columns)}) -- use the search_products tool")
+    return "\n".join(lines)
+
+schema_cache = SchemaCache()
+
+query_guard = QueryGuard(
+    time_budget=float(os.environ.get("QUERY_TIME_BUDGET", "5")),
+    max_vm_steps=int(os.environ.get("QUERY_MAX_VM_STEPS", "100000000")),
+    max_join_rows=int(os.environ.get("QUERY_MAX_JOIN_ROWS", "10000000"))
+)
@@ -0,0 +1,306 @@
+# fake_ollama.py
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# Scripted ReAct transcripts. The first transcript whose "match" appears in the
+# question is replayed; each LLM call returns the step after the number of
+# observations already in the conversation.
+DEFAULT_SCRIPT = [
+    {
+        "match": "count",
+        "steps": [
+            "Thought: I need to count the rows in products\nAction: execute_query\nAction Input: SELECT COUNT(*) FROM products",
+            "Thought: I now know the final answer\nFinal Answer: The products table has the counted number of records."
+        ]
+    },
+    {
+        "match": "schema",
+        "steps": [
+            "Thought: I should look at the schema\nAction: get_schema\nAction Input: ",
+            "Thought: I now know the final answer\nFinal Answer: The database has a products table."
+        ]
+    },
+    {
+        "match": "first",
+        "steps": [
+            "Thought: I need the first rows\nAction: execute_query\nAction Input: SELECT * FROM products LIMIT 5",
+            "Thought: I now know the final answer\nFinal Answer: Here are the first 5 products."
+        ]
+    },
+    {
+        "match": "",
+        "steps": [
+            "Thought: I should check the schema first\nAction: get_schema\nAction Input: ",
+            "Thought: Now I can query the data\nAction: execute_query\nAction Input: SELECT category, COUNT(*), AVG(price) FROM products GROUP BY category",
+            "Thought: I now know the final answer\nFinal Answer: Here is the summary per category."
+        ]
+    }
+]
+
+_TOKEN_RE = re.compile(r"\s*\S+|\s+")
+_ACTION_RE = re.compile(r"Action:\s*(\S+)\s*\nAction Input:[ \t]*(.*)", re.DOTALL)
+_FINAL_RE = re.compile(r"Final Answer:\s*(.*)", re.DOTALL)
+
+def to_tool_message(step: str) -> Dict[str, Any]:
+    """Convert a scripted ReAct step into a native tool-calling assistant message"""
+    match = _ACTION_RE.search(step)
+    if match is None:
+        final = _FINAL_RE.search(step)
+        return {"role": "assistant", "content": (final.group(1) if final else step).strip()}
+    name, tool_input = match.group(1), match.group(2).strip()
+    arguments = {"query": tool_input} if name == "execute_query" else {}
+    return {"role": "assistant", "content": "", "tool_calls": [{"function": {"name": name, "arguments": arguments}}]}
+
+class FakeOllama:
+    """
+    Minimal Ollama /api/chat server that replays scripted transcripts with a
+    configurable per-token latency, for benchmarks without a real model.
+    Prompt evaluation costs prompt_latency per token not shared with the
+    previous prompt for the same model, like Ollama's prompt cache.
+    """
+    def __init__(self, script: Optional[List[Dict[str, Any]]] = None, token_latency: float = 0.01,
+                 load_delay: float = 0.0, host: str = "localhost", port: int = 11434,
+                 prompt_latency: float = 0.0, parallel: Optional[int] = None):
+        self.script = script or DEFAULT_SCRIPT
+        self.token_latency = token_latency
+        self.load_delay = load_delay
+        self.prompt_latency = prompt_latency
+        self._last_prompt: Dict[str, str] = {}
+        # like OLLAMA_NUM_PARALLEL: chats beyond this many wait for a free slot
+        self._slots = threading.Semaphore(parallel) if parallel else None
+        self.host = host
+        self.port = port
+        self._lock = threading.Lock()
+        self._loaded_models = set()
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {"calls": 0, "tokens": 0, "loads": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0}
+
+    def _pick_reply(self, messages: List[Dict[str, Any]], tools: bool = False) -> str:
+        question = next((m.get("content", "") for m in messages if m.get("role") == "user"), "")
+        if tools:
+            # tool-calling mode: one step per tool result already in the conversation
+            step = sum(1 for m in messages if m.get("role") == "tool")
+        else:
+            conversation = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") != "system")
+            step = conversation.count("Observation:")
+        for transcript in self.script:
+            if transcript["match"].lower() in question.lower():
+                steps = transcript["steps"]
+                return steps[min(step, len(steps) - 1)]
+        return "Final Answer: I don't know."
+
+    def _load_model(self, model: str) -> None:
+        # จำลองเวลาโหลด model ครั้งแรก
+        with self._lock:
+            loaded = model in self._loaded_models
+            self._loaded_models.add(model)
+            if not loaded:
+                self.stats["loads"] += 1
+        if not loaded and self.load_delay:
+            time.sleep(self.load_delay)
+
+    def _unload_model(self, model: str) -> None:
+        with self._lock:
+            self._loaded_models.discard(model)
+            self._last_prompt.pop(model, None)
+
+    def _eval_prompt(self, model: str, messages: List[Dict[str, Any]]) -> None:
+        # นับ token คร่าว ๆ 4 ตัวอักษรต่อ token ส่วนที่ตรงกับ prompt ก่อนหน้าไม่ต้องประมวลผลใหม่
+        prompt = "".join(f"<{m.get('role')}>{m.get('content', '')}" for m in messages)
+        with self._lock:
+            shared = len(os.path.commonprefix([prompt, self._last_prompt.get(model, "")]))
+            self._last_prompt[model] = prompt
+            self.stats["prompt_tokens"] += len(prompt) // 4
+            self.stats["cached_prompt_tokens"] += shared // 4
+        if self.prompt_latency:
+            time.sleep(self.prompt_latency * (len(prompt) - shared) / 4)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload: Dict[str, Any], status: int = 200) -> None:
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _write_chunk(self, payload: Dict[str, Any]) -> None:
+                data = (json.dumps(payload) + "\n").encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            def _down(self) -> bool:
+                # stopped server: drop kept-alive connections without answering, like a crashed host
+                if server._server is None:
+                    self.close_connection = True
+                    return True
+                return False
+
+            def do_GET(self):
+                if self._down():
+                    return
+                if self.path == "/api/version":
+                    self._send_json({"version": "0.0.0-fake"})
+                elif self.path == "/api/tags":
+                    self._send_json({"models": [{"name": m, "model": m} for m in sorted(server._loaded_models)]})
+                elif self.path == "/_stats":
+                    with server._lock:
+                        self._send_json(dict(server.stats))
+                else:
+                    self._send_json({"error": "not found"}, status=404)
+
+            def do_POST(self):
+                if self._down():
+                    return
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                model = request.get("model", "")
+
+                unload = str(request.get("keep_alive")) in ("0", "0s")
+                if unload:
+                    server._unload_model(model)
+                if self.path == "/api/generate":
+                    if unload and not request.get("prompt"):
+                        # keep_alive=0 with no prompt only unloads the model
+                        self._send_json({"model": model, "response": "", "done": True, "done_reason": "unload"})
+                        return
+                    # warm-up / keep-alive requests with an empty prompt
+                    server._load_model(model)
+                    self._send_json({"model": model, "response": "", "done": True})
+                    return
+                if self.path != "/api/chat":
+                    self._send_json({"error": "not found"}, status=404)
+                    return
+
+                if server._slots is None:
+                    self._chat(request, model)
+                    return
+                with server._slots:
+                    self._chat(request, model)
+
+            def _chat(self, request: Dict[str, Any], model: str) -> None:
+                server._load_model(model)
+                messages = request.get("messages", [])
+                server._eval_prompt(model, messages)
+                if not any(m.get("role") == "user" for m in messages):
+                    # prefix priming from warm_up(): evaluate the prompt only
+                    self._send_json({"model": model, "message": {"role": "assistant", "content": ""},
+                                     "done": True, "done_reason": "length", "eval_count": 0})
+                    return
+                tools = bool(request.get("tools"))
+                reply = server._pick_reply(messages, tools=tools)
+                stop = (request.get("options") or {}).get("stop") or []
+                for sequence in stop:
+                    if sequence in reply:
+                        reply = reply[:reply.index(sequence)]
+                message = to_tool_message(reply) if tools else {"role": "assistant", "content": reply}
+                if "tool_calls" in message:
+                    # tool calls arrive as one chunk; cost them as the JSON the model would generate
+                    tokens = _TOKEN_RE.findall(json.dumps(message["tool_calls"][0]["function"]))
+                else:
+                    tokens = _TOKEN_RE.findall(message["content"])
+                with server._lock:
+                    server.stats["calls"] += 1
+                    server.stats["tokens"] += len(tokens)
+
+                created_at = datetime.now(timezone.utc).isoformat()
+                started = time.perf_counter()
+                if not request.get("stream", True):
+                    time.sleep(server.token_latency * len(tokens))
+                    self._send_json({
+                        "model": model, "created_at": created_at,
+                        "message": message,
+                        "done": True, "done_reason": "stop", "eval_count": len(tokens)
+                    })
+                    return
+
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                if "tool_calls" in message:
+                    time.sleep(server.token_latency * len(tokens))
+                    self._write_chunk({"model": model, "created_at": created_at, "message": message, "done": False})
+                else:
+                    for token in tokens:
+                        time.sleep(server.token_latency)
+                        self._write_chunk({
+                            "model": model, "created_at": created_at,
+                            "message": {"role": "assistant", "content": token}, "done": False
+                        })
+                self._write_chunk({
+                    "model": model, "created_at": created_at,
+                    "message": {"role": "assistant", "content": ""},
+                    "done": True, "done_reason": "stop",
+                    "total_duration": int((time.perf_counter() - started) * 1e9),
+                    "eval_count": len(tokens)
+                })
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self) -> "FakeOllama":
+        self._server = ThreadingHTTPServer((self.host, self.port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeOllama":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake Ollama server for offline benchmarks')
+    parser.add_argument('--host', type=str, default="localhost")
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--token-latency', type=float, default=0.01, help='Seconds per streamed token')
+    parser.add_argument('--load-delay', type=float, default=0.0, help='Seconds to "load" a model on first use')
+    parser.add_argument('--prompt-latency', type=float, default=0.0, help='Seconds per uncached prompt token')
+    parser.add_argument('--parallel', type=int, help='Concurrent chats served at once (default: unlimited)')
+    parser.add_argument('--script', type=str, help='JSON file with [{"match": ..., "steps": [...]}, ...]')
+    args = parser.parse_args()
+
+    script = None
+    if args.script:
+        with open(args.script, encoding="utf-8") as f:
+            script = json.load(f)
+
+    fake = FakeOllama(script, token_latency=args.token_latency, load_delay=args.load_delay,
+                      prompt_latency=args.prompt_latency, parallel=args.parallel,
+                      host=args.host, port=args.port).start()
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
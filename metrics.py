@@ -0,0 +1,299 @@
+# metrics.py
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            return dict(self._values)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            return self.header() + [
+                f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+                for key, value in sorted(self._values.items())
+            ]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry["buckets"][i] += 1
+            entry["sum"] += value
+            entry["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        with self._lock:
+            for key, entry in sorted(self._values.items()):
+                labels = _format_labels(self.labelnames, key)
+                for bound, count in zip(self.buckets, entry["buckets"]):
+                    bucket_labels = _format_labels(self.labelnames, key, 'le="%g"' % bound)
+                    lines.append(f"{self.name}_bucket{bucket_labels} {count}")
+                inf_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{inf_labels} {entry['count']}")
+                lines.append(f"{self.name}_sum{labels} {entry['sum']}")
+                lines.append(f"{self.name}_count{labels} {entry['count']}")
+        return lines
+
+class Registry:
+    """Minimal Prometheus text-format registry"""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> Any:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+REQUESTS = registry.counter("agent_requests_total", "Agent runs by outcome", ["status"])
+REQUEST_DURATION = registry.histogram("agent_request_duration_seconds", "End-to-end agent run time")
+LLM_CALL_DURATION = registry.histogram("agent_llm_call_duration_seconds", "Time per LLM call")
+LLM_TTFT = registry.histogram("agent_llm_time_to_first_token_seconds", "Time to first streamed token per LLM call")
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "agent_llm_tokens_per_second", "Generation speed per LLM call",
+    buckets=(1, 2, 5, 10, 20, 40, 80, 160, 320)
+)
+LLM_CALLS = registry.counter("agent_llm_calls_total", "LLM calls")
+TOOL_CALL_DURATION = registry.histogram(
+    "agent_tool_call_duration_seconds", "Time per tool call", ["tool"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+)
+ITERATIONS = registry.histogram("agent_iterations", "Agent iterations per run", buckets=(1, 2, 3, 4, 5, 6, 8, 10))
+PARSE_FAILURES = registry.counter("agent_parse_failures_total", "LLM outputs that could not be parsed")
+GRAPH_OVERHEAD = registry.histogram("agent_graph_overhead_seconds", "Run time not spent in LLM or tool calls")
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    Per-request handler recording LLM calls (time to first token, tokens/s),
+    tool calls, iterations and parse failures. finish() exports the numbers
+    to the registry; trace() returns them as JSON-friendly dict.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.status: Optional[str] = None
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.tool_calls: List[Dict[str, Any]] = []
+        self.iterations = 0
+        self.parse_failures = 0
+        self._llm_runs: Dict[UUID, Dict[str, Any]] = {}
+        self._tool_runs: Dict[UUID, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._llm_runs[run_id] = {"start": time.perf_counter(), "first_token": None, "tokens": 0}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self.on_chat_model_start(serialized, prompts, run_id=run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            run = self._llm_runs.get(run_id)
+            if run is None:
+                return
+            if run["first_token"] is None:
+                run["first_token"] = time.perf_counter()
+            run["tokens"] += 1
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        end = time.perf_counter()
+        with self._lock:
+            run = self._llm_runs.pop(run_id, None)
+        if run is None:
+            return
+
+        tokens = run["tokens"]
+        if not tokens:
+            # ไม่ได้ stream: ใช้ eval_count จาก Ollama ถ้ามี ไม่งั้นนับคำคร่าว ๆ
+            for generations in getattr(response, "generations", []):
+                for generation in generations:
+                    info = getattr(generation, "generation_info", None) or {}
+                    tokens += info.get("eval_count") or len(generation.text.split())
+
+        duration = end - run["start"]
+        ttft = (run["first_token"] - run["start"]) if run["first_token"] else None
+        generation_time = end - (run["first_token"] or run["start"])
+        call = {
+            "duration_ms": duration * 1000,
+            "ttft_ms": ttft * 1000 if ttft is not None else None,
+            "tokens": tokens,
+            "tokens_per_s": tokens / generation_time if generation_time > 0 else None
+        }
+        with self._lock:
+            self.llm_calls.append(call)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        with self._lock:
+            self._llm_runs.pop(run_id, None)
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name") or "unknown"
+        with self._lock:
+            self._tool_runs[run_id] = {"tool": name, "start": time.perf_counter()}
+            # AgentExecutor เรียก tool ชื่อ _Exception เมื่อ parse output ของ LLM ไม่ได้
+            if name == "_Exception":
+                self.parse_failures += 1
+
+    def _end_tool(self, run_id: UUID, error: bool) -> None:
+        end = time.perf_counter()
+        with self._lock:
+            run = self._tool_runs.pop(run_id, None)
+            if run is None or run["tool"] == "_Exception":
+                return
+            self.tool_calls.append({
+                "tool": run["tool"],
+                "duration_ms": (end - run["start"]) * 1000,
+                "error": error
+            })
+
+    def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_tool(run_id, error=str(getattr(output, "content", output)).startswith("Error"))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end_tool(run_id, error=True)
+
+    def on_agent_action(self, action: Any, **kwargs: Any) -> None:
+        with self._lock:
+            self.iterations += 1
+
+    def on_agent_finish(self, finish: Any, **kwargs: Any) -> None:
+        with self._lock:
+            self.iterations += 1
+
+    def finish(self, status: str = "ok") -> None:
+        """Close the trace and export it to the metrics registry"""
+        if self.finished is not None:
+            return
+        self.finished = time.perf_counter()
+        self.status = status
+        if not self.iterations:
+            # tool-calling mode ไม่มี agent action ให้นับรอบจากจำนวนครั้งที่เรียก LLM
+            self.iterations = len(self.llm_calls)
+
+        total = self.finished - self.started
+        REQUESTS.inc(status=status)
+        REQUEST_DURATION.observe(total)
+        for call in self.llm_calls:
+            LLM_CALLS.inc()
+            LLM_CALL_DURATION.observe(call["duration_ms"] / 1000)
+            if call["ttft_ms"] is not None:
+                LLM_TTFT.observe(call["ttft_ms"] / 1000)
+            if call["tokens_per_s"] is not None:
+                LLM_TOKENS_PER_SECOND.observe(call["tokens_per_s"])
+        for call in self.tool_calls:
+            TOOL_CALL_DURATION.observe(call["duration_ms"] / 1000, tool=call["tool"])
+        if status != "cached":
+            ITERATIONS.observe(self.iterations)
+            GRAPH_OVERHEAD.observe(max(total - self._busy_seconds(), 0))
+        if self.parse_failures:
+            PARSE_FAILURES.inc(self.parse_failures)
+
+    def _busy_seconds(self) -> float:
+        return (sum(call["duration_ms"] for call in self.llm_calls)
+                + sum(call["duration_ms"] for call in self.tool_calls)) / 1000
+
+    def trace(self) -> Dict[str, Any]:
+        end = self.finished or time.perf_counter()
+        total = end - self.started
+        return {
+            "status": self.status,
+            "total_ms": total * 1000,
+            "llm_ms": sum(call["duration_ms"] for call in self.llm_calls),
+            "tool_ms": sum(call["duration_ms"] for call in self.tool_calls),
+            "graph_overhead_ms": max(total - self._busy_seconds(), 0) * 1000,
+            "iterations": self.iterations,
+            "parse_failures": self.parse_failures,
+            "llm_calls": list(self.llm_calls),
+            "tool_calls": list(self.tool_calls)
+        }
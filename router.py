@@ -0,0 +1,229 @@
+# router.py
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from cache import normalize_question
+from metrics import registry
+
+ROUTER_DECISIONS = registry.counter("agent_router_decisions_total", "Fast-path routing decisions", ["intent"])
+
+NUMBER_WORDS = {
+    "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "twenty": 20
+}
+
+_NUMBER = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+_PRICE = r"(\d[\d,]*(?:\.\d+)?k?)"
+_TABLE = r"(?:\s+(?:from|in|of)\s+(?:the\s+)?(\w+)(?:\s+table)?)?"
+
+SCHEMA_RE = re.compile(
+    r"^(?:show|get|describe|display|list|what is|what's)?\s*(?:me\s+)?(?:the\s+)?(?:database\s+|db\s+)?"
+    r"(?:schema|tables|table list|structure)(?:\s+of\s+the\s+database)?$"
+)
+FIRST_ROWS_RE = re.compile(
+    r"^(?:show|get|list|display|select)\s+(?:me\s+)?(?:the\s+)?(?:first|top)\s+" + _NUMBER
+    + r"\s+(?:rows|records|entries|products)" + _TABLE + "$"
+)
+COUNT_RE = re.compile(
+    r"^(?:count|how many)\s+(?:the\s+)?(?:total\s+)?(?:number\s+of\s+)?(?:records|rows|entries)" + _TABLE
+    + r"(?:\s+are there)?$"
+)
+BETWEEN_RE = re.compile(r"\b(?:priced\s+)?between\s+" + _PRICE + r"\s+(?:and|to|-)\s+" + _PRICE)
+_PRICED = r"\b(?:priced\s+|costing\s+|that cost\s+)?"
+MAX_PRICE_RE = re.compile(_PRICED + r"(?:under|below|less than|cheaper than)\s+" + _PRICE)
+MAX_PRICE_INCLUSIVE_RE = re.compile(_PRICED + r"(?:at most|up to|no more than|not more than)\s+" + _PRICE)
+MIN_PRICE_RE = re.compile(_PRICED + r"(?:over|above|more than|pricier than)\s+" + _PRICE)
+MIN_PRICE_INCLUSIVE_RE = re.compile(_PRICED + r"(?:at least|no less than|not less than)\s+" + _PRICE)
+# "no more than" ต้องเช็คก่อน "more than" ไม่งั้นได้เครื่องหมายกลับด้าน
+PRICE_BOUNDS = (
+    (MAX_PRICE_INCLUSIVE_RE, "<="),
+    (MIN_PRICE_INCLUSIVE_RE, ">="),
+    (MAX_PRICE_RE, "<"),
+    (MIN_PRICE_RE, ">"),
+)
+CURRENCY_RE = re.compile(r"\b(?:baht|thb|฿)\b|฿")
+
+# คำที่เหลือได้หลังตัด category/ราคาออกแล้ว ถ้ามีคำอื่นปนอยู่ให้ส่งต่อไปที่ LLM
+FILLER_WORDS = {
+    "show", "list", "find", "get", "display", "give", "me", "all", "the", "a", "products", "product",
+    "items", "item", "in", "from", "category", "categories", "with", "price", "prices", "priced",
+    "that", "are", "is", "cost", "costing", "which", "what", "of", "table", "there", "and"
+}
+COUNT_WORDS = ("count", "how many", "number of")
+
+def _parse_number(text: str) -> int:
+    return NUMBER_WORDS.get(text) or int(text)
+
+def _parse_price(text: str) -> float:
+    text = text.replace(",", "")
+    if text.endswith("k"):
+        return float(text[:-1]) * 1000
+    return float(text)
+
+class FastPathRouter:
+    """
+    Answer common questions (schema, first N rows, record counts, category and
+    price filters) from parameterized SQL templates without calling the LLM.
+    route() returns None for anything it does not recognize.
+    """
+    def __init__(self, db_tools: Any, table: str = "products", max_rows: int = 50, categories_ttl: float = 30.0):
+        self.db_tools = db_tools
+        self.table = table
+        self.max_rows = max_rows
+        self.categories_ttl = categories_ttl
+        self._categories: Tuple[float, List[str]] = (0.0, [])
+        self._lock = threading.Lock()
+
+    def _tables(self) -> List[str]:
+        schema = self.db_tools.get_table_schema()
+        return list(schema) if isinstance(schema, dict) else []
+
+    def _resolve_table(self, name: Optional[str]) -> Optional[str]:
+        # ใช้ได้เฉพาะชื่อตารางที่มีอยู่จริง ชื่อจากผู้ใช้จะไม่ถูกต่อเข้า SQL ตรง ๆ
+        name = name or self.table
+        for table in self._tables():
+            if table.lower() == name.lower():
+                return table
+        return None
+
+    def _known_categories(self) -> List[str]:
+        with self._lock:
+            loaded_at, categories = self._categories
+            if time.monotonic() - loaded_at < self.categories_ttl:
+                return categories
+        if self._resolve_table(self.table) is None:
+            return []
+        rows = self.db_tools.execute_query(f"SELECT DISTINCT category FROM {self.table}")
+        categories = [row[0] for row in rows] if isinstance(rows, list) else []
+        with self._lock:
+            self._categories = (time.monotonic(), categories)
+        return categories
+
+    def _match_category(self, question: str) -> Tuple[Optional[str], str]:
+        for category in sorted(self._known_categories(), key=len, reverse=True):
+            singular = category.lower().rstrip("s")
+            pattern = re.compile(r"\b" + re.escape(singular) + r"s?\b")
+            if pattern.search(question):
+                return category, pattern.sub(" ", question, count=1)
+        return None, question
+
+    def _filter_route(self, question: str) -> Optional[Dict[str, Any]]:
+        conditions, params, rest = [], [], question
+
+        match = BETWEEN_RE.search(rest)
+        if match:
+            low, high = sorted((_parse_price(match.group(1)), _parse_price(match.group(2))))
+            conditions.append("price BETWEEN ? AND ?")
+            params.extend([low, high])
+            rest = rest.replace(match.group(0), " ")
+        else:
+            for regex, operator in PRICE_BOUNDS:
+                match = regex.search(rest)
+                if match:
+                    conditions.append(f"price {operator} ?")
+                    params.append(_parse_price(match.group(1)))
+                    rest = rest.replace(match.group(0), " ")
+
+        category, rest = self._match_category(rest)
+        if category is not None:
+            conditions.insert(0, "category = ?")
+            params.insert(0, category)
+
+        if not conditions:
+            return None
+
+        is_count = any(word in rest for word in COUNT_WORDS)
+        for word in COUNT_WORDS:
+            rest = rest.replace(word, " ")
+        rest = CURRENCY_RE.sub(" ", rest)
+        if any(word not in FILLER_WORDS for word in re.findall(r"[\w']+", rest)):
+            return None
+
+        where = " AND ".join(conditions)
+        if is_count:
+            return {"intent": "filter_count", "sql": f"SELECT COUNT(*) FROM {self.table} WHERE {where}",
+                    "params": params}
+        # อ่านเกิน max_rows หนึ่งแถว จะได้รู้ว่ามีผลลัพธ์ที่ถูกตัดออก
+        return {
+            "intent": "filter",
+            "sql": f"SELECT id, name, price, category, stock FROM {self.table} WHERE {where} ORDER BY price LIMIT ?",
+            "params": params + [self.max_rows + 1],
+            "count_sql": f"SELECT COUNT(*) FROM {self.table} WHERE {where}",
+            "count_params": params
+        }
+
+    def match(self, question: str) -> Optional[Dict[str, Any]]:
+        """Return {"intent", "sql", "params"} for a recognized question, otherwise None"""
+        question = normalize_question(question)
+
+        if SCHEMA_RE.match(question):
+            return {"intent": "schema", "sql": None, "params": []}
+
+        match = FIRST_ROWS_RE.match(question)
+        if match:
+            table = self._resolve_table(match.group(2))
+            if table is None:
+                return None
+            limit = min(_parse_number(match.group(1)), self.max_rows)
+            return {"intent": "first_rows", "sql": f'SELECT * FROM "{table}" LIMIT ?', "params": [limit]}
+
+        match = COUNT_RE.match(question)
+        if match:
+            table = self._resolve_table(match.group(1))
+            if table is None:
+                return None
+            return {"intent": "count", "sql": f'SELECT COUNT(*) FROM "{table}"', "params": []}
+
+        if self._resolve_table(self.table) is None:
+            return None
+        return self._filter_route(question)
+
+    def route(self, question: str) -> Optional[Dict[str, Any]]:
+        """Match and execute. Returns {"intent", "sql", "output"} or None to fall through to the LLM."""
+        try:
+            route = self.match(question)
+        except Exception:
+            route = None
+        if route is None:
+            ROUTER_DECISIONS.inc(intent="fallthrough")
+            return None
+
+        if route["intent"] == "schema":
+            output = self.db_tools.get_table_schema()
+        else:
+            output = self.db_tools.execute_query(route["sql"], route["params"])
+        if isinstance(output, str) and output.startswith("Error"):
+            ROUTER_DECISIONS.inc(intent="fallthrough")
+            return None
+
+        if route["intent"] in ("count", "filter_count"):
+            output = output[0][0]
+        elif route["intent"] == "filter" and len(output) > self.max_rows:
+            output = self._truncated(route, output[:self.max_rows])
+        ROUTER_DECISIONS.inc(intent=route["intent"])
+        return {"intent": route["intent"], "sql": route["sql"], "output": str(output)}
+
+    def _truncated(self, route: Dict[str, Any], rows: List[Tuple]) -> Dict[str, Any]:
+        """Same shape as a truncated execute_query result, so a partial list is not taken for all matches"""
+        counted = self.db_tools.execute_query(route["count_sql"], route["count_params"])
+        row_count = counted[0][0] if isinstance(counted, list) else None
+        return {
+            "truncated": True,
+            "row_count": row_count,
+            "columns": ["id", "name", "price", "category", "stock"],
+            "preview": rows,
+            "note": f"Only the {len(rows)} cheapest of {row_count if row_count is not None else 'more'} "
+                    f"matching products are listed"
+        }
+
+def router_stats(baseline: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """
+    Fast-path decisions of every router in the process and the share answered
+    without the LLM. baseline is an earlier result's "decisions", to count only what came after.
+    """
+    decisions = {key[0]: value - (baseline or {}).get(key[0], 0) for key, value in ROUTER_DECISIONS.samples().items()}
+    total = sum(decisions.values())
+    routed = total - decisions.get("fallthrough", 0)
+    return {"decisions": decisions, "hit_rate": routed / total if total else 0.0}
@@ -0,0 +1,277 @@
+# sessions.py
+import asyncio
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (WRITES_IDX_MAP, BaseCheckpointSaver, ChannelVersions, Checkpoint,
+                                       CheckpointMetadata, CheckpointTuple, get_checkpoint_id,
+                                       get_checkpoint_metadata)
+
+# ประมาณจำนวน token จากความยาวข้อความ ไม่ต้องโหลด tokenizer ของ model
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: Any) -> int:
+    return -(-len(str(text)) // CHARS_PER_TOKEN)
+
+def _clip(text: str, max_tokens: int) -> str:
+    limit = max(max_tokens, 1) * CHARS_PER_TOKEN
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+def compact_turn(question: str, output: Any, sql: Optional[str], max_tokens: int) -> List[Any]:
+    """
+    One finished turn as a question and a short note with the SQL that answered
+    it and the beginning of the answer. Tool observations are not kept.
+    """
+    note = f"SQL: {sql}\n" if sql else ""
+    answer = "" if output is None else str(output)
+    return [HumanMessage(content=question),
+            AIMessage(content=note + "Answer: " + _clip(answer, max_tokens - estimate_tokens(note)))]
+
+def compact_history(history: List[Any], max_tokens: int) -> List[Any]:
+    """Drop the oldest turns (question/answer pairs) until the history fits in max_tokens"""
+    history = list(history)
+    while history and sum(estimate_tokens(message.content) for message in history) > max_tokens:
+        del history[:2]
+    return history
+
+# คำที่ชี้กลับไปหาคำถามก่อนหน้า ("what about ...", "their price") ถ้าไม่มีถือว่าคำถามนี้ตอบได้ด้วยตัวเอง
+_FOLLOW_UP_RE = re.compile(
+    r"^\s*(and|or|but|also|so|then|now|just|only|what about|how about|which of|sort|order|filter)\b"
+    r"|\b(it|its|they|them|their|those|these|this one|that one|same|previous|above|earlier|again|instead"
+    r"|as well|too|ones|the rest|others)\b",
+    re.I
+)
+
+def is_follow_up(question: str, history: Sequence[Any]) -> bool:
+    """True when the question needs the earlier turns, so an answer cached for the bare question won't do"""
+    return bool(history) and _FOLLOW_UP_RE.search(question) is not None
+
+class SQLiteSessionSaver(BaseCheckpointSaver[str]):
+    """
+    LangGraph checkpointer for conversation sessions in a local SQLite file.
+    Only the latest checkpoint of each session is kept (no time travel), and
+    the least recently used sessions beyond max_sessions are deleted.
+    """
+    def __init__(self, path: str, max_sessions: int = 1000):
+        super().__init__()
+        self.path = path
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # เปิดไฟล์ตอนใช้ครั้งแรก import เฉย ๆ จะได้ไม่สร้างไฟล์
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript('''
+            CREATE TABLE IF NOT EXISTS session_checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                parent_id TEXT,
+                type TEXT NOT NULL,
+                checkpoint BLOB NOT NULL,
+                metadata_type TEXT NOT NULL,
+                metadata BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns)
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_checkpoints_last_used ON session_checkpoints(last_used);
+            CREATE TABLE IF NOT EXISTS session_writes (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                checkpoint_id TEXT NOT NULL,
+                task_id TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                channel TEXT NOT NULL,
+                type TEXT NOT NULL,
+                value BLOB NOT NULL,
+                task_path TEXT NOT NULL,
+                PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+            );
+            ''')
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _tuple(self, row: Sequence[Any]) -> CheckpointTuple:
+        thread_id, checkpoint_ns, checkpoint_id, parent_id, type_, checkpoint, metadata_type, metadata = row
+        writes = self._connection().execute('''
+        SELECT task_id, channel, type, value FROM session_writes
+        WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ? ORDER BY task_id, idx
+        ''', (thread_id, checkpoint_ns, checkpoint_id)).fetchall()
+
+        def config(checkpoint_id: str) -> RunnableConfig:
+            return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}}
+
+        return CheckpointTuple(
+            config=config(checkpoint_id),
+            checkpoint=self.serde.loads_typed((type_, checkpoint)),
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            parent_config=config(parent_id) if parent_id else None,
+            pending_writes=[(task_id, channel, self.serde.loads_typed((value_type, value)))
+                            for task_id, channel, value_type, value in writes]
+        )
+
+    def _latest(self, thread_id: str, checkpoint_ns: Optional[str]) -> List[Sequence[Any]]:
+        sql = '''
+        SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata
+        FROM session_checkpoints WHERE thread_id = ?
+        '''
+        if checkpoint_ns is None:
+            return self._connection().execute(sql, (thread_id,)).fetchall()
+        return self._connection().execute(sql + " AND checkpoint_ns = ?", (thread_id, checkpoint_ns)).fetchall()
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        configurable = config["configurable"]
+        with self._lock:
+            rows = self._latest(configurable["thread_id"], configurable.get("checkpoint_ns", ""))
+            checkpoint_id = get_checkpoint_id(config)
+            if not rows or (checkpoint_id and rows[0][2] != checkpoint_id):
+                return None
+            return self._tuple(rows[0])
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            if config:
+                rows = self._latest(config["configurable"]["thread_id"], config["configurable"].get("checkpoint_ns"))
+            else:
+                rows = self._connection().execute('''
+                SELECT thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata
+                FROM session_checkpoints ORDER BY last_used DESC
+                ''').fetchall()
+            found = [self._tuple(row) for row in rows]
+        checkpoint_id = get_checkpoint_id(config) if config else None
+        before_id = get_checkpoint_id(before) if before else None
+        for item in found:
+            if limit is not None and limit <= 0:
+                break
+            current_id = item.config["configurable"]["checkpoint_id"]
+            if checkpoint_id and current_id != checkpoint_id:
+                continue
+            if before_id and current_id >= before_id:
+                continue
+            if filter and not all(item.metadata.get(key) == value for key, value in filter.items()):
+                continue
+            if limit is not None:
+                limit -= 1
+            yield item
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        type_, data = self.serde.dumps_typed(checkpoint)
+        metadata_type, metadata_data = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+        with self._lock:
+            conn = self._connection()
+            conn.execute('''
+            INSERT OR REPLACE INTO session_checkpoints
+            (thread_id, checkpoint_ns, checkpoint_id, parent_id, type, checkpoint, metadata_type, metadata, last_used)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                  type_, data, metadata_type, metadata_data, time.time()))
+            # pending writes ของ checkpoint ก่อนหน้าถูกรวมเข้า checkpoint ใหม่แล้ว
+            conn.execute('''
+            DELETE FROM session_writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id != ?
+            ''', (thread_id, checkpoint_ns, checkpoint["id"]))
+            stale = [row[0] for row in conn.execute('''
+            SELECT thread_id FROM session_checkpoints GROUP BY thread_id
+            ORDER BY MAX(last_used) DESC LIMIT -1 OFFSET ?
+            ''', (self.max_sessions,))]
+            for stale_id in stale:
+                self._delete(conn, stale_id)
+            conn.commit()
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple], task_id: str, task_path: str = "") -> None:
+        configurable = config["configurable"]
+        rows = []
+        for idx, (channel, value) in enumerate(writes):
+            type_, data = self.serde.dumps_typed(value)
+            rows.append((configurable["thread_id"], configurable.get("checkpoint_ns", ""),
+                         configurable["checkpoint_id"], task_id, WRITES_IDX_MAP.get(channel, idx),
+                         channel, type_, data, task_path))
+        # ค่าพิเศษ (error, interrupt) เขียนทับได้ ค่าปกติเก็บครั้งแรกครั้งเดียว
+        verb = "INSERT OR REPLACE" if all(channel in WRITES_IDX_MAP for channel, _ in writes) else "INSERT OR IGNORE"
+        with self._lock:
+            conn = self._connection()
+            conn.executemany(f'''
+            {verb} INTO session_writes
+            (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+
+    def _delete(self, conn: sqlite3.Connection, thread_id: str) -> None:
+        conn.execute('DELETE FROM session_checkpoints WHERE thread_id = ?', (thread_id,))
+        conn.execute('DELETE FROM session_writes WHERE thread_id = ?', (thread_id,))
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            self._delete(conn, thread_id)
+            conn.commit()
+
+    def count(self) -> int:
+        # Not __len__: LangGraph treats a falsy checkpointer as no checkpointer
+        with self._lock:
+            return self._connection().execute(
+                'SELECT COUNT(DISTINCT thread_id) FROM session_checkpoints'
+            ).fetchone()[0]
+
+    # The sync methods block on the lock and on disk, so the async API runs them in a worker thread
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        # Same version format as langgraph's InMemorySaver
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+# Compacted history per session is kept under this many (estimated) tokens
+SESSION_HISTORY_TOKENS = int(os.environ.get("SESSION_HISTORY_TOKENS", "1000"))
+
+# Next to the app, not in whatever directory the process was started from
+SESSION_STORE_PATH = os.environ.get("SESSION_STORE_PATH",
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.db"))
+
+session_store = SQLiteSessionSaver(
+    SESSION_STORE_PATH,
+    max_sessions=int(os.environ.get("SESSION_MAX", "1000"))
+)
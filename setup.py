@@ -1,30 +1,254 @@
+import argparse
+import csv
+import itertools
+import json
+import random
 import sqlite3
 import os
+import time
 from datetime import datetime
 
-def init_database():
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(__file__), 'products.db')
+
+PRODUCT_INDEXES = {
+    'idx_products_category': 'CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)',
+    'idx_products_price': 'CREATE INDEX IF NOT EXISTS idx_products_price ON products(price)',
+    'idx_products_stock': 'CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock)',
+    # lets the stats triggers re-read MIN/MAX(price) of one category with a single index seek
+    'idx_products_category_price': 'CREATE INDEX IF NOT EXISTS idx_products_category_price ON products(category, price)',
+}
+
+INSERT_PRODUCT_SQL = '''
+INSERT OR REPLACE INTO products (id, name, price, category, stock, description)
+VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+def create_products_table(cursor):
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        price REAL NOT NULL,
+        category TEXT NOT NULL,
+        stock INTEGER NOT NULL,
+        description TEXT,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+
+def create_indexes(cursor):
+    for sql in PRODUCT_INDEXES.values():
+        cursor.execute(sql)
+
+def drop_indexes(cursor):
+    for name in PRODUCT_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+
+# External-content FTS5 index: the text lives only in products, products_fts keeps the tokens
+SEARCH_INDEX_SQL = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    name, description, category,
+    content='products', content_rowid='id',
+    tokenize='porter unicode61 remove_diacritics 2'
+)
+'''
+
+# INSERT OR REPLACE does not fire DELETE triggers (recursive_triggers is off),
+# so the BEFORE INSERT trigger removes the old tokens of a replaced row itself
+SEARCH_TRIGGERS = {
+    'products_fts_bi': '''
+    CREATE TRIGGER IF NOT EXISTS products_fts_bi BEFORE INSERT ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, category)
+        SELECT 'delete', id, name, description, category FROM products WHERE id = new.id;
+    END''',
+    'products_fts_ai': '''
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END''',
+    'products_fts_ad': '''
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+    END''',
+    'products_fts_au': '''
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description, category ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description, category)
+        VALUES ('delete', old.id, old.name, old.description, old.category);
+        INSERT INTO products_fts(rowid, name, description, category)
+        VALUES (new.id, new.name, new.description, new.category);
+    END''',
+}
+
+def create_search_index(cursor):
+    cursor.execute(SEARCH_INDEX_SQL)
+    for sql in SEARCH_TRIGGERS.values():
+        cursor.execute(sql)
+
+def drop_search_triggers(cursor):
+    for name in SEARCH_TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+def rebuild_search_index(cursor):
+    """Re-tokenize every product into products_fts (after a bulk load or to repair drift)"""
+    cursor.execute("INSERT INTO products_fts(products_fts) VALUES('rebuild')")
+    cursor.execute("INSERT INTO products_fts(products_fts) VALUES('optimize')")
+
+# Lower bounds of the price_histogram buckets (baht); the last bucket is open-ended
+PRICE_BUCKETS = (0, 1000, 5000, 10000, 20000, 50000, 100000, 200000)
+
+def _bucket_sql(price, edge):
+    """CASE expression mapping a price to the start (or end) of its histogram bucket"""
+    cases = ' '.join(f'WHEN {price} < {high} THEN {low if edge == "start" else high}'
+                     for low, high in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:]))
+    return f'CASE {cases} ELSE {PRICE_BUCKETS[-1] if edge == "start" else "NULL"} END'
+
+STATS_TABLES = (
+    '''
+    CREATE TABLE IF NOT EXISTS category_stats (
+        category TEXT PRIMARY KEY,
+        product_count INTEGER NOT NULL,
+        total_stock INTEGER NOT NULL,
+        price_sum REAL NOT NULL,
+        min_price REAL,
+        max_price REAL
+    )''',
+    '''
+    CREATE TABLE IF NOT EXISTS price_histogram (
+        category TEXT NOT NULL,
+        bucket_start REAL NOT NULL,
+        bucket_end REAL,
+        product_count INTEGER NOT NULL,
+        PRIMARY KEY (category, bucket_start)
+    ) WITHOUT ROWID''',
+)
+
+def _stats_add(row):
+    return f'''
+        INSERT INTO category_stats (category, product_count, total_stock, price_sum, min_price, max_price)
+        VALUES ({row}.category, 1, {row}.stock, {row}.price, {row}.price, {row}.price)
+        ON CONFLICT(category) DO UPDATE SET
+            product_count = product_count + 1,
+            total_stock = total_stock + excluded.total_stock,
+            price_sum = price_sum + excluded.price_sum,
+            min_price = min(min_price, excluded.min_price),
+            max_price = max(max_price, excluded.max_price);
+        INSERT INTO price_histogram (category, bucket_start, bucket_end, product_count)
+        VALUES ({row}.category, {_bucket_sql(row + '.price', 'start')}, {_bucket_sql(row + '.price', 'end')}, 1)
+        ON CONFLICT(category, bucket_start) DO UPDATE SET product_count = product_count + 1;'''
+
+def _stats_remove(source):
+    # ลบแถวที่เป็น min/max ไม่รู้ค่าถัดไป จึง mark เป็น NULL แล้วให้ _STATS_FIX_EDGES อ่านใหม่จาก index
+    return f'''
+        UPDATE category_stats SET
+            product_count = product_count - 1,
+            total_stock = total_stock - o.stock,
+            price_sum = price_sum - o.price,
+            min_price = CASE WHEN o.price <= min_price THEN NULL ELSE min_price END,
+            max_price = CASE WHEN o.price >= max_price THEN NULL ELSE max_price END
+        FROM ({source}) AS o WHERE category_stats.category = o.category;
+        UPDATE price_histogram SET product_count = product_count - 1
+        FROM ({source}) AS o
+        WHERE price_histogram.category = o.category AND price_histogram.bucket_start = {_bucket_sql('o.price', 'start')};
+        DELETE FROM category_stats WHERE product_count <= 0;
+        DELETE FROM price_histogram WHERE product_count <= 0;'''
+
+_STATS_FIX_EDGES = '''
+        UPDATE category_stats SET
+            min_price = (SELECT MIN(price) FROM products WHERE category = category_stats.category),
+            max_price = (SELECT MAX(price) FROM products WHERE category = category_stats.category)
+        WHERE min_price IS NULL OR max_price IS NULL;'''
+
+_OLD_ROW = 'SELECT old.category AS category, old.price AS price, old.stock AS stock'
+
+# Same INSERT OR REPLACE caveat as the search triggers: the replaced row is subtracted
+# BEFORE INSERT, its MIN/MAX are re-read once the new row is in place
+STATS_TRIGGERS = {
+    'products_stats_bi': f'''
+    CREATE TRIGGER IF NOT EXISTS products_stats_bi BEFORE INSERT ON products BEGIN
+        {_stats_remove('SELECT category, price, stock FROM products WHERE id = new.id')}
+    END''',
+    'products_stats_ai': f'''
+    CREATE TRIGGER IF NOT EXISTS products_stats_ai AFTER INSERT ON products BEGIN
+        {_stats_add('new')}
+        {_STATS_FIX_EDGES}
+    END''',
+    'products_stats_ad': f'''
+    CREATE TRIGGER IF NOT EXISTS products_stats_ad AFTER DELETE ON products BEGIN
+        {_stats_remove(_OLD_ROW)}
+        {_STATS_FIX_EDGES}
+    END''',
+    'products_stats_au': f'''
+    CREATE TRIGGER IF NOT EXISTS products_stats_au AFTER UPDATE OF category, price, stock ON products BEGIN
+        {_stats_remove(_OLD_ROW)}
+        {_stats_add('new')}
+        {_STATS_FIX_EDGES}
+    END''',
+}
+
+CATEGORY_STATS_SQL = '''
+SELECT category, COUNT(*), SUM(stock), SUM(price), MIN(price), MAX(price)
+FROM products GROUP BY category
+'''
+
+PRICE_HISTOGRAM_SQL = f'''
+SELECT category, {_bucket_sql('price', 'start')} AS bucket_start, {_bucket_sql('price', 'end')}, COUNT(*)
+FROM products GROUP BY category, bucket_start
+'''
+
+def create_stats_tables(cursor):
+    for sql in STATS_TABLES:
+        cursor.execute(sql)
+    for sql in STATS_TRIGGERS.values():
+        cursor.execute(sql)
+
+def drop_stats_triggers(cursor):
+    for name in STATS_TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
+def rebuild_stats(cursor):
+    """Recompute category_stats and price_histogram from scratch with two GROUP BY scans"""
+    cursor.execute('DELETE FROM category_stats')
+    cursor.execute('DELETE FROM price_histogram')
+    cursor.execute(f'INSERT INTO category_stats {CATEGORY_STATS_SQL}')
+    cursor.execute(f'INSERT INTO price_histogram {PRICE_HISTOGRAM_SQL}')
+
+def check_stats(conn):
+    """
+    Compare the summary tables with a fresh aggregate over products.
+    Returns a list of (table, key, stored, actual) differences, empty when consistent.
+    """
+    def differences(table, stored, actual):
+        for key in sorted(stored.keys() | actual.keys(), key=repr):
+            a, b = stored.get(key), actual.get(key)
+            if a is None or b is None or any(
+                    abs(x - y) > 1e-6 * max(1.0, abs(y)) if isinstance(y, float) else x != y
+                    for x, y in zip(a, b)):
+                yield (table, key, a, b)
+
+    stats = {row[0]: row[1:] for row in conn.execute(
+        'SELECT category, product_count, total_stock, price_sum, min_price, max_price FROM category_stats')}
+    fresh_stats = {row[0]: row[1:] for row in conn.execute(CATEGORY_STATS_SQL)}
+    histogram = {row[:2]: row[2:] for row in conn.execute(
+        'SELECT category, bucket_start, bucket_end, product_count FROM price_histogram')}
+    fresh_histogram = {row[:2]: row[2:] for row in conn.execute(PRICE_HISTOGRAM_SQL)}
+    return (list(differences('category_stats', stats, fresh_stats))
+            + list(differences('price_histogram', histogram, fresh_histogram)))
+
+def init_database(db_path=DEFAULT_DB_PATH):
     try:
-        db_path = os.path.join(os.path.dirname(__file__), 'products.db')
         conn = sqlite3.connect(db_path)
         cursor = conn.cursor()
 
+        cursor.execute('DROP TABLE IF EXISTS products_fts')
+        cursor.execute('DROP TABLE IF EXISTS category_stats')
+        cursor.execute('DROP TABLE IF EXISTS price_histogram')
         cursor.execute('DROP TABLE IF EXISTS products')
 
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS products (
-            id INTEGER PRIMARY KEY,
-            name TEXT NOT NULL,
-            price REAL NOT NULL,
-            category TEXT NOT NULL,
-            stock INTEGER NOT NULL,
-            description TEXT,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
-
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_category ON products(category)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_price ON products(price)')
-        cursor.execute('CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock)')
+        create_products_table(cursor)
+        create_indexes(cursor)
+        create_search_index(cursor)
+        create_stats_tables(cursor)
 
         products_data = [
             # Smartphones
@@ -148,10 +372,7 @@ def init_database():
             (100, 'Samsung S Pen Pro', 3900.00, 'Accessories', 75, 'Universal stylus')
         ]
 
-        cursor.executemany('''
-        INSERT OR REPLACE INTO products (id, name, price, category, stock, description)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', products_data)
+        cursor.executemany(INSERT_PRODUCT_SQL, products_data)
 
         conn.commit()
         print("Database initialized successfully!")
@@ -164,6 +385,169 @@ def init_database():
         print(f"Error: {e}")
         return None
 
+# Synthetic catalog: category -> (price range, brands, product lines, descriptions)
+SYNTHETIC_CATALOG = {
+    'Smartphones': ((5900, 59900), ['Apple', 'Samsung', 'Google', 'OnePlus', 'Xiaomi', 'Oppo', 'Vivo'],
+                    ['Phone', 'Phone Pro', 'Phone Ultra', 'Phone Lite', 'Fold', 'Flip'],
+                    ['128GB storage', '256GB storage', '512GB storage', 'AI camera', '5G flagship']),
+    'Laptops': ((15900, 129900), ['Apple', 'Dell', 'ASUS', 'Lenovo', 'HP', 'Acer', 'MSI'],
+                ['Book', 'Book Pro', 'Gaming', 'Ultrabook', '2-in-1', 'Workstation'],
+                ['16GB RAM', '32GB RAM', 'RTX graphics', 'OLED display', 'Business laptop']),
+    'TVs': ((9900, 299900), ['Samsung', 'LG', 'Sony', 'TCL', 'Hisense', 'Philips'],
+            ['QLED 55"', 'QLED 65"', 'OLED 65"', 'OLED 77"', 'Mini LED 85"'],
+            ['4K resolution', '8K resolution', 'Google TV', 'Dolby Vision', '120Hz panel']),
+    'Audio': ((990, 39900), ['Sony', 'Apple', 'Bose', 'Sennheiser', 'JBL', 'Marshall', 'Sonos'],
+              ['Buds', 'Headphones', 'Soundbar', 'Speaker', 'Subwoofer'],
+              ['Noise cancelling', 'Wireless', 'Dolby Atmos', 'Portable', 'Hi-Res audio']),
+    'Tablets': ((5900, 59900), ['Apple', 'Samsung', 'Lenovo', 'Microsoft', 'HUAWEI', 'Xiaomi'],
+                ['Tab', 'Tab Pro', 'Tab Lite', 'Pad Air', 'Pad Pro'],
+                ['OLED display', 'Stylus support', '11" display', '13" display', 'LTE']),
+    'Wearables': ((1990, 39900), ['Apple', 'Samsung', 'Garmin', 'Fitbit', 'HUAWEI', 'Withings'],
+                  ['Watch', 'Watch Pro', 'Band', 'Ring', 'Watch Ultra'],
+                  ['Health tracking', 'GPS', 'Titanium case', 'AMOLED display', 'Solar charging']),
+    'Cameras': ((9900, 159900), ['Sony', 'Canon', 'Nikon', 'Fujifilm', 'GoPro', 'DJI', 'Panasonic'],
+                ['Mirrorless', 'Full-frame', 'Action Cam', 'Compact', 'Cinema'],
+                ['4K video', 'Full-frame sensor', 'APS-C sensor', 'Image stabilization', 'Weather sealed']),
+    'Gaming': ((4900, 29900), ['Sony', 'Microsoft', 'Nintendo', 'Valve', 'ASUS', 'Meta'],
+               ['Console', 'Handheld', 'VR Headset', 'Controller', 'Console Pro'],
+               ['Next-gen console', 'Portable', 'Digital edition', 'VR ready', 'OLED screen']),
+    'Appliances': ((1990, 99900), ['Samsung', 'LG', 'Dyson', 'Philips', 'Panasonic', 'Hitachi', 'iRobot'],
+                   ['Fridge', 'Vacuum', 'Air Purifier', 'Washer', 'Airfryer', 'Rice Cooker'],
+                   ['Smart inverter', 'HEPA filter', 'Robot vacuum', 'Energy saving', 'Wi-Fi control']),
+    'Accessories': ((290, 19900), ['Apple', 'Logitech', 'Anker', 'Belkin', 'Samsung', 'Razer'],
+                    ['Keyboard', 'Mouse', 'Charger', 'Power Bank', 'SSD', 'Monitor'],
+                    ['Wireless', 'USB-C', 'Fast charging', 'Portable', 'Ergonomic']),
+}
+
+def generate_products(count, seed=42, start_id=1):
+    """Yield `count` deterministic synthetic product rows for a given seed"""
+    rng = random.Random(seed)
+    categories = list(SYNTHETIC_CATALOG.items())
+    for product_id in range(start_id, start_id + count):
+        category, ((low, high), brands, lines, descriptions) = categories[int(rng.random() * len(categories))]
+        brand = brands[int(rng.random() * len(brands))]
+        line = lines[int(rng.random() * len(lines))]
+        # ราคาปัดให้ลงท้ายด้วย 90 แบบราคาขายจริง
+        price = float(int(low + rng.random() * (high - low)) // 100 * 100 + 90)
+        yield (
+            product_id,
+            f'{brand} {line} {product_id}',
+            price,
+            category,
+            int(rng.random() * 200),
+            descriptions[int(rng.random() * len(descriptions))]
+        )
+
+def _product_row(record):
+    return (
+        int(record['id']) if record.get('id') not in (None, '') else None,
+        record['name'],
+        float(record['price']),
+        record['category'],
+        int(record['stock']),
+        record.get('description') or None
+    )
+
+def iter_csv_products(path):
+    """Stream product rows from a CSV file with a header row"""
+    with open(path, newline='', encoding='utf-8') as f:
+        for record in csv.DictReader(f):
+            yield _product_row(record)
+
+def iter_jsonl_products(path):
+    """Stream product rows from a JSONL file, one object per line"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield _product_row(json.loads(line))
+
+# Appends smaller than this share of the existing rows go through the indexes and
+# triggers; bigger loads drop them and rebuild everything once at the end
+BULK_REBUILD_RATIO = 0.25
+
+def _has_derived(cursor):
+    """True when every product index, search/stats trigger and summary table exists"""
+    names = {row[0] for row in cursor.execute('SELECT name FROM sqlite_master')}
+    return names >= {*PRODUCT_INDEXES, *SEARCH_TRIGGERS, *STATS_TRIGGERS,
+                     'products_fts', 'category_stats', 'price_histogram'}
+
+def bulk_load(rows, db_path=DEFAULT_DB_PATH, batch_size=100000, replace=False):
+    """
+    Load product rows in large executemany transactions with bulk-load PRAGMAs.
+    A replace, or an append that is large next to the table, drops the indexes and
+    triggers during the load and rebuilds them afterwards, also when the load fails.
+    Smaller appends insert through them.
+    Returns (rows loaded, seconds).
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    cursor = conn.cursor()
+    start = time.perf_counter()
+    total = 0
+    journal_mode = cursor.execute('PRAGMA journal_mode').fetchone()[0]
+    rebuild = False
+    try:
+        # อ่าน batch แรกก่อนแตะ schema: ไฟล์ที่พังตั้งแต่แถวแรก ๆ จะไม่ทำให้ DB เสียอะไรเลย
+        rows = iter(rows)
+        batch = list(itertools.islice(rows, batch_size))
+
+        cursor.execute('PRAGMA synchronous=OFF')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+        cursor.execute('PRAGMA cache_size=-262144')
+        # ให้ sorter ใช้หลาย thread ตอนสร้าง index
+        cursor.execute(f'PRAGMA threads={os.cpu_count() or 1}')
+
+        create_products_table(cursor)
+        existing = 0 if replace else cursor.execute('SELECT COUNT(*) FROM products').fetchone()[0]
+        rebuild = replace or not _has_derived(cursor) or len(batch) >= existing * BULK_REBUILD_RATIO
+        if rebuild:
+            # journal ใน memory เร็วพอ ๆ กับปิด journal แต่ยัง ROLLBACK batch ที่พังได้
+            cursor.execute('PRAGMA journal_mode=MEMORY')
+            cursor.execute('PRAGMA locking_mode=EXCLUSIVE')
+            if replace:
+                cursor.execute('DROP TABLE IF EXISTS products_fts')
+                cursor.execute('DROP TABLE IF EXISTS category_stats')
+                cursor.execute('DROP TABLE IF EXISTS price_histogram')
+                cursor.execute('DROP TABLE IF EXISTS products')
+                create_products_table(cursor)
+            # สร้าง index ทีหลังเร็วกว่าอัปเดต index ทุกแถวระหว่าง insert
+            drop_indexes(cursor)
+            # full-text index ก็เช่นกัน: ปิด trigger ระหว่างโหลด แล้ว rebuild ครั้งเดียวตอนจบ
+            drop_search_triggers(cursor)
+            drop_stats_triggers(cursor)
+
+        # Fresh table: plain INSERT skips the conflict check of INSERT OR REPLACE
+        insert_sql = INSERT_PRODUCT_SQL.replace('OR REPLACE ', '') if replace else INSERT_PRODUCT_SQL
+        try:
+            while batch:
+                cursor.execute('BEGIN')
+                cursor.executemany(insert_sql, batch)
+                cursor.execute('COMMIT')
+                total += len(batch)
+                batch = list(itertools.islice(rows, batch_size))
+        except BaseException:
+            if conn.in_transaction:
+                cursor.execute('ROLLBACK')
+            raise
+        finally:
+            if rebuild:
+                # โหลดสำเร็จหรือไม่ก็ตาม index, trigger และตารางสรุปต้องกลับมาตรงกับ products
+                cursor.execute('BEGIN')
+                create_indexes(cursor)
+                create_search_index(cursor)
+                rebuild_search_index(cursor)
+                create_stats_tables(cursor)
+                rebuild_stats(cursor)
+                cursor.execute('COMMIT')
+        if rebuild:
+            cursor.execute('ANALYZE')
+    finally:
+        if rebuild:
+            cursor.execute('PRAGMA locking_mode=NORMAL')
+        cursor.execute(f'PRAGMA journal_mode={journal_mode}')
+        cursor.execute('PRAGMA synchronous=FULL')
+        conn.close()
+    return total, time.perf_counter() - start
+
 def display_products(conn, category=None, limit=5):
     try:
         cursor = conn.cursor()
@@ -203,8 +587,73 @@ def get_categories(conn):
         print(f"Error getting categories: {e}")
         return []
 
+def next_product_id(db_path):
+    """First id after the existing products (1 for a new database)"""
+    if not os.path.exists(db_path):
+        return 1
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM products").fetchone()[0]
+    except sqlite3.OperationalError:
+        return 1
+    finally:
+        conn.close()
+
 def main():
-    conn = init_database()
+    parser = argparse.ArgumentParser(description='Create and populate the products database')
+    parser.add_argument('--db', type=str, default=DEFAULT_DB_PATH, help='Database file path')
+    parser.add_argument('--generate', type=int, metavar='N', help='Generate N synthetic products')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for --generate')
+    parser.add_argument('--import', dest='import_path', type=str, help='Stream products from a .csv or .jsonl file')
+    parser.add_argument('--batch-size', type=int, default=100000, help='Rows per transaction when bulk loading')
+    parser.add_argument('--append', action='store_true', help='Keep existing products instead of recreating the table')
+    parser.add_argument('--rebuild-search', action='store_true',
+                        help='Create or rebuild the full-text search index of an existing database')
+    parser.add_argument('--check-stats', action='store_true',
+                        help='Check the summary tables against products and rebuild them from scratch')
+    args = parser.parse_args()
+
+    if args.check_stats:
+        conn = sqlite3.connect(args.db)
+        try:
+            with conn:
+                create_stats_tables(conn.cursor())
+                drift = check_stats(conn)
+                for table, key, stored, actual in drift:
+                    print(f"{table} {key}: stored={stored} actual={actual}")
+                print(f"{len(drift)} inconsistent rows" if drift else "Summary tables are consistent")
+                start = time.perf_counter()
+                rebuild_stats(conn.cursor())
+            print(f"Rebuilt summary tables in {time.perf_counter() - start:.2f}s")
+        finally:
+            conn.close()
+        return
+
+    if args.rebuild_search:
+        conn = sqlite3.connect(args.db)
+        try:
+            start = time.perf_counter()
+            with conn:
+                create_search_index(conn.cursor())
+                rebuild_search_index(conn.cursor())
+            print(f"Rebuilt search index in {time.perf_counter() - start:.1f}s")
+        finally:
+            conn.close()
+        return
+
+    if args.generate or args.import_path:
+        if args.import_path:
+            reader = iter_jsonl_products if args.import_path.endswith('.jsonl') else iter_csv_products
+            rows = reader(args.import_path)
+        else:
+            # ต่อท้ายต้องเริ่มหลัง id สุดท้าย ไม่งั้น INSERT OR REPLACE จะทับแถวเดิม
+            start_id = next_product_id(args.db) if args.append else 1
+            rows = generate_products(args.generate, seed=args.seed, start_id=start_id)
+        loaded, seconds = bulk_load(rows, db_path=args.db, batch_size=args.batch_size, replace=not args.append)
+        print(f"Loaded {loaded:,} products in {seconds:.1f}s ({loaded / max(seconds, 1e-9):,.0f} rows/s)")
+        return
+
+    conn = init_database(args.db)
     if not conn:
         print("Failed to initialize database")
         return
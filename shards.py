@@ -0,0 +1,689 @@
+# shards.py
+import functools
+import glob
+import json
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from urllib.parse import quote
+
+from db import (SEARCH_SQL, AsyncToolsMixin, ConnectionPool, QueryGuard, ResultRows, _ColumnSummary, connection_pool,
+                describe_blocked_query, materialize_rows, normalize_stats_category, query_guard, render_schema_digest,
+                render_stats, schema_cache, search_expressions, stats_queries, with_warnings)
+
+class ShardSet:
+    """
+    Database files that together hold one logical database. values maps a shard
+    path to the partition key values stored in it; shards without an entry may
+    hold any value.
+    """
+    def __init__(self, paths: Sequence[str], partition_key: Optional[str] = None,
+                 values: Optional[Dict[str, Sequence[Any]]] = None):
+        self.paths = list(paths)
+        self.partition_key = partition_key
+        self.values = {path: set(v) for path, v in (values or {}).items()}
+
+    def candidates(self, keys: Optional[Sequence[Any]]) -> List[str]:
+        """Shards that can hold rows with any of the given partition key values (None = all)"""
+        if keys is None:
+            return list(self.paths)
+        return [path for path in self.paths if path not in self.values or any(k in self.values[path] for k in keys)]
+
+@functools.lru_cache(maxsize=32)
+def _load_manifest(path: str, mtime_ns: int) -> ShardSet:
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    base = os.path.dirname(path)
+    paths, values = [], {}
+    for shard in manifest["shards"]:
+        shard = {"path": shard} if isinstance(shard, str) else shard
+        shard_path = os.path.join(base, shard["path"])
+        paths.append(shard_path)
+        if "values" in shard:
+            values[shard_path] = shard["values"]
+    return ShardSet(paths, manifest.get("partition_key"), values)
+
+def resolve_shards(db_path: str) -> Optional[ShardSet]:
+    """
+    db_path is sharded when it is a JSON manifest
+    ({"partition_key": "category", "shards": [{"path": "laptops.db", "values": ["Laptops"]}, ...]})
+    or a glob pattern such as "catalog_*.db". Returns None for a plain database file.
+    """
+    if db_path.endswith(".json"):
+        try:
+            mtime_ns = os.stat(db_path).st_mtime_ns
+        except OSError:
+            return None
+        return _load_manifest(os.path.abspath(db_path), mtime_ns)
+    if any(ch in db_path for ch in "*?["):
+        paths = sorted(glob.glob(db_path))
+        return ShardSet(paths) if paths else None
+    return None
+
+# --- minimal SQL scanning, enough to split simple single-table SELECTs ---
+
+def _mask_quotes(sql: str) -> str:
+    """Same-length copy of sql with the contents of quoted strings and identifiers blanked"""
+    out, quote_char = [], None
+    for ch in sql:
+        if quote_char:
+            out.append(ch if ch == quote_char else " ")
+            if ch == quote_char:
+                quote_char = None
+        else:
+            if ch in "'\"`[":
+                quote_char = "]" if ch == "[" else ch
+            out.append(ch)
+    return "".join(out)
+
+def _mask_parens(masked: str) -> str:
+    """Blank everything inside parentheses so only the top level is left"""
+    out, depth = [], 0
+    for ch in masked:
+        if ch == "(":
+            depth += 1
+            out.append(ch if depth == 1 else " ")
+        elif ch == ")":
+            depth -= 1
+            out.append(ch if depth == 0 else " ")
+        else:
+            out.append(ch if depth == 0 else " ")
+    return "".join(out)
+
+def _split_top_level(text: str, masked: str) -> List[Tuple[str, str]]:
+    """Split on top-level commas, returning (original, masked) pieces"""
+    pieces, start = [], 0
+    for match in re.finditer(",", masked):
+        pieces.append((text[start:match.start()], masked[start:match.start()]))
+        start = match.end()
+    pieces.append((text[start:], masked[start:]))
+    return [(t.strip(), m.strip()) for t, m in pieces]
+
+def _norm(expr: str) -> str:
+    return re.sub(r"\s+", " ", expr.replace('"', "").strip().lower())
+
+_CLAUSE_RE = re.compile(
+    r"\b(select|from|where|group\s+by|having|order\s+by|limit|union|intersect|except|window|join|values)\b", re.I
+)
+_CLAUSE_ORDER = ["select", "from", "where", "group by", "order by", "limit"]
+_AGGREGATE_RE = re.compile(r"^(count|sum|total|min|max|avg)\s*\((.*)\)$", re.I | re.S)
+_ANY_AGGREGATE_RE = re.compile(r"\b(count|sum|total|min|max|avg|group_concat|string_agg)\s*\(", re.I)
+_ALIAS_RE = re.compile(r"^(.*?[\w)\"'\]])\s+(?:as\s+)?(\"[^\"]*\"|[A-Za-z_]\w*)$", re.I | re.S)
+_KEYWORDS = {"end", "and", "or", "not", "null", "else", "then", "is", "in", "like", "glob", "between",
+             "collate", "escape", "asc", "desc", "distinct"}
+
+def _param(token: str, index: int, params: Sequence[Any]) -> Any:
+    if token == "?":
+        return params[index]
+    if re.fullmatch(r"-?\d+", token):
+        return int(token)
+    if re.fullmatch(r"-?\d+\.\d*", token):
+        return float(token)
+    if token.startswith("'") and token.endswith("'"):
+        return token[1:-1].replace("''", "'")
+    raise ValueError(token)
+
+def _clauses(sql: str, masked: str) -> Optional[Dict[str, Tuple[int, int, int]]]:
+    """{clause: (keyword start, body start, body end)} for a top-level SELECT, None if unsupported"""
+    found = [(re.sub(r"\s+", " ", m.group(1).lower()), m.start(), m.end()) for m in _CLAUSE_RE.finditer(masked)]
+    names = [name for name, _, _ in found]
+    if (not names or names[0] != "select" or found[0][1] != 0 or "from" not in names
+            or any(name not in _CLAUSE_ORDER for name in names) or len(set(names)) != len(names)
+            or names != sorted(names, key=_CLAUSE_ORDER.index)):
+        return None
+    bounds = {}
+    for (name, start, end), following in zip(found, found[1:] + [(None, len(sql), None)]):
+        bounds[name] = (start, end, following[1])
+    return bounds
+
+def _partition_values(query: str, params: Sequence[Any], key: Optional[str]) -> Optional[List[Any]]:
+    """Partition key values the query is restricted to, or None when it may touch any shard"""
+    if key is None:
+        return None
+    sql = query.strip().rstrip(";")
+    unquoted = _mask_quotes(sql)
+    # only prune plain conjunctive filters; OR/NOT/subqueries could reach other partitions.
+    # The manifest values are compared exactly, a COLLATE (e.g. NOCASE) can match other spellings
+    if re.search(r"\b(or|not|collate)\b", unquoted, re.I) or len(re.findall(r"\bselect\b", unquoted, re.I)) != 1:
+        return None
+    bounds = _clauses(sql, _mask_parens(unquoted))
+    if bounds is None or "where" not in bounds:
+        return None
+    _, where_start, where_end = bounds["where"]
+    pattern = re.compile(r"(?:\b\w+\.)?\"?\b%s\b\"?\s*(==|=|\bin\b)\s*" % re.escape(key), re.I)
+    match = pattern.search(unquoted, where_start, where_end)
+    if match is None:
+        return None
+    try:
+        if match.group(1).lower() == "in":
+            close = unquoted.index(")", match.end())
+            if unquoted[match.end()] != "(":
+                return None
+            tokens = [t for t, _ in _split_top_level(sql[match.end() + 1:close], unquoted[match.end() + 1:close])]
+            start = match.end() + 1
+        else:
+            token = re.match(r"'(?:[^']|'')*'|-?\d+(?:\.\d+)?|\?", sql[match.end():])
+            if token is None:
+                return None
+            tokens = [token.group(0)]
+            start = match.end()
+        values, index = [], unquoted[:start].count("?")
+        for token in tokens:
+            values.append(_param(token, index, params))
+            index += token == "?"
+        return values
+    except (ValueError, IndexError):
+        return None
+
+def _plan(query: str, params: Sequence[Any]) -> Optional[Dict[str, Any]]:
+    """
+    Rewrite a single-table SELECT into a per-shard query plus merge instructions.
+    Returns None when the query cannot be split (joins, DISTINCT, HAVING,
+    subqueries, compound aggregates, ...); those run over attached shards instead.
+    """
+    sql = query.strip().rstrip(";").strip()
+    unquoted = _mask_quotes(sql)
+    if (";" in unquoted or re.search(r"\?\d|[:@$][A-Za-z_]", unquoted) or unquoted.count("?") != len(params)
+            or len(re.findall(r"\bselect\b", unquoted, re.I)) != 1 or re.search(r"\bover\b", unquoted, re.I)):
+        return None
+    masked = _mask_parens(unquoted)
+    bounds = _clauses(sql, masked)
+    if bounds is None:
+        return None
+
+    def part(name: str) -> Tuple[str, str]:
+        _, start, end = bounds.get(name, (0, 0, 0))
+        return sql[start:end].strip(), masked[start:end].strip()
+
+    select, select_masked = part("select")
+    if re.match(r"distinct\b", select_masked, re.I):
+        return None
+    if re.match(r"all\b", select_masked, re.I):
+        select, select_masked = select[3:].strip(), select_masked[3:].strip()
+    from_text, from_masked = part("from")
+    if not re.fullmatch(r"[\w.\"]+(?:\s+(?:as\s+)?\w+)?", from_masked, re.I):
+        return None
+
+    items = []
+    for text, text_masked in _split_top_level(select, select_masked):
+        alias = None
+        match = _ALIAS_RE.match(text_masked)
+        if match and match.group(2).lower() not in _KEYWORDS and not re.search(r"[-+*/%|<>=]\s*$", match.group(1)):
+            alias = text[match.start(2):].strip().strip('"')
+            text = text[:match.end(1)].strip()
+            text_masked = text_masked[:match.end(1)].strip()
+        aggregate = _AGGREGATE_RE.match(text)
+        if aggregate and re.fullmatch(r"\w+\s*\(\s*\)", text_masked):
+            func, inner = aggregate.group(1).lower(), aggregate.group(2).strip()
+            if (re.match(r"distinct\b", inner, re.I) or _ANY_AGGREGATE_RE.search(inner)
+                    or (func in ("min", "max") and "," in _mask_parens(_mask_quotes(inner)))):
+                return None
+            items.append({"expr": text, "alias": alias, "func": func, "inner": inner})
+        elif _ANY_AGGREGATE_RE.search(text):
+            return None
+        else:
+            items.append({"expr": text, "alias": alias, "func": None, "star": text_masked.endswith("*")})
+
+    def resolve(term: str) -> Optional[int]:
+        if re.fullmatch(r"\d+", term):
+            # after a * the ordinal no longer lines up with the select items
+            if any(item.get("star") for item in items):
+                return None
+            index = int(term) - 1
+            return index if 0 <= index < len(items) else None
+        for index, item in enumerate(items):
+            if item["alias"] and _norm(item["alias"]) == _norm(term):
+                return index
+        for index, item in enumerate(items):
+            if _norm(item["expr"]) == _norm(term):
+                return index
+        return None
+
+    order = []
+    if "order by" in bounds:
+        for text, text_masked in _split_top_level(*part("order by")):
+            if re.search(r"\b(collate|nulls)\b", text_masked, re.I):
+                return None
+            match = re.match(r"^(.*?)(?:\s+(asc|desc))?$", text, re.I | re.S)
+            order.append((match.group(1).strip(), (match.group(2) or "").lower() == "desc"))
+
+    limit = offset = None
+    if "limit" in bounds:
+        match = re.fullmatch(r"(\S+?)(?:\s+offset\s+(\S+)|\s*,\s*(\S+))?", part("limit")[0], re.I)
+        if match is None:
+            return None
+        tokens = [match.group(1), match.group(2) or match.group(3)]
+        index = unquoted[:bounds["limit"][1]].count("?")
+        try:
+            first = _param(tokens[0], index, params)
+            second = _param(tokens[1], index + (tokens[0] == "?"), params) if tokens[1] else None
+        except (ValueError, IndexError):
+            return None
+        if not isinstance(first, int) or (second is not None and not isinstance(second, int)):
+            return None
+        limit, offset = (second, first) if match.group(3) else (first, second or 0)
+        if limit < 0:
+            limit = None
+        offset = max(offset, 0)
+
+    head_end = bounds.get("order by", bounds.get("limit", (len(sql),)))[0]
+    body = sql[bounds["from"][0]:head_end].strip()  # FROM ... [WHERE ...] [GROUP BY ...]
+    head_params = list(params[:unquoted[:head_end].count("?")])
+
+    grouped = "group by" in bounds
+    if not grouped and not any(item["func"] for item in items):
+        # Plain rows: every shard sorts and limits on its own, we merge-sort and cut
+        hidden = []
+        for term, _ in order:
+            index = resolve(term)
+            if index is None and re.fullmatch(r"\d+", term):
+                return None  # an ordinal we cannot map would sort the merge on a constant
+            if index is not None and not items[index].get("star"):
+                term = items[index]["expr"]
+            if "?" in _mask_quotes(term):
+                return None
+            hidden.append(term)
+        shard_query = "SELECT " + ", ".join([select] + hidden) + " " + body
+        shard_params = list(head_params)
+        if order:
+            _, order_start, order_end = bounds["order by"]
+            shard_query += " ORDER BY " + sql[order_start:order_end].strip()
+            shard_params = list(params[:unquoted[:order_end].count("?")])
+        if limit is not None:
+            shard_query += f" LIMIT {limit + offset}"
+        return {"kind": "rows", "shard_query": shard_query, "shard_params": shard_params,
+                "hidden": len(hidden), "order": [desc for _, desc in order], "limit": limit, "offset": offset or 0}
+
+    # Aggregates: every shard returns partial aggregates per group, we re-combine
+    if "?" in unquoted[:bounds["from"][0]] or any(item.get("star") for item in items):
+        return None
+    group_indexes = []
+    if grouped:
+        for text, _ in _split_top_level(*part("group by")):
+            index = resolve(text)
+            if index is None or items[index]["func"]:
+                return None
+            group_indexes.append(index)
+    if any(item["func"] is None and index not in group_indexes for index, item in enumerate(items)):
+        return None  # bare columns next to aggregates pick an arbitrary row in SQLite
+
+    columns, outputs = [], []
+    for item in items:
+        if item["func"] == "avg":
+            outputs.append(("avg", [len(columns), len(columns) + 1], item))
+            columns += [f"SUM({item['inner']})", f"COUNT({item['inner']})"]
+        elif item["func"]:
+            outputs.append((item["func"], [len(columns)], item))
+            columns.append(f"{item['func'].upper()}({item['inner']})")
+        else:
+            outputs.append(("group", [len(columns)], item))
+            # GROUP BY / WHERE ใน body อาจอ้างถึง alias จึงต้องคงไว้ใน shard query
+            columns.append(f"{item['expr']} AS {_quote(item['alias'])}" if item["alias"] else item["expr"])
+    order_indexes = []
+    for term, desc in order:
+        index = resolve(term)
+        if index is None:
+            return None
+        order_indexes.append((index, desc))
+    return {"kind": "aggregate", "shard_query": "SELECT " + ", ".join(columns) + " " + body,
+            "shard_params": head_params, "outputs": outputs, "groups": group_indexes,
+            "order": order_indexes, "limit": limit, "offset": offset or 0}
+
+# --- merging ---
+
+def _sql_order(value: Any) -> Tuple[int, Any]:
+    # SQLite sorts NULL < numbers < text < blobs
+    if value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    return (3, value)
+
+def _sort_rows(rows: List[Tuple], keys: List[Tuple[int, bool]]) -> List[Tuple]:
+    for index, desc in reversed(keys):
+        rows.sort(key=lambda row: _sql_order(row[index]), reverse=desc)
+    return rows
+
+def _combine(func: str, a: Any, b: Any) -> Any:
+    if func in ("count", "total"):
+        return a + b
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if func == "sum":
+        return a + b
+    if func == "min":
+        return min(a, b, key=_sql_order)
+    if func == "max":
+        return max(a, b, key=_sql_order)
+    return a
+
+class _RowCursor:
+    """Just enough of a cursor for materialize_rows over merged rows"""
+    def __init__(self, columns: List[str], rows: List[Tuple]):
+        self.description = [(name, None, None, None, None, None, None) for name in columns]
+        self._rows = iter(rows)
+
+    def fetchmany(self, size: int) -> List[Tuple]:
+        return [row for _, row in zip(range(size), self._rows)]
+
+def _empty_result(query: str, params: Sequence[Any]) -> Any:
+    """What query returns over no rows: one row of empty aggregates, or no rows at all"""
+    plan = _plan(query, params)
+    if plan is None or plan["kind"] != "aggregate" or plan["groups"]:
+        return []
+    empty = {"count": 0, "total": 0.0}
+    return [tuple(empty.get(func) for func, _, _ in plan["outputs"])]
+
+class _BudgetExceeded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("SHARD_WORKERS", "8")), thread_name_prefix="shard")
+
+class ShardedSQLiteTools(AsyncToolsMixin):
+    """
+    Drop-in for SQLiteTools over a ShardSet. Queries run in parallel on every
+    shard that can hold matching rows (pruned by the partition key when the
+    WHERE clause pins it) and the partial results are merged: rows are
+    merge-sorted for ORDER BY/LIMIT, COUNT/SUM/TOTAL/MIN/MAX/AVG are re-combined
+    per GROUP BY key. Queries that cannot be split run once over all shards
+    attached to a single connection.
+    """
+    def __init__(self, db_path: str, shards: ShardSet, pool: Optional[ConnectionPool] = connection_pool,
+                 max_rows: int = int(os.environ.get("RESULT_MAX_ROWS", "50")),
+                 max_bytes: int = int(os.environ.get("RESULT_MAX_BYTES", "8000")),
+                 guard: Optional[QueryGuard] = query_guard, executor: ThreadPoolExecutor = _executor):
+        self.db_path = db_path
+        self.shards = shards
+        self.pool = pool
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.guard = guard
+        self.executor = executor
+
+    @contextmanager
+    def _connection(self, path: str) -> Iterator[sqlite3.Connection]:
+        if self.pool is None:
+            conn = sqlite3.connect(path)
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+            return
+
+        yield self.pool.get(path)
+
+    def _run(self, conn: sqlite3.Connection, query: str, params: Sequence[Any], consume) -> Any:
+        with (self.guard.budget(conn) if self.guard is not None else nullcontext()) as budget:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(query, params)
+                return consume(cursor)
+            except sqlite3.OperationalError:
+                if budget is not None and budget.reason:
+                    raise _BudgetExceeded(budget.reason)
+                raise
+            finally:
+                cursor.close()
+
+    def _run_on(self, path: str, query: str, params: Sequence[Any], consume) -> Any:
+        with self._connection(path) as conn:
+            return self._run(conn, query, params, consume)
+
+    def _materialize(self, cursor: sqlite3.Cursor) -> Any:
+        return materialize_rows(cursor, max_rows=self.max_rows, max_bytes=self.max_bytes)
+
+    def execute_query(self, query: str, params: Sequence[Any] = ()) -> Any:
+        """
+        Function to execute SQL queries across all relevant shards
+        Results over max_rows/max_bytes are returned as a truncated preview with a summary
+        """
+        try:
+            keys = _partition_values(query, params, self.shards.partition_key)
+            paths = self.shards.candidates(keys)
+            if not paths:
+                # WHERE pins the partition key to values no shard holds
+                return _empty_result(query, params)
+            plan = _plan(query, params) if len(paths) > 1 else None
+
+            report = None
+            if self.guard is not None:
+                with self._connection(paths[0]) as conn:
+                    report = self.guard.inspect(conn, plan["shard_query"] if plan else query,
+                                                plan["shard_params"] if plan else params)
+                if report["blocked"]:
+                    return self._too_expensive(paths[0], report, report["blocked"])
+
+            try:
+                if len(paths) == 1:
+                    result = self._run_on(paths[0], query, params, self._materialize)
+                elif plan is None:
+                    result = self._run_attached(paths, query, params)
+                else:
+                    result = self._fan_out(paths, plan)
+            except _BudgetExceeded as e:
+                if report is None:
+                    raise
+                return self._too_expensive(paths[0], report, e.reason)
+            # แผนของ shard แรกแทนทุก shard เหมือนตอนตัดสินว่าจะ block
+            return with_warnings(result, report["warnings"] if report else [])
+        except Exception as e:
+            return f"Error execute_query occurred: {str(e)}"
+
+    def _fan_out(self, paths: List[str], plan: Dict[str, Any]) -> Any:
+        preview_only = plan["kind"] == "rows" and plan["limit"] is None
+
+        def collect(cursor: sqlite3.Cursor) -> Dict[str, Any]:
+            # ไม่มี LIMIT: เก็บแค่แถวแรก ๆ ไว้ทำ preview ที่เหลือนับและสรุปอย่างเดียว
+            columns = [d[0] for d in cursor.description]
+            visible = len(columns) - plan.get("hidden", 0)
+            summaries = [_ColumnSummary(1000) for _ in range(visible)] if preview_only else []
+            rows, row_count = [], 0
+            while True:
+                chunk = cursor.fetchmany(500)
+                if not chunk:
+                    break
+                for row in chunk:
+                    row_count += 1
+                    for summary, value in zip(summaries, row):
+                        summary.add(value)
+                    if not preview_only or len(rows) < self.max_rows:
+                        rows.append(row)
+            return {"columns": columns, "rows": rows, "row_count": row_count, "summaries": summaries}
+
+        futures = [self.executor.submit(self._run_on, path, plan["shard_query"], plan["shard_params"], collect)
+                   for path in paths]
+        parts = [future.result() for future in futures]
+        columns = parts[0]["columns"]
+        rows = [row for part in parts for row in part["rows"]]
+
+        if plan["kind"] == "aggregate":
+            columns, rows = self._merge_aggregates(plan, columns, rows)
+        else:
+            visible = len(columns) - plan["hidden"]
+            if plan["order"]:
+                _sort_rows(rows, [(visible + i, desc) for i, desc in enumerate(plan["order"])])
+            columns, rows = columns[:visible], [row[:visible] for row in rows]
+            if preview_only:
+                summaries = parts[0]["summaries"]
+                for part in parts[1:]:
+                    for summary, other in zip(summaries, part["summaries"]):
+                        summary.merge(other)
+                return self._preview(columns, rows, sum(part["row_count"] for part in parts), summaries)
+
+        start = plan["offset"]
+        stop = start + plan["limit"] if plan["limit"] is not None else None
+        return self._materialize(_RowCursor(columns, rows[start:stop]))
+
+    def _merge_aggregates(self, plan: Dict[str, Any], columns: List[str],
+                          rows: List[Tuple]) -> Tuple[List[str], List[Tuple]]:
+        outputs = plan["outputs"]
+        group_columns = [outputs[i][1][0] for i in plan["groups"]]
+        merged: Dict[Tuple, List[Any]] = {}
+        for row in rows:
+            key = tuple(row[i] for i in group_columns)
+            partial = [row[i] for _, indexes, _ in outputs for i in indexes]
+            current = merged.get(key)
+            if current is None:
+                merged[key] = partial
+                continue
+            position = 0
+            for func, indexes, _ in outputs:
+                if func == "avg":
+                    current[position] = _combine("sum", current[position], partial[position])
+                    current[position + 1] = _combine("count", current[position + 1], partial[position + 1])
+                else:
+                    current[position] = _combine(func, current[position], partial[position])
+                position += len(indexes)
+
+        result = []
+        for partial in merged.values():
+            row, position = [], 0
+            for func, indexes, _ in outputs:
+                if func == "avg":
+                    total, count = partial[position], partial[position + 1]
+                    row.append(total / count if count else None)
+                else:
+                    row.append(partial[position])
+                position += len(indexes)
+            result.append(tuple(row))
+
+        names = []
+        for func, indexes, item in outputs:
+            names.append(columns[indexes[0]] if func == "group" else (item["alias"] or item["expr"]))
+        # SQLite returns groups in key order when there is no ORDER BY
+        _sort_rows(result, plan["order"] or [(i, False) for i in plan["groups"]])
+        return names, result
+
+    def _preview(self, columns: List[str], rows: List[Tuple], row_count: int,
+                 summaries: List[_ColumnSummary]) -> Any:
+        preview, preview_bytes = [], 0
+        for row in rows:
+            row_bytes = len(repr(row))
+            if len(preview) >= self.max_rows or preview_bytes + row_bytes > self.max_bytes:
+                break
+            preview.append(row)
+            preview_bytes += row_bytes
+        if len(preview) == row_count:
+            return ResultRows(preview, columns)
+        return {
+            "truncated": True,
+            "row_count": row_count,
+            "columns": columns,
+            "preview": preview,
+            "summary": {name: summary.to_dict() for name, summary in zip(columns, summaries)}
+        }
+
+    def _run_attached(self, paths: List[str], query: str, params: Sequence[Any]) -> Any:
+        """Run a query the merger cannot split over UNION ALL views of the attached shards"""
+        conn = sqlite3.connect("file::memory:", uri=True)
+        try:
+            if len(paths) > conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED):
+                conn.setlimit(sqlite3.SQLITE_LIMIT_ATTACHED, len(paths))
+                if len(paths) > conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED):
+                    raise RuntimeError(f"this query needs all {len(paths)} shards attached, "
+                                       f"SQLite allows {conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)}")
+            tables: Dict[str, List[Tuple[int, List[str]]]] = {}
+            for i, path in enumerate(paths):
+                conn.execute(f"ATTACH DATABASE ? AS shard{i}", (f"file:{quote(os.path.abspath(path))}?mode=ro",))
+                for table, columns in self._schema(path)["columns"].items():
+                    if not table.startswith("sqlite_"):
+                        tables.setdefault(table, []).append((i, [col["name"] for col in columns]))
+            for table, sources in tables.items():
+                names = list(dict.fromkeys(name for _, columns in sources for name in columns))
+                selects = [
+                    "SELECT " + ", ".join(_quote(n) if n in columns else f"NULL AS {_quote(n)}" for n in names)
+                    + f" FROM shard{i}.{_quote(table)}"
+                    for i, columns in sources
+                ]
+                conn.execute(f"CREATE TEMP VIEW {_quote(table)} AS " + " UNION ALL ".join(selects))
+            return self._run(conn, query, params, self._materialize)
+        finally:
+            conn.close()
+
+    def search_products(self, query: str, limit: int = 10) -> Any:
+        """
+        Ranked full-text search on every shard in parallel, merged by bm25 score
+        (each shard scores against its own term statistics, close enough for ranking)
+        """
+        try:
+            limit = max(1, min(int(limit), self.max_rows))
+            for expression in search_expressions(query):
+                futures = [self.executor.submit(self._run_on, path, SEARCH_SQL, (expression, limit),
+                                                lambda cursor: (cursor.description, cursor.fetchall()))
+                           for path in self.shards.paths]
+                parts = [future.result() for future in futures]
+                rows = sorted((row for _, part in parts for row in part), key=lambda row: row[-1])
+                if rows:
+                    columns = [d[0] for d in parts[0][0]]
+                    return self._materialize(_RowCursor(columns, rows[:limit]))
+            return []
+        except _BudgetExceeded as e:
+            return f"Error search_products occurred: {e.reason}"
+        except Exception as e:
+            return f"Error search_products occurred: {str(e)}"
+
+    def get_stats(self, category: str = "") -> Dict[str, Any]:
+        """Per-category summary of every shard's summary tables, combined"""
+        try:
+            # ไม่ prune ตาม partition key: ชื่อ category เทียบแบบ NOCASE และแต่ละ shard อ่านแค่ไม่กี่แถว
+            queries = stats_queries(normalize_stats_category(category))
+
+            def read(path: str) -> List[List[Tuple]]:
+                with self._connection(path) as conn:
+                    return [conn.execute(sql, params).fetchall() for sql, params in queries]
+
+            parts = list(self.executor.map(read, self.shards.paths))
+            return render_stats([row for part in parts for row in part[0]],
+                                [row for part in parts for row in part[1]])
+        except Exception as e:
+            return f"Error get_stats occurred: {str(e)}"
+
+    def _schema(self, path: str) -> Dict[str, Any]:
+        with self._connection(path) as conn:
+            return schema_cache.get(conn, path)
+
+    def _unified_schema(self) -> Dict[str, Any]:
+        columns: Dict[str, Dict[str, Any]] = {}
+        indexes: Dict[str, List[Dict[str, Any]]] = {}
+        for path in self.shards.paths:
+            schema = self._schema(path)
+            for table, table_columns in schema["columns"].items():
+                merged = columns.setdefault(table, {})
+                for col in table_columns:
+                    merged.setdefault(col["name"], col)
+                indexes.setdefault(table, schema["indexes"].get(table, []))
+        fulltext: Dict[str, List[str]] = {}
+        for path in self.shards.paths:
+            fulltext.update(self._schema(path).get("fulltext", {}))
+        return {"columns": {table: list(cols.values()) for table, cols in columns.items()}, "indexes": indexes,
+                "fulltext": fulltext}
+
+    def _too_expensive(self, path: str, report: Dict[str, Any], reason: str) -> str:
+        return describe_blocked_query(report, reason, self._schema(path)["indexes"])
+
+    def get_table_schema(self, *args) -> Dict[str, List[str]]:
+        """Get the unified schema of all shards"""
+        try:
+            return self._unified_schema()["columns"]
+        except Exception as e:
+            return f"Error get_table_schema occurred: {str(e)}"
+
+    def get_schema_digest(self) -> str:
+        """Compact schema text (columns, types, PKs, indexes) for the system prompt"""
+        try:
+            return render_schema_digest(self._unified_schema())
+        except Exception as e:
+            return f"(schema unavailable: {str(e)})"
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
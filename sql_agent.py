@@ -0,0 +1,956 @@
+# sql_agent.py
+
+from typing import (List, Tuple, Dict, Any, TypedDict, Annotated, Optional, AsyncIterator, Iterator, Sequence,
+                    Callable, AsyncContextManager)
+from langgraph.graph import StateGraph, END
+from langgraph.graph.message import REMOVE_ALL_MESSAGES, add_messages
+from langgraph.checkpoint.base import BaseCheckpointSaver
+from langgraph.prebuilt import ToolNode
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain.tools import Tool, StructuredTool
+from langchain.agents import AgentExecutor
+from langchain.agents.react.agent import create_react_agent
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage, ToolMessage
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackHandler
+from langchain_core.agents import AgentAction
+from pydantic import BaseModel, Field
+import asyncio
+import functools
+import json
+import os
+import signal
+import sqlite3
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+from backends import backend_pool, create_chat_model
+from cache import QueryCache, normalize_question, query_cache
+from metrics import TracingCallbackHandler
+from router import FastPathRouter
+from sessions import SESSION_HISTORY_TOKENS, compact_history, compact_turn, is_follow_up, session_store
+from shards import ShardedSQLiteTools, resolve_shards
+from db import (SEARCH_SQL, AsyncToolsMixin, ConnectionPool, QueryGuard, connection_pool, describe_blocked_query,
+                materialize_rows, normalize_stats_category, query_guard, render_schema_digest, render_stats,
+                schema_cache, search_expressions, stats_queries, tool_observation, with_warnings)
+
+class SQLiteTools(AsyncToolsMixin):
+    def __init__(self, db_path: str, pool: Optional[ConnectionPool] = connection_pool,
+                 max_rows: int = int(os.environ.get("RESULT_MAX_ROWS", "50")),
+                 max_bytes: int = int(os.environ.get("RESULT_MAX_BYTES", "8000")),
+                 guard: Optional[QueryGuard] = query_guard):
+        self.db_path = db_path
+        self.pool = pool  # None = เปิด connection ใหม่ทุกครั้ง
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.guard = guard  # None = ไม่ตรวจ query plan และไม่จำกัดเวลา
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        if self.pool is None:
+            conn = sqlite3.connect(self.db_path)
+            try:
+                with conn:
+                    yield conn
+            finally:
+                conn.close()
+            return
+
+        yield self.pool.get(self.db_path)
+        
+    def execute_query(self, query: str, params: Sequence[Any] = ()) -> List[Tuple]:
+        """
+        Function to execute SQL queries
+        Results over max_rows/max_bytes are returned as a truncated preview with a summary
+        """
+        try:
+            with self._connection() as conn:
+                if self.guard is None:
+                    return self._fetch(conn, query, params)
+
+                report = self.guard.inspect(conn, query, params)
+                if report["blocked"]:
+                    return self._too_expensive(conn, report, report["blocked"])
+
+                with self.guard.budget(conn) as budget:
+                    try:
+                        # full scan ที่ไม่ถูก block ยังแจ้ง agent ไปพร้อมผลลัพธ์ จะได้เขียน query ใหม่ให้ดีขึ้น
+                        return with_warnings(self._fetch(conn, query, params), report["warnings"])
+                    except sqlite3.OperationalError:
+                        if budget.reason:
+                            return self._too_expensive(conn, report, budget.reason)
+                        raise
+        except Exception as e:
+            return f"Error execute_query occurred: {str(e)}"
+
+    def _fetch(self, conn: sqlite3.Connection, query: str, params: Sequence[Any] = ()) -> Any:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            return materialize_rows(cursor, max_rows=self.max_rows, max_bytes=self.max_bytes)
+        finally:
+            cursor.close()
+
+    def _too_expensive(self, conn: sqlite3.Connection, report: Dict[str, Any], reason: str) -> str:
+        """Structured observation telling the agent why the query was stopped and how to rewrite it"""
+        return describe_blocked_query(report, reason, schema_cache.get(conn, self.db_path)["indexes"])
+            
+    def get_table_schema(self, *args) -> Dict[str, List[str]]:  
+        """Get schema information for all tables"""
+        try:
+            with self._connection() as conn:
+                return schema_cache.get(conn, self.db_path)["columns"]
+        except Exception as e:
+            return f"Error get_table_schema occurred: {str(e)}"
+
+    def get_schema_digest(self) -> str:
+        """Compact schema text (columns, types, PKs, indexes) for the system prompt"""
+        try:
+            with self._connection() as conn:
+                return render_schema_digest(schema_cache.get(conn, self.db_path))
+        except Exception as e:
+            return f"(schema unavailable: {str(e)})"
+
+    def search_products(self, query: str, limit: int = 10) -> List[Tuple]:
+        """
+        Ranked full-text search (FTS5 bm25) over product name, description and category
+        Matches all terms first and falls back to any term when nothing matches
+        """
+        try:
+            limit = max(1, min(int(limit), self.max_rows))
+            with self._connection() as conn:
+                with (self.guard.budget(conn) if self.guard is not None else nullcontext()):
+                    for expression in search_expressions(query):
+                        rows = self._fetch(conn, SEARCH_SQL, (expression, limit))
+                        if rows:
+                            return rows
+            return []
+        except Exception as e:
+            return f"Error search_products occurred: {str(e)}"
+
+    def get_stats(self, category: str = "") -> Dict[str, Any]:
+        """
+        Per-category count, stock, average/min/max price and a price histogram,
+        read from the trigger-maintained summary tables instead of scanning products
+        """
+        try:
+            with self._connection() as conn:
+                category_rows, bucket_rows = (conn.execute(sql, params).fetchall()
+                                              for sql, params in stats_queries(normalize_stats_category(category)))
+            return render_stats(category_rows, bucket_rows)
+        except Exception as e:
+            return f"Error get_stats occurred: {str(e)}"
+
+class AgentState(TypedDict):
+    input: str
+    output: Any
+    messages: List[Any]
+    sql: Optional[str]
+    route: Optional[str]
+    history: List[Any]  # compacted earlier turns of the session
+
+class ToolAgentState(TypedDict):
+    input: str
+    output: Any
+    messages: Annotated[List[Any], add_messages]
+    sql: Optional[str]
+    route: Optional[str]
+    history: List[Any]
+
+class ExecuteQueryInput(BaseModel):
+    query: str = Field(description="A single valid SQLite query")
+
+class GetSchemaInput(BaseModel):
+    pass
+
+class SearchProductsInput(BaseModel):
+    query: str = Field(description="Keywords to look for in product names, descriptions and categories")
+    limit: int = Field(default=10, description="Maximum number of products to return")
+
+class GetStatsInput(BaseModel):
+    category: str = Field(default="", description="A single category, or empty for all categories")
+
+AGENT_MODES = ("react", "tools")
+
+TOOL_CALLING_PROMPT = """You are a SQL database assistant for a SQLite database.
+Use the execute_query tool to run SQL and the get_schema tool if you need the table structure.
+To find products by keywords or features, use search_products instead of LIKE '%...%' queries.
+For counts, stock, average/min/max price or price ranges per category, use get_stats instead of GROUP BY queries.
+When you have the data you need, reply with a short final answer and no tool call."""
+
+TOOL_DESCRIPTIONS = {
+    "execute_query": "Execute a SQL query. Input should be a valid SQL query string.",
+    "get_schema": "Get the database schema. No input needed.",
+    "search_products": "Find products by keywords in name, description and category, best matches first. "
+                       "Input should be keywords, e.g. wireless noise cancelling. "
+                       "Returns (id, name, price, category, stock, description, score). "
+                       "Use this instead of LIKE '%...%' queries.",
+    "get_stats": "Get per-category product count, total stock, average/min/max price and a price histogram "
+                 "from precomputed summary tables. Input should be a category name, or all for every category. "
+                 "Use this instead of GROUP BY queries over products."
+}
+
+_REACT_TEMPLATE = """You are a SQL database assistant. Follow the format below EXACTLY, including EXACT spacing and punctuation:
+
+            Thought: [your reasoning]
+            Action: [tool name]
+            Action Input: [tool input]
+            Observation: [tool output]
+            ... (this Thought/Action/Action Input/Observation can repeat if needed)
+            Thought: [your conclusion]
+            Final Answer: [your response]
+
+            Available tools:
+            {tool_names}
+
+            {tools}
+
+            Remember:
+            1. ALWAYS start with "Thought:"
+            2. ALWAYS include "Action:" after "Thought:"
+            3. ALWAYS follow the exact format above
+            4. NEVER include multiple actions without observations between them
+            5. NEVER skip steps in the format"""
+
+# Rendered once so every agent and request starts with the same bytes
+REACT_SYSTEM_PROMPT = _REACT_TEMPLATE.format(
+    tool_names=", ".join(TOOL_DESCRIPTIONS),
+    tools="\n".join(f"{name}: {description}" for name, description in TOOL_DESCRIPTIONS.items())
+)
+
+SCHEMA_PROMPT = "Database schema (already loaded, do not call get_schema unless it is missing something):\n{schema}"
+
+# How long Ollama keeps the model in memory after a request ("30m", "1h", "-1" = forever)
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# arun() reports failures as text instead of raising
+FAILED_OUTPUT_PREFIXES = ("Error", "An error occurred", "Agent stopped")
+
+def is_failed_output(output: Any) -> bool:
+    return str(output).startswith(FAILED_OUTPUT_PREFIXES)
+
+def _answer_sql(calls: List[Tuple[str, Any, Any]]) -> Optional[str]:
+    """
+    The SQL the final answer was built from, given the run's (tool, input, output)
+    calls. Only a run with exactly one successful query and no other data tool
+    qualifies; with several, the last one may have been exploratory.
+    """
+    data_calls = [(tool, query) for tool, query, output in calls
+                  if tool != "get_schema" and not str(output).startswith("Error")]
+    if len(data_calls) != 1 or data_calls[0][0] != "execute_query" or not data_calls[0][1]:
+        return None
+    return str(data_calls[0][1]).strip()
+
+def _map_result(func: Callable, convert: Callable[[Any], Any]) -> Callable:
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def run(*args, **kwargs) -> Any:
+            return convert(await func(*args, **kwargs))
+        return run
+
+    @functools.wraps(func)
+    def run(*args, **kwargs) -> Any:
+        return convert(func(*args, **kwargs))
+    return run
+
+def _with_warnings(func: Callable) -> Callable:
+    """Tool function whose observation keeps the query plan warnings of the rows"""
+    return _map_result(func, tool_observation)
+
+def _with_columns(func: Callable) -> Callable:
+    """
+    Tool function for response_format="content_and_artifact": the model still sees
+    the rows (and plan warnings), the ToolMessage artifact carries their column names for the UI
+    """
+    return _map_result(func, lambda result: (tool_observation(result), getattr(result, "columns", None)))
+
+class SQLiteAgent:
+    def __init__(self, db_path: str, model_name: str = "deepseek-r1:8b", llm: Optional[BaseChatModel] = None,
+                 verbose: bool = False, inject_schema: bool = False, cache: Optional[QueryCache] = None,
+                 fast_path: bool = False, sessions: Optional[BaseCheckpointSaver] = None,
+                 history_tokens: int = SESSION_HISTORY_TOKENS):
+        self.db_path = db_path
+        self.model_name = model_name
+        self.cache = cache
+        shards = resolve_shards(db_path)
+        self.db_tools = ShardedSQLiteTools(db_path, shards) if shards else SQLiteTools(db_path)
+        self.router = FastPathRouter(self.db_tools) if fast_path else None
+        
+        # One ChatOllama, or a load balancer over the OLLAMA_BACKENDS configured for this model
+        self.llm = llm or create_chat_model(
+            model_name,
+            temperature=0,  # ความแปรปรวนในการสร้างข้อความ ใช้ 0 สำหรับความแม่นยำสูงสุด
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            streaming=True
+        )
+        
+        self.tools = [
+            Tool(
+              name="execute_query",
+              func=_with_warnings(self.db_tools.execute_query),
+              coroutine=_with_warnings(self.db_tools.aexecute_query),
+              description=TOOL_DESCRIPTIONS["execute_query"]
+            ),
+            Tool(
+                name="get_schema",
+                func=self.db_tools.get_table_schema,
+                coroutine=self.db_tools.aget_table_schema,
+                description=TOOL_DESCRIPTIONS["get_schema"]
+            ),
+            Tool(
+                name="search_products",
+                func=self.db_tools.search_products,
+                coroutine=self.db_tools.asearch_products,
+                description=TOOL_DESCRIPTIONS["search_products"]
+            ),
+            Tool(
+                name="get_stats",
+                func=self.db_tools.get_stats,
+                coroutine=self.db_tools.aget_stats,
+                description=TOOL_DESCRIPTIONS["get_stats"]
+            )
+        ]
+        
+        # The system prompt is rendered once per process (REACT_SYSTEM_PROMPT), so every
+        # agent sends a byte-identical prefix and Ollama can reuse its prompt cache.
+        # Per-database and per-request parts come after it.
+        messages = [("system", REACT_SYSTEM_PROMPT.replace("{", "{{").replace("}", "}}"))]
+        if inject_schema:
+            # ใส่ schema ไว้ใน prompt เลย model จะได้ไม่ต้องเสียรอบไปเรียก get_schema
+            # The digest is resolved on every format, so it follows schema changes via the cache
+            messages.append(("system", SCHEMA_PROMPT))
+        self.prompt = ChatPromptTemplate.from_messages([
+            *messages,
+            # Earlier turns of the session go after the fixed prefix so the prompt cache still applies
+            MessagesPlaceholder("history", optional=True),
+            ("human", "{input}"),
+            ("ai", "{agent_scratchpad}")
+        ]).partial(tools="", tool_names="")  # create_react_agent checks for these; already in the prefix
+        if inject_schema:
+            self.prompt = self.prompt.partial(schema=self.db_tools.get_schema_digest)
+          
+        self.agent = create_react_agent(
+            llm=self.llm,
+            tools=self.tools,
+            prompt=self.prompt
+        )
+        
+        self.agent_executor = AgentExecutor(
+            agent=self.agent,
+            tools=self.tools,
+            verbose=verbose,
+            return_intermediate_steps=True,  # สำหรับการแสดงข้อความระหว่างการทำงาน
+            handle_parsing_errors=True,  # จัดการข้อผิดพลาดในการแปลงข้อความ
+            max_iterations=5  # จำกัดจำนวนรอบการทำงาน (เพื่อป้องกันการวนลูป)
+        )
+        
+        # Compile the workflow once per agent instead of on every run
+        self.app = self._build_workflow()
+
+        # Native tool-calling mode: the model returns structured tool calls
+        # instead of Thought/Action text, so there is nothing to parse
+        self.inject_schema = inject_schema
+        self.max_iterations = 5
+        self.structured_tools = [
+            StructuredTool.from_function(
+                func=_with_columns(self.db_tools.execute_query),
+                coroutine=_with_columns(self.db_tools.aexecute_query),
+                name="execute_query",
+                description="Execute a SQL query and return the rows.",
+                args_schema=ExecuteQueryInput,
+                response_format="content_and_artifact"
+            ),
+            StructuredTool.from_function(
+                func=self.db_tools.get_table_schema,
+                coroutine=self.db_tools.aget_table_schema,
+                name="get_schema",
+                description="Get the database schema (tables and columns).",
+                args_schema=GetSchemaInput
+            ),
+            StructuredTool.from_function(
+                func=self.db_tools.search_products,
+                coroutine=self.db_tools.asearch_products,
+                name="search_products",
+                description="Ranked keyword search over product names, descriptions and categories. "
+                            "Returns (id, name, price, category, stock, description, score) rows.",
+                args_schema=SearchProductsInput
+            ),
+            StructuredTool.from_function(
+                func=self.db_tools.get_stats,
+                coroutine=self.db_tools.aget_stats,
+                name="get_stats",
+                description="Per-category count, stock, average/min/max price and price histogram "
+                            "from precomputed summary tables.",
+                args_schema=GetStatsInput
+            )
+        ]
+        self._tools_app = None
+
+        # Multi-turn sessions: the same graphs compiled with a checkpointer, keyed by mode
+        self.sessions = sessions if sessions is not None else session_store
+        self.history_tokens = history_tokens
+        self._session_apps: Dict[str, Any] = {}
+
+    def _to_state(self, state: Dict, result: Dict) -> Dict:
+        # Create messages
+        messages = []
+        calls = []
+        if "intermediate_steps" in result:
+            for step in result["intermediate_steps"]:
+                action, output = step
+                messages.extend([
+                    AIMessage(content=str(action)),
+                    HumanMessage(content=str(output))
+                ])
+                calls.append((action.tool, str(action.tool_input).strip(), output))
+        sql = _answer_sql(calls)
+        
+        # Update state
+        return {
+            "input": state["input"],
+            "output": result.get("output", ""),
+            "messages": messages,
+            "sql": sql,
+            "route": None
+        }
+
+    def _route(self, state: Dict) -> Dict:
+        # ตอบคำถามที่เจอบ่อยจาก SQL template ได้เลย ไม่ต้องเรียก LLM
+        if self.router is None:
+            return {}
+        routed = self.router.route(state["input"])
+        if routed is None:
+            return {}
+        return {"output": routed["output"], "sql": routed["sql"], "route": routed["intent"]}
+
+    def _after_route(self, state: Dict) -> str:
+        return END if state.get("route") else "agent"
+
+    def _process_agent(self, state: Dict, config: RunnableConfig) -> Dict:
+        # Call agent executor
+        result = self.agent_executor.invoke({
+            "input": state["input"],
+            "history": state.get("history") or [],
+            "agent_scratchpad": state.get("messages", [])
+        }, config=config)
+        return self._to_state(state, result)
+
+    async def _aprocess_agent(self, state: Dict, config: RunnableConfig) -> Dict:
+        # Same as _process_agent but on the executor's async path
+        result = await self.agent_executor.ainvoke({
+            "input": state["input"],
+            "history": state.get("history") or [],
+            "agent_scratchpad": state.get("messages", [])
+        }, config=config)
+        return self._to_state(state, result)
+
+    def _remember(self, state: Dict) -> Dict:
+        # เก็บแค่คำถาม SQL และคำตอบแบบย่อไว้ใน session ทิ้ง observation ดิบของรอบนี้
+        turn = compact_turn(state["input"], state.get("output"), state.get("sql"), self.history_tokens // 4)
+        history = compact_history([*(state.get("history") or []), *turn], self.history_tokens)
+        return {"history": history, "messages": []}
+
+    def _remember_tools(self, state: Dict) -> Dict:
+        # messages ของ tool mode ใช้ add_messages ต้องสั่งลบแทนการเขียนทับ
+        return {**self._remember(state), "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)]}
+
+    def _build_workflow(self, checkpointer: Optional[BaseCheckpointSaver] = None):
+        workflow = StateGraph(state_schema=AgentState)
+        
+        workflow.add_node("router", self._route)
+        workflow.add_node("agent", RunnableLambda(self._process_agent, afunc=self._aprocess_agent))
+        
+        workflow.set_entry_point("router")
+
+        # Session runs fold the turn into the history before the checkpoint is saved
+        finish = END
+        if checkpointer is not None:
+            workflow.add_node("remember", self._remember)
+            workflow.add_edge("remember", END)
+            finish = "remember"
+        
+        workflow.add_conditional_edges("router", self._after_route, {"agent": "agent", END: finish})
+        workflow.add_edge("agent", finish)
+        
+        return workflow.compile(checkpointer=checkpointer)
+
+    @property
+    def tools_app(self):
+        # สร้างตอนใช้ครั้งแรก model บางตัวไม่รองรับ bind_tools
+        if self._tools_app is None:
+            self.tool_llm = self.llm.bind_tools(self.structured_tools)
+            self._tools_app = self._build_tools_workflow()
+        return self._tools_app
+
+    def _model_messages(self, state: Dict) -> List[Any]:
+        messages = [SystemMessage(content=TOOL_CALLING_PROMPT)]
+        if self.inject_schema:
+            messages.append(SystemMessage(content="Database schema:\n" + self.db_tools.get_schema_digest()))
+        return [*messages, *(state.get("history") or []), HumanMessage(content=state["input"]), *state["messages"]]
+
+    def _model_update(self, state: Dict, response: AIMessage) -> Dict:
+        update = {"messages": [response]}
+        if not response.tool_calls:
+            update["output"] = response.content
+            update["sql"] = self._last_sql(state["messages"])
+        return update
+
+    def _iteration_limit(self, state: Dict) -> Optional[Dict]:
+        turns = sum(1 for message in state["messages"] if isinstance(message, AIMessage))
+        if turns < self.max_iterations:
+            return None
+        return {"output": "Agent stopped due to iteration limit or time limit.", "sql": None}
+
+    def _call_model(self, state: Dict, config: RunnableConfig) -> Dict:
+        stopped = self._iteration_limit(state)
+        if stopped:
+            return stopped
+        return self._model_update(state, self.tool_llm.invoke(self._model_messages(state), config=config))
+
+    async def _acall_model(self, state: Dict, config: RunnableConfig) -> Dict:
+        stopped = self._iteration_limit(state)
+        if stopped:
+            return stopped
+        response = await self.tool_llm.ainvoke(self._model_messages(state), config=config)
+        return self._model_update(state, response)
+
+    def _last_sql(self, messages: List[Any]) -> Optional[str]:
+        # จับคู่ tool call กับผลลัพธ์ แล้วดูว่าคำตอบมาจาก SQL ตัวไหน
+        pending, calls = {}, []
+        for message in messages:
+            if isinstance(message, AIMessage):
+                for call in message.tool_calls:
+                    pending[call["id"]] = (call["name"], call["args"].get("query"))
+            elif isinstance(message, ToolMessage) and message.tool_call_id in pending:
+                name, query = pending[message.tool_call_id]
+                calls.append((name, query, message.content))
+        return _answer_sql(calls)
+
+    def _after_model(self, state: Dict) -> str:
+        return END if state.get("output") is not None else "tools"
+
+    def _after_route_tools(self, state: Dict) -> str:
+        return END if state.get("route") else "model"
+
+    def _build_tools_workflow(self, checkpointer: Optional[BaseCheckpointSaver] = None):
+        workflow = StateGraph(state_schema=ToolAgentState)
+
+        workflow.add_node("router", self._route)
+        workflow.add_node("model", RunnableLambda(self._call_model, afunc=self._acall_model))
+        workflow.add_node("tools", ToolNode(self.structured_tools))
+
+        workflow.set_entry_point("router")
+
+        finish = END
+        if checkpointer is not None:
+            workflow.add_node("remember", self._remember_tools)
+            workflow.add_edge("remember", END)
+            finish = "remember"
+
+        workflow.add_conditional_edges("router", self._after_route_tools, {"model": "model", END: finish})
+        workflow.add_conditional_edges("model", self._after_model, {"tools": "tools", END: finish})
+        workflow.add_edge("tools", "model")
+
+        return workflow.compile(checkpointer=checkpointer)
+
+    def _workflow(self, mode: str, session_id: Optional[str] = None):
+        if mode not in AGENT_MODES:
+            raise ValueError(f"Unknown agent mode: {mode}")
+        if session_id is None:
+            return self.tools_app if mode == "tools" else self.app
+        if mode not in self._session_apps:
+            if mode == "tools":
+                self.tools_app  # binds the tools to the model
+                self._session_apps[mode] = self._build_tools_workflow(self.sessions)
+            else:
+                self._session_apps[mode] = self._build_workflow(self.sessions)
+        return self._session_apps[mode]
+
+    def _run_config(self, callbacks: List[BaseCallbackHandler], session_id: Optional[str]) -> Dict:
+        config: Dict[str, Any] = {"callbacks": callbacks}
+        if session_id is not None:
+            # session เดียวกันแต่คนละ database ไม่ใช้ history ร่วมกัน
+            config["configurable"] = {"thread_id": f"{session_id}@{os.path.abspath(self.db_path)}"}
+        return config
+
+    def _cached_turn(self, state: Dict, query: str, output: Any) -> Dict:
+        """Session update for an answer served from the cache, as if the graph had run"""
+        return self._remember({**state, "input": query, "output": output, "sql": None})
+
+    def _initial_state(self, query: str, mode: str = "react") -> Dict:
+        # history is not reset: in a session it comes from the checkpoint.
+        # A session run that failed half way may have left tool messages behind, clear them too
+        return {
+            "input": query,
+            "output": None,
+            "messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES)] if mode == "tools" else [],
+            "sql": None,
+            "route": None
+        }
+
+    def end_session(self, session_id: str) -> None:
+        """Forget the history of a session on this database"""
+        self.sessions.delete_thread(self._run_config([], session_id)["configurable"]["thread_id"])
+
+    def _cache_lookup(self, query: str) -> Optional[str]:
+        if self.cache is None:
+            return None
+        try:
+            hit = self.cache.lookup(self.db_path, self.model_name, query, self.db_tools.execute_query)
+        except Exception:
+            return None
+        return hit["output"] if hit else None
+
+    def _cache_store(self, query: str, result: Dict) -> None:
+        output = result.get("output")
+        if self.cache is None or not output or result.get("route"):
+            return
+        if is_failed_output(output):
+            return
+        try:
+            self.cache.store(self.db_path, self.model_name, query, output, sql=result.get("sql"))
+        except Exception:
+            pass
+
+    def run(self, query: str, callbacks: Optional[List[BaseCallbackHandler]] = None,
+            tracer: Optional[TracingCallbackHandler] = None, mode: str = "react",
+            session_id: Optional[str] = None) -> Any:
+        """
+        Run Agent to process queries
+        mode is "react" (text-parsed ReAct) or "tools" (native tool calling)
+        session_id keeps a compacted history of earlier turns for follow-up questions
+        """
+        tracer = tracer or TracingCallbackHandler()
+        status = "error"
+        try:
+          workflow = self._workflow(mode, session_id)
+          config = self._run_config([*(callbacks or []), tracer], session_id)
+          state = workflow.get_state(config).values if session_id is not None else {}
+          # คำถามต่อเนื่องขึ้นกับบริบทก่อนหน้า ใช้ cache ที่ key ด้วยคำถามอย่างเดียวไม่ได้
+          follow_up = is_follow_up(query, state.get("history"))
+
+          cached = None if follow_up else self._cache_lookup(query)
+          if cached is not None:
+              status = "cached"
+              if session_id is not None:
+                  workflow.update_state(config, self._cached_turn(state, query, cached), as_node="remember")
+              return cached
+
+          # Run workflow
+          result = workflow.invoke(self._initial_state(query, mode), config=config)
+          if not follow_up:
+              self._cache_store(query, result)
+          status = self._status(result)
+          
+          # Get results
+          return result["output"]
+        except ValueError as e:
+            if "Could not parse LLM output" in str(e):
+                status = "parse_error"
+                return f"Error: The model response could not be parsed. Original query: {query}"
+            raise
+        except Exception as e:
+            return f"An error occurred: {str(e)}"
+        finally:
+            tracer.finish(status)
+
+    async def arun(self, query: str, callbacks: Optional[List[BaseCallbackHandler]] = None,
+                   tracer: Optional[TracingCallbackHandler] = None, mode: str = "react",
+                   session_id: Optional[str] = None) -> Any:
+        """
+        Run Agent to process queries without blocking the event loop
+        """
+        tracer = tracer or TracingCallbackHandler()
+        status = "error"
+        try:
+          workflow = self._workflow(mode, session_id)
+          config = self._run_config([*(callbacks or []), tracer], session_id)
+          state = (await workflow.aget_state(config)).values if session_id is not None else {}
+          follow_up = is_follow_up(query, state.get("history"))
+
+          cached = None if follow_up else await asyncio.to_thread(self._cache_lookup, query)
+          if cached is not None:
+              status = "cached"
+              if session_id is not None:
+                  await workflow.aupdate_state(config, self._cached_turn(state, query, cached), as_node="remember")
+              return cached
+
+          result = await workflow.ainvoke(self._initial_state(query, mode), config=config)
+          if not follow_up:
+              await asyncio.to_thread(self._cache_store, query, result)
+          status = self._status(result)
+          return result["output"]
+        except ValueError as e:
+            if "Could not parse LLM output" in str(e):
+                status = "parse_error"
+                return f"Error: The model response could not be parsed. Original query: {query}"
+            raise
+        except Exception as e:
+            return f"An error occurred: {str(e)}"
+        finally:
+            tracer.finish(status)
+
+    def _status(self, result: Dict) -> str:
+        if result.get("route"):
+            return "routed"
+        if str(result.get("output", "")).startswith("Agent stopped"):
+            return "iteration_limit"
+        return "ok"
+
+    async def astream(self, query: str, mode: str = "react",
+                      session_id: Optional[str] = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Run Agent and yield token, action, observation and final events as they happen
+        """
+        handler = QueryStreamHandler(tool_actions=mode == "tools")
+        task = asyncio.create_task(self.arun(query, callbacks=[handler], mode=mode, session_id=session_id))
+        task.add_done_callback(lambda _: handler.queue.put_nowait(None))
+
+        try:
+            while True:
+                event = await handler.queue.get()
+                if event is None:
+                    break
+                yield event
+
+            try:
+                yield {"event": "final", "data": {"output": str(task.result())}}
+            except Exception as e:
+                yield {"event": "error", "data": {"detail": str(e)}}
+        finally:
+            # Client went away before the run finished
+            if not task.done():
+                task.cancel()
+
+class QueryStreamHandler(AsyncCallbackHandler):
+    """
+    Per-request callback handler that collects streaming events into a queue
+    instead of printing them to stdout
+    """
+    def __init__(self, tool_actions: bool = False):
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # tool-calling mode has no agent actions, report tool starts instead
+        self.tool_actions = tool_actions
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.queue.put_nowait({"event": "token", "data": {"token": token}})
+
+    async def on_agent_action(self, action: AgentAction, **kwargs: Any) -> None:
+        self.queue.put_nowait({
+            "event": "action",
+            "data": {"tool": action.tool, "tool_input": str(action.tool_input), "log": action.log}
+        })
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        if self.tool_actions:
+            self.queue.put_nowait({
+                "event": "action",
+                "data": {"tool": (serialized or {}).get("name") or kwargs.get("name"), "tool_input": input_str, "log": ""}
+            })
+
+    async def on_tool_end(self, output: Any, **kwargs: Any) -> None:
+        # ToolNode ส่ง ToolMessage กลับมา ให้แสดงเฉพาะเนื้อหา
+        self.queue.put_nowait({"event": "observation", "data": {"output": str(getattr(output, "content", output))}})
+
+class AgentPool:
+    """
+    Process-wide pool of SQLiteAgent instances keyed by (db_path, model_name)
+    with LRU eviction once max_size is reached
+    """
+    def __init__(self, max_size: int = 8, **agent_kwargs: Any):
+        self.max_size = max_size
+        self.agent_kwargs = agent_kwargs
+        self._agents: "OrderedDict[Tuple[str, str], SQLiteAgent]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, db_path: str, model_name: str = "deepseek-r1:8b") -> "SQLiteAgent":
+        key = (db_path, model_name)
+        with self._lock:
+            agent = self._agents.get(key)
+            if agent is not None:
+                self._agents.move_to_end(key)
+                return agent
+
+        # Build outside the lock so one slow construction does not block other keys
+        agent = SQLiteAgent(db_path, model_name=model_name, **self.agent_kwargs)
+
+        with self._lock:
+            existing = self._agents.get(key)
+            if existing is not None:
+                self._agents.move_to_end(key)
+                return existing
+            self._agents[key] = agent
+            while len(self._agents) > self.max_size:
+                self._agents.popitem(last=False)
+            return agent
+
+    def clear(self) -> None:
+        with self._lock:
+            self._agents.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._agents)
+
+agent_pool = AgentPool(
+    max_size=int(os.environ.get("AGENT_POOL_SIZE", "8")),
+    inject_schema=os.environ.get("AGENT_INJECT_SCHEMA", "1") == "1",
+    cache=query_cache if os.environ.get("QUERY_CACHE", "1") == "1" else None,
+    fast_path=os.environ.get("AGENT_FAST_PATH", "1") == "1"
+)
+
+def get_agent(db_path: str, model_name: str = "deepseek-r1:8b") -> SQLiteAgent:
+    """Get a cached agent from the process-wide pool"""
+    return agent_pool.get(db_path, model_name)
+
+def warm_up(model_names: Sequence[str], base_url: Optional[str] = None, keep_alive: str = OLLAMA_KEEP_ALIVE,
+            prefix: Optional[str] = REACT_SYSTEM_PROMPT, timeout: float = 300.0) -> Dict[str, Any]:
+    """
+    Load each model into Ollama memory ahead of the first query, on base_url or
+    on every backend configured for the model. When prefix is given (the static
+    system prompt) it is evaluated too, so the first real request can reuse the
+    prompt cache. Returns {model: seconds of the slowest backend} or {model: "error: ..."}.
+    """
+    results: Dict[str, Any] = {}
+    for model in model_names:
+        timings, errors = [], []
+        for url in ([base_url] if base_url else backend_pool.urls(model)):
+            start = time.perf_counter()
+            try:
+                # prompt ว่าง = ให้ Ollama โหลด model อย่างเดียว
+                _ollama_post(url, "/api/generate", {"model": model, "prompt": "", "keep_alive": keep_alive}, timeout)
+                if prefix:
+                    _ollama_post(url, "/api/chat", {
+                        "model": model,
+                        "messages": [{"role": "system", "content": prefix}],
+                        "stream": False,
+                        "keep_alive": keep_alive,
+                        "options": {"num_predict": 1, "temperature": 0}
+                    }, timeout)
+                timings.append(time.perf_counter() - start)
+            except Exception as e:
+                errors.append(f"{url}: {e}")
+        results[model] = f"error: {'; '.join(errors)}" if errors else max(timings)
+    return results
+
+def _ollama_post(base_url: str, path: str, payload: Dict[str, Any], timeout: float) -> Dict[str, Any]:
+    request = urllib.request.Request(base_url.rstrip("/") + path, data=json.dumps(payload).encode(),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read() or b"{}")
+
+def plan_batch(items: List[Dict[str, Any]], default_db_path: str = "products.db",
+               default_model_name: str = "deepseek-r1:8b",
+               default_mode: str = "react") -> Tuple[List[Tuple[Any, ...]], Dict[Tuple[Any, ...], Tuple[Any, ...]]]:
+    """
+    Dedupe key per item, plus the run arguments (query, db_path, model_name, mode,
+    session_id) of each distinct key in first-seen order
+    """
+    keys = []
+    unique: Dict[Tuple[Any, ...], Tuple[Any, ...]] = {}
+    for index, item in enumerate(items):
+        db_path = item.get("db_path") or default_db_path
+        model_name = item.get("model_name") or default_model_name
+        mode = item.get("mode") or default_mode
+        session_id = item.get("session_id")
+        # คำถามซ้ำใน session ยังต้องรันทุกครั้ง บริบทของแต่ละรอบไม่เหมือนกัน
+        turn = (session_id, index) if session_id else None
+        key = (normalize_question(item["query"]), db_path, model_name, mode, turn)
+        keys.append(key)
+        unique.setdefault(key, (item["query"], db_path, model_name, mode, session_id))
+    return keys, unique
+
+async def run_batch(items: List[Dict[str, Any]], max_concurrency: int = 4,
+                    default_db_path: str = "products.db",
+                    default_model_name: str = "deepseek-r1:8b",
+                    default_mode: str = "react",
+                    slot: Optional[Callable[[], AsyncContextManager]] = None) -> List[Dict[str, Any]]:
+    """
+    Run many queries concurrently. Each item is {"query", "db_path"?, "model_name"?, "mode"?, "session_id"?}.
+    Identical questions (after normalization) run once; results come back in
+    input order as {"result", "error"}. Items of one session run one after another in input order.
+    slot, when given, is entered around every single agent run (the API passes its limiter).
+    """
+    semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+    session_locks: Dict[str, asyncio.Lock] = {}
+
+    async def run_one(query: str, db_path: str, model_name: str, mode: str,
+                      session_id: Optional[str]) -> Dict[str, Any]:
+        # Lock before the semaphore, so a waiting follow-up never holds a slot
+        async with (session_locks.setdefault(session_id, asyncio.Lock()) if session_id else nullcontext()):
+            async with semaphore:
+                try:
+                    async with (slot() if slot is not None else nullcontext()):
+                        agent = await asyncio.to_thread(get_agent, db_path, model_name)
+                        result = await agent.arun(query, mode=mode, session_id=session_id)
+                    return {"result": str(result), "error": None}
+                except Exception as e:
+                    return {"result": "", "error": str(e)}
+
+    keys, unique = plan_batch(items, default_db_path, default_model_name, default_mode)
+    results = await asyncio.gather(*[run_one(*args) for args in unique.values()])
+    by_key = dict(zip(unique.keys(), results))
+    return [dict(by_key[key]) for key in keys]
+
+def _read_batch_file(path: str) -> List[Dict[str, Any]]:
+    items = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            items.append({"query": item} if isinstance(item, str) else item)
+    return items
+
+async def serve(socket_path: str, default_db_path: str = "products.db",
+                default_model_name: str = "deepseek-r1:8b") -> None:
+    """
+    Keep warmed agents in this process and answer queries on a Unix socket.
+    Each connection sends one JSON line {"query", "db_path"?, "model_name"?, "mode"?, "session_id"?}
+    and gets the astream() events back as JSON lines.
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = json.loads(await reader.readline())
+            agent = await asyncio.to_thread(get_agent, request.get("db_path") or default_db_path,
+                                            request.get("model_name") or default_model_name)
+            async for event in agent.astream(request["query"], mode=request.get("mode") or "react",
+                                             session_id=request.get("session_id")):
+                writer.write((json.dumps(event, ensure_ascii=False, default=str) + "\n").encode())
+                await writer.drain()
+        except Exception as e:
+            writer.write((json.dumps({"event": "error", "data": {"detail": str(e)}}) + "\n").encode())
+        finally:
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+            writer.close()
+
+    if os.path.exists(socket_path):
+        try:
+            _, probe = await asyncio.open_unix_connection(socket_path)
+            probe.close()
+            raise RuntimeError(f"An agent daemon is already listening on {socket_path}")
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(socket_path)  # socket ค้างจาก daemon ที่ตายไปแล้ว
+
+    server = await asyncio.start_unix_server(handle, path=socket_path)
+    os.chmod(socket_path, 0o600)
+    # SIGTERM ให้ปิดแบบปกติ จะได้ลบ socket file ด้วย
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    try:
+        # สร้าง agent และโหลด model ไว้ก่อน request แรก
+        await asyncio.to_thread(get_agent, default_db_path, default_model_name)
+        await asyncio.to_thread(warm_up, [default_model_name])
+        print(f"Agent daemon listening on {socket_path}", flush=True)
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
@@ -0,0 +1,87 @@
+# test_cache.py
+import json
+import sqlite3
+
+import pytest
+
+from cache import STALE_NOTE, MemoryCacheBackend, QueryCache, SQLiteCacheBackend, normalize_question
+
+ANSWER = "There are 100 products in the table."
+SQL = "SELECT COUNT(*) FROM products"
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "products.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT)")
+    conn.executemany("INSERT INTO products (name) VALUES (?)", [(f"item {i}",) for i in range(100)])
+    conn.commit()
+    conn.close()
+    return path
+
+def _execute(db_path):
+    def execute(sql):
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute(sql).fetchall()
+        except sqlite3.Error as e:
+            return f"Error execute_query occurred: {e}"
+        finally:
+            conn.close()
+    return execute
+
+def _delete_one(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM products WHERE id = 1")
+    conn.commit()
+    conn.close()
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    backend = MemoryCacheBackend() if request.param == "memory" else SQLiteCacheBackend(str(tmp_path / "cache.db"))
+    return QueryCache(backend=backend)
+
+def test_normalize_question():
+    assert normalize_question("  How many   Products?? ") == "how many products"
+
+def test_miss_then_answer_hit(cache, db_path):
+    assert cache.lookup(db_path, "m", "how many products?", _execute(db_path)) is None
+    cache.store(db_path, "m", "how many products?", ANSWER, sql=SQL)
+    hit = cache.lookup(db_path, "m", "How many products", _execute(db_path))
+    assert hit == {"output": ANSWER, "level": "answer"}
+
+def test_changed_data_returns_fresh_rows_and_keeps_the_answer(cache, db_path):
+    cache.store(db_path, "m", "how many products?", ANSWER, sql=SQL)
+    _delete_one(db_path)
+
+    for _ in range(2):
+        hit = cache.lookup(db_path, "m", "how many products?", _execute(db_path))
+        assert hit["level"] == "sql"
+        assert json.loads(hit["output"]) == {"note": STALE_NOTE, "sql": SQL, "rows": [[99]]}
+    key = cache._key(db_path, "m", "how many products?")
+    assert cache.backend.get(key)["answer"] == ANSWER
+
+def test_changed_data_without_sql_is_a_miss(cache, db_path):
+    cache.store(db_path, "m", "how many products?", ANSWER)
+    _delete_one(db_path)
+    assert cache.lookup(db_path, "m", "how many products?", _execute(db_path)) is None
+    assert cache.stats()["misses"] == 1
+
+def test_failing_sql_drops_the_entry(cache, db_path):
+    cache.store(db_path, "m", "q", ANSWER, sql="SELECT nope FROM products")
+    _delete_one(db_path)
+    assert cache.lookup(db_path, "m", "q", _execute(db_path)) is None
+    assert cache.backend.get(cache._key(db_path, "m", "q")) is None
+
+def test_expired_entry_is_a_miss(db_path):
+    cache = QueryCache(ttl=-1)
+    cache.store(db_path, "m", "q", ANSWER, sql=SQL)
+    assert cache.lookup(db_path, "m", "q", _execute(db_path)) is None
+    assert cache.stats()["expirations"] == 1
+
+def test_lru_eviction(tmp_path):
+    for backend in (MemoryCacheBackend(max_entries=2), SQLiteCacheBackend(str(tmp_path / "c.db"), max_entries=2)):
+        for key in ("a", "b", "c"):
+            backend.set(key, {"answer": key, "sql": None, "version": "v", "created_at": 0.0})
+        assert len(backend) == 2
+        assert backend.get("a") is None
@@ -0,0 +1,45 @@
+# test_db.py
+import sqlite3
+
+import pytest
+
+from db import QueryGuard, materialize_rows
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, price REAL, category TEXT)")
+    conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?)",
+                     [(i, f"item {i}", float(i), f"cat {i % 5}") for i in range(1, 1001)])
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def guard():
+    # 1000 x 1000 rows is over the limit, a single scan of 1000 is not
+    return QueryGuard(max_join_rows=100_000)
+
+def test_cross_join_is_blocked(conn, guard):
+    report = guard.inspect(conn, "SELECT a.id, b.id FROM products a, products b")
+    assert report["blocked"].startswith("cartesian product products x products")
+
+def test_cross_join_with_limit_is_left_to_the_budget(conn, guard):
+    assert guard.inspect(conn, "SELECT a.id, b.id FROM products a, products b LIMIT 10")["blocked"] is None
+
+@pytest.mark.parametrize("query", [
+    "SELECT category, COUNT(*) FROM products GROUP BY category UNION ALL SELECT 'total', COUNT(*) FROM products",
+    "SELECT (SELECT COUNT(*) FROM products), name FROM products",
+    "SELECT name FROM products a WHERE price > (SELECT AVG(price) FROM products b WHERE b.name != a.name)",
+    "SELECT id FROM products WHERE id IN (SELECT id FROM products WHERE price > 10)",
+])
+def test_linear_queries_are_not_blocked(conn, guard, query):
+    assert guard.inspect(conn, query)["blocked"] is None
+
+def test_cross_join_inside_a_compound_arm_is_blocked(conn, guard):
+    query = "SELECT a.id FROM products a CROSS JOIN products b UNION ALL SELECT id FROM products"
+    assert guard.inspect(conn, query)["blocked"] is not None
+
+def test_small_results_carry_their_column_names(conn):
+    rows = materialize_rows(conn.execute("SELECT id, name AS label FROM products ORDER BY id LIMIT 2"))
+    assert rows == [(1, "item 1"), (2, "item 2")]
+    assert rows.columns == ["id", "label"]
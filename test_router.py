@@ -0,0 +1,88 @@
+# test_router.py
+import ast
+import sqlite3
+
+import pytest
+
+from router import FastPathRouter, router_stats
+
+class FakeTools:
+    """The two db_tools calls the router makes, on an in-memory products table"""
+    def __init__(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, price REAL, category TEXT, stock INTEGER)")
+        self.conn.executemany("INSERT INTO products (name, price, category, stock) VALUES (?, ?, ?, ?)", [
+            ("MacBook Air 13", 39900, "Laptops", 5),
+            ("ThinkPad X1", 59900, "Laptops", 3),
+            ("Budget Laptop", 19900, "Laptops", 9),
+            ("OLED TV 77", 289900, "TVs", 2),
+            ("LED TV 55", 29900, "TVs", 7),
+        ])
+
+    def get_table_schema(self, *args):
+        return {"products": ["id", "name", "price", "category", "stock"]}
+
+    def execute_query(self, query, params=()):
+        return self.conn.execute(query, params).fetchall()
+
+@pytest.fixture
+def router():
+    return FastPathRouter(FakeTools())
+
+@pytest.mark.parametrize("phrase, operator", [
+    ("under", "<"),
+    ("below", "<"),
+    ("less than", "<"),
+    ("cheaper than", "<"),
+    ("over", ">"),
+    ("above", ">"),
+    ("more than", ">"),
+    ("pricier than", ">"),
+    ("at most", "<="),
+    ("up to", "<="),
+    ("no more than", "<="),
+    ("not more than", "<="),
+    ("at least", ">="),
+    ("no less than", ">="),
+    ("not less than", ">="),
+])
+def test_price_phrase_operator(router, phrase, operator):
+    route = router.match(f"show laptops {phrase} 39900")
+    assert route["intent"] == "filter"
+    assert f"price {operator} ?" in route["sql"]
+    assert route["params"][:2] == ["Laptops", 39900.0]
+
+def test_at_most_includes_the_bound(router):
+    assert router.route("count laptops at most 39900")["output"] == "2"
+    assert router.route("count laptops under 39900")["output"] == "1"
+
+def test_at_least_includes_the_bound(router):
+    assert "OLED TV 77" in router.route("show tvs at least 289900")["output"]
+    assert router.route("show tvs over 289900")["output"] == "[]"
+
+def test_between_and_thousands(router):
+    route = router.match("how many products between 20k and 30,000")
+    assert route["intent"] == "filter_count"
+    assert route["params"] == [20000.0, 30000.0]
+
+def test_unknown_words_fall_through(router):
+    assert router.match("show laptops under 40000 with a good keyboard") is None
+
+def test_filter_past_max_rows_is_marked_truncated():
+    router = FastPathRouter(FakeTools(), max_rows=2)
+    output = ast.literal_eval(router.route("show laptops")["output"])
+    assert output["truncated"] is True
+    assert output["row_count"] == 3
+    assert [row[1] for row in output["preview"]] == ["Budget Laptop", "MacBook Air 13"]
+    assert "2 cheapest of 3" in output["note"]
+    assert ast.literal_eval(FastPathRouter(FakeTools(), max_rows=3).route("show laptops")["output"])[0][1] \
+        == "Budget Laptop"
+
+def test_router_stats_counts_since_a_baseline(router):
+    baseline = router_stats()["decisions"]
+    router.route("count laptops under 39900")
+    router.route("show laptops under 40000 with a good keyboard")
+    stats = router_stats(baseline)
+    assert stats["decisions"]["filter_count"] == 1
+    assert stats["decisions"]["fallthrough"] == 1
+    assert stats["hit_rate"] == 0.5
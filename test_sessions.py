@@ -0,0 +1,81 @@
+# test_sessions.py
+import asyncio
+import operator
+import sqlite3
+from typing import Annotated, List, TypedDict
+
+import pytest
+from langgraph.graph import END, StateGraph
+
+from sessions import SQLiteSessionSaver, compact_history, compact_turn, estimate_tokens
+
+class CounterState(TypedDict):
+    turns: Annotated[List[str], operator.add]
+
+def _graph(saver):
+    workflow = StateGraph(CounterState)
+    workflow.add_node("step", lambda state: {"turns": [f"turn {len(state['turns'])}"]})
+    workflow.set_entry_point("step")
+    workflow.add_edge("step", END)
+    return workflow.compile(checkpointer=saver)
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+@pytest.fixture
+def saver(tmp_path):
+    return SQLiteSessionSaver(str(tmp_path / "sessions.db"), max_sessions=2)
+
+def test_compact_turn_keeps_sql_and_clips_the_answer():
+    question, note = compact_turn("how many?", "x" * 1000, "SELECT COUNT(*) FROM products", max_tokens=40)
+    assert question.content == "how many?"
+    assert note.content.startswith("SQL: SELECT COUNT(*) FROM products\nAnswer: ")
+    assert note.content.endswith("...")
+    assert estimate_tokens(note.content) <= 40 + 3
+
+def test_compact_turn_without_sql():
+    assert compact_turn("hi", None, None, max_tokens=10)[1].content == "Answer: "
+
+def test_compact_history_drops_the_oldest_turns():
+    history = [message for i in range(5) for message in compact_turn(f"q{i}", "a" * 40, None, max_tokens=100)]
+    compacted = compact_history(history, max_tokens=30)
+    assert [message.content for message in compacted[::2]] == ["q3", "q4"]
+    assert sum(estimate_tokens(message.content) for message in compacted) <= 30
+    assert compact_history(history, max_tokens=0) == []
+
+def test_graph_round_trip_keeps_only_the_latest_checkpoint(saver):
+    app = _graph(saver)
+    app.invoke({"turns": []}, _config("a"))
+    app.invoke({"turns": []}, _config("a"))
+    assert app.get_state(_config("a")).values["turns"] == ["turn 0", "turn 1"]
+
+    assert len(list(saver.list(_config("a")))) == 1
+    conn = sqlite3.connect(saver.path)
+    assert conn.execute("SELECT COUNT(*) FROM session_checkpoints").fetchone()[0] == 1
+    conn.close()
+
+def test_async_round_trip(saver):
+    app = _graph(saver)
+
+    async def run():
+        await app.ainvoke({"turns": []}, _config("a"))
+        await app.ainvoke({"turns": []}, _config("a"))
+        return (await app.aget_state(_config("a"))).values["turns"]
+
+    assert asyncio.run(run()) == ["turn 0", "turn 1"]
+
+def test_least_recently_used_sessions_are_evicted(saver):
+    app = _graph(saver)
+    for thread_id in ("a", "b", "a", "c"):
+        app.invoke({"turns": []}, _config(thread_id))
+    assert saver.count() == 2
+    assert saver.get_tuple(_config("b")) is None
+    assert saver.get_tuple(_config("a")) is not None
+
+def test_delete_thread(saver):
+    app = _graph(saver)
+    app.invoke({"turns": []}, _config("a"))
+    saver.delete_thread("a")
+    assert saver.get_tuple(_config("a")) is None
+    assert app.get_state(_config("a")).values == {}
+    assert saver.count() == 0
@@ -0,0 +1,59 @@
+# test_setup.py
+import sqlite3
+
+import pytest
+
+from setup import (PRODUCT_INDEXES, SEARCH_TRIGGERS, STATS_TRIGGERS, bulk_load, check_stats, generate_products,
+                   iter_csv_products)
+
+def _write_csv(path, count, start_id, bad_at=None):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("id,name,price,category,stock,description\n")
+        for product_id in range(start_id, start_id + count):
+            price = "not a price" if product_id == bad_at else f"{product_id * 10}.0"
+            f.write(f"{product_id},Item {product_id},{price},Audio,{product_id % 7},wireless speaker\n")
+    return str(path)
+
+def _assert_consistent(db_path, count):
+    conn = sqlite3.connect(db_path)
+    try:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        assert names >= {*PRODUCT_INDEXES, *SEARCH_TRIGGERS, *STATS_TRIGGERS}
+        assert conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] == count
+        assert conn.execute("SELECT COUNT(*) FROM products_fts WHERE products_fts MATCH 'item'").fetchone()[0] \
+            == conn.execute("SELECT COUNT(*) FROM products WHERE name LIKE 'item%'").fetchone()[0]
+        assert check_stats(conn) == []
+    finally:
+        conn.close()
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "products.db")
+    bulk_load(generate_products(400), db_path=path, replace=True)
+    return path
+
+@pytest.mark.parametrize("count, batch_size", [(300, 100), (20, 5)])
+def test_failed_append_keeps_indexes_triggers_and_stats(db_path, tmp_path, count, batch_size):
+    """A large append drops and rebuilds the derived tables, a small one inserts through them"""
+    csv_path = _write_csv(tmp_path / "bad.csv", count, start_id=401, bad_at=401 + count // 2)
+    with pytest.raises(ValueError):
+        bulk_load(iter_csv_products(csv_path), db_path=db_path, batch_size=batch_size)
+    # whole batches before the bad row are kept
+    _assert_consistent(db_path, 400 + count // 2 // batch_size * batch_size)
+
+def test_failing_batch_is_rolled_back(db_path):
+    rows = [(401, "Item 401", 10.0, "Audio", 1, None), (402, None, 10.0, "Audio", 1, None)]
+    with pytest.raises(sqlite3.IntegrityError):
+        bulk_load(rows, db_path=db_path, batch_size=10)
+    _assert_consistent(db_path, 400)
+
+def test_small_append_keeps_wal_and_stays_consistent(db_path, tmp_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.close()
+    loaded, _ = bulk_load(iter_csv_products(_write_csv(tmp_path / "more.csv", 10, start_id=401)), db_path=db_path)
+    assert loaded == 10
+    _assert_consistent(db_path, 410)
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
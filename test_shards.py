@@ -0,0 +1,105 @@
+# test_shards.py
+import json
+import sqlite3
+
+import pytest
+
+from db import QueryGuard
+from shards import ShardedSQLiteTools, _partition_values, _plan, resolve_shards
+
+CATEGORIES = ["Cameras", "Laptops", "Phones", "TVs"]
+SCHEMA = "CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, price REAL, category TEXT, stock INTEGER)"
+
+def _rows():
+    return [(i, f"item {i}", float((i * 7919) % 3000 + i), CATEGORIES[i % 4], i % 13) for i in range(1, 201)]
+
+@pytest.fixture
+def dbs(tmp_path):
+    """The same products as one file and as two category shards with a manifest"""
+    single = sqlite3.connect(tmp_path / "single.db")
+    single.execute(SCHEMA)
+    single.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?)", _rows())
+    single.commit()
+
+    manifest = {"partition_key": "category", "shards": []}
+    for i, values in enumerate((CATEGORIES[:2], CATEGORIES[2:])):
+        conn = sqlite3.connect(tmp_path / f"shard_{i}.db")
+        conn.execute(SCHEMA)
+        conn.executemany("INSERT INTO products VALUES (?, ?, ?, ?, ?)", [r for r in _rows() if r[3] in values])
+        conn.commit()
+        conn.close()
+        manifest["shards"].append({"path": f"shard_{i}.db", "values": values})
+    (tmp_path / "catalog.json").write_text(json.dumps(manifest))
+
+    manifest_path = str(tmp_path / "catalog.json")
+    tools = ShardedSQLiteTools(manifest_path, resolve_shards(manifest_path), pool=None, guard=None, max_rows=500,
+                               max_bytes=10 ** 6)
+    yield single, tools
+    single.close()
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM products ORDER BY 3 DESC LIMIT 3",
+    "SELECT name, price FROM products ORDER BY 2 DESC, 1 LIMIT 5",
+    "SELECT name FROM products ORDER BY price DESC, id LIMIT 4 OFFSET 2",
+    "SELECT id FROM products ORDER BY stock DESC, id LIMIT 10",
+    "SELECT COUNT(*), SUM(stock), MIN(price), MAX(price) FROM products",
+    "SELECT category, COUNT(*), AVG(price) FROM products GROUP BY category",
+    "SELECT category, SUM(stock) AS s FROM products GROUP BY category ORDER BY s DESC",
+    "SELECT COUNT(*) FROM products WHERE category = 'laptops' COLLATE NOCASE",
+    "SELECT name FROM products WHERE category = 'tvs' COLLATE NOCASE ORDER BY id LIMIT 5",
+    "SELECT COUNT(*) FROM products WHERE category = 'Laptops'",
+    "SELECT COUNT(*) FROM products WHERE category = 'laptops'",
+    "SELECT name FROM products WHERE category = 'Nope'",
+    "SELECT COUNT(*), MAX(price) FROM products WHERE category IN ('Nope', 'Other')",
+    "SELECT DISTINCT category FROM products ORDER BY category",
+    "SELECT upper(category) AS c, count(*) FROM products GROUP BY c ORDER BY c",
+])
+def test_sharded_matches_single_file(dbs, query):
+    single, tools = dbs
+    assert tools.execute_query(query) == single.execute(query).fetchall()
+
+def test_aggregate_keeps_the_select_aliases(dbs):
+    query = "SELECT upper(category) AS c, count(*) AS n FROM products GROUP BY c ORDER BY n DESC, c"
+    single, tools = dbs
+    result = tools.execute_query(query)
+    assert result == single.execute(query).fetchall()
+    assert result.columns == ["c", "n"]
+
+@pytest.mark.parametrize("query, columns", [
+    ("SELECT id, name AS label FROM products WHERE stock = 0", ["id", "label"]),
+    ("SELECT id, price FROM products ORDER BY price DESC LIMIT 3", ["id", "price"]),
+])
+def test_rows_keep_their_column_names(dbs, query, columns):
+    single, tools = dbs
+    result = tools.execute_query(query)
+    assert sorted(result) == sorted(single.execute(query).fetchall())
+    assert result.columns == columns
+
+def test_unmappable_ordinal_is_not_split():
+    assert _plan("SELECT * FROM products ORDER BY 3 DESC LIMIT 3", []) is None
+    assert _plan("SELECT *, price FROM products ORDER BY 2", []) is None
+    plan = _plan("SELECT name, price FROM products ORDER BY 2 DESC LIMIT 3", [])
+    assert plan["shard_query"].startswith("SELECT name, price, price FROM products")
+
+def test_avg_is_split_into_sum_and_count():
+    plan = _plan("SELECT category, AVG(price) FROM products GROUP BY category", [])
+    assert plan["kind"] == "aggregate"
+    assert plan["shard_query"] == "SELECT category, SUM(price), COUNT(price) FROM products GROUP BY category"
+
+@pytest.mark.parametrize("query, params, values", [
+    ("SELECT * FROM products WHERE category = 'TVs'", [], ["TVs"]),
+    ("SELECT * FROM products WHERE category = ? AND price > 5", ["TVs"], ["TVs"]),
+    ("SELECT * FROM products WHERE category IN ('TVs', ?)", ["Phones"], ["TVs", "Phones"]),
+    ("SELECT * FROM products WHERE category = 'tvs' COLLATE NOCASE", [], None),
+    ("SELECT * FROM products WHERE category = 'TVs' OR price > 5", [], None),
+    ("SELECT * FROM products WHERE price > 5", [], None),
+])
+def test_partition_values(query, params, values):
+    assert _partition_values(query, params, "category") == values
+
+def test_allowed_full_scan_keeps_its_plan_warning(dbs):
+    _, tools = dbs
+    tools.guard = QueryGuard(large_table_rows=50)
+    result = tools.execute_query("SELECT COUNT(*) FROM products WHERE stock > 3")
+    assert result == [(sum(1 for row in _rows() if row[4] > 3),)]
+    assert [warning.split(" (")[0] for warning in result.warnings] == ["full scan of products"]
@@ -0,0 +1,93 @@
+# test_sql_agent.py
+import sqlite3
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from cache import MemoryCacheBackend, QueryCache
+from db import QueryGuard, tool_observation
+from metrics import TracingCallbackHandler
+from sessions import SQLiteSessionSaver, is_follow_up
+from sql_agent import SQLiteAgent, SQLiteTools, _answer_sql
+
+SQL = "SELECT COUNT(*) FROM products"
+
+@pytest.mark.parametrize("calls, expected", [
+    ([("execute_query", SQL, "[(100,)]")], SQL),
+    ([("get_schema", "", "{...}"), ("execute_query", SQL, "[(100,)]")], SQL),
+    ([("execute_query", "SELECT nope", "Error execute_query occurred: no such column"),
+      ("execute_query", SQL, "[(100,)]")], SQL),
+    # the last query may only have been a look around, the answer could come from either
+    ([("execute_query", "SELECT * FROM products LIMIT 3", "[...]"), ("execute_query", SQL, "[(100,)]")], None),
+    ([("search_products", "tv", "[...]"), ("execute_query", SQL, "[(100,)]")], None),
+    ([("execute_query", SQL, "Error query_too_expensive: {...}")], None),
+    ([], None),
+])
+def test_answer_sql(calls, expected):
+    assert _answer_sql(calls) == expected
+
+def test_last_sql_pairs_tool_calls_with_results():
+    messages = [
+        HumanMessage(content="how many products?"),
+        AIMessage(content="", tool_calls=[{"name": "execute_query", "args": {"query": SQL}, "id": "1"}]),
+        ToolMessage(content="[(100,)]", tool_call_id="1"),
+    ]
+    assert SQLiteAgent._last_sql(None, messages) == SQL
+
+REACT_STEPS = [
+    "Thought: I need to count the products\nAction: execute_query\nAction Input: SELECT COUNT(*) FROM products",
+    "Thought: I now know the final answer\nFinal Answer: There are 3 products.",
+]
+
+@pytest.fixture
+def session_agent(tmp_path):
+    db_path = str(tmp_path / "products.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE products (id INTEGER PRIMARY KEY, name TEXT, price REAL)")
+    conn.executemany("INSERT INTO products (name, price) VALUES (?, ?)", [("a", 1.0), ("b", 2.0), ("c", 3.0)])
+    conn.commit()
+    conn.close()
+    return SQLiteAgent(db_path, model_name="m", llm=FakeListChatModel(responses=REACT_STEPS),
+                       cache=QueryCache(backend=MemoryCacheBackend()),
+                       sessions=SQLiteSessionSaver(str(tmp_path / "sessions.db")))
+
+def test_allowed_full_scan_keeps_its_plan_warning(session_agent):
+    # products มี 3 แถว ตั้ง large_table_rows ต่ำ ๆ ให้ full scan มี warning แต่ไม่ถูก block
+    tools = SQLiteTools(session_agent.db_path, pool=None, guard=QueryGuard(large_table_rows=2))
+    rows = tools.execute_query("SELECT name FROM products WHERE price > 1 ORDER BY id")
+    assert rows == [("b",), ("c",)]
+    assert rows.warnings == ["full scan of products (~3 rows)"]
+    assert tool_observation(rows) == {"columns": ["name"], "rows": [("b",), ("c",)], "warnings": rows.warnings}
+
+    lookup = tools.execute_query("SELECT name FROM products WHERE id = 1")
+    assert lookup.warnings == [] and tool_observation(lookup) is lookup
+
+    tools.max_rows = 1
+    assert tools.execute_query("SELECT name FROM products")["warnings"] == ["full scan of products (~3 rows)"]
+
+def _status(agent, question, session_id=None):
+    tracer = TracingCallbackHandler()
+    agent.run(question, tracer=tracer, session_id=session_id)
+    return tracer.trace()["status"]
+
+def test_unrelated_question_in_a_session_hits_the_cache(session_agent):
+    assert _status(session_agent, "how many products are there") == "ok"
+    assert _status(session_agent, "count the products", session_id="s") == "ok"
+    assert _status(session_agent, "how many products are there", session_id="s") == "cached"
+
+def test_follow_up_question_skips_the_cache(session_agent):
+    assert _status(session_agent, "what about their prices") == "ok"
+    assert _status(session_agent, "count the products", session_id="s") == "ok"
+    assert _status(session_agent, "what about their prices", session_id="s") == "ok"
+
+@pytest.mark.parametrize("question, follow_up", [
+    ("what about laptops", True),
+    ("and their prices?", True),
+    ("show those sorted by price", True),
+    ("how many products are there", False),
+    ("list laptops that cost more than 30000", False),
+])
+def test_is_follow_up(question, follow_up):
+    assert is_follow_up(question, ["earlier turn"]) is follow_up
+    assert is_follow_up(question, []) is False